@@ -0,0 +1,161 @@
+import argparse
+import copy
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from compact_dtypes import read_transactions
+from feature_engineering_v2_1 import V2_1_CATEGORICALS, V2_1_INPUT_COLUMNS
+from model_artifact import V3_1_PARAMS
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
+from tune_rf import share_arrays
+
+PRICE_CAP = 1000000
+
+
+def make_folds(n_periods, train_periods=4, test_periods=1, expanding=False, min_train_periods=None):
+    """
+    Walk-forward folds over period indices 0..n_periods-1, as (train_start, train_end, test_end) half-open bounds.
+    Rolling: the train window is the train_periods periods right before the test block.
+    Expanding: the train window always starts at period 0 (at least min_train_periods long).
+    """
+    min_train_periods = min_train_periods or train_periods
+    folds = []
+    for train_end in range(min_train_periods, n_periods - test_periods + 1):
+        train_start = 0 if expanding else train_end - train_periods
+        folds.append((train_start, train_end, train_end + test_periods))
+    return folds
+
+
+def _window_encoder(template, cum_sums, cum_counts, start, end):
+    # Target encoder for periods [start, end) from the cumulative aggregates: two subtractions, no re-grouping
+    encoder = copy.copy(template)
+    encoder.sums = cum_sums[end] - cum_sums[start]
+    encoder.counts = cum_counts[end] - cum_counts[start]
+    encoder.global_sum = float(encoder.sums.sum())
+    encoder.global_count = int(encoder.counts.sum())
+    return encoder
+
+
+def run_fold(paths, template, fold, n_jobs=1):
+    """Worker: fit the V3.1 forest on one fold's train periods and score its test periods."""
+    train_start, train_end, test_end = fold
+    period = np.load(paths['period'], mmap_mode='r')
+    key_codes = np.load(paths['key_codes'], mmap_mode='r')
+    onehot = np.load(paths['onehot'], mmap_mode='r')
+    price = np.load(paths['price'], mmap_mode='r')
+    cum_sums = np.load(paths['cum_sums'], mmap_mode='r')
+    cum_counts = np.load(paths['cum_counts'], mmap_mode='r')
+
+    # 1. Leakage-free Area_Type_Avg: aggregates come from the train periods only
+    encoder = _window_encoder(template, cum_sums, cum_counts, train_start, train_end)
+    means = encoder.encoded_means()
+    area_type_avg = np.where(key_codes >= 0, means[np.maximum(key_codes, 0)], encoder.global_mean)
+
+    train_rows = np.flatnonzero((period >= train_start) & (period < train_end))
+    test_rows = np.flatnonzero((period >= train_end) & (period < test_end))
+
+    def matrix(rows):
+        return np.hstack([area_type_avg[rows].astype(np.float32)[:, None], onehot[rows]])
+
+    # 2. Train on log prices, evaluate in GBP
+    start = time.perf_counter()
+    model = RandomForestRegressor(**dict(V3_1_PARAMS, n_jobs=n_jobs))
+    model.fit(matrix(train_rows), np.log1p(price[train_rows]))
+    predictions_real = np.expm1(model.predict(matrix(test_rows)))
+    elapsed = time.perf_counter() - start
+
+    return {'train_start': train_start, 'train_end': train_end, 'test_end': test_end, 'n_train': len(train_rows),
+        'n_test': len(test_rows), 'mae': mean_absolute_error(price[test_rows], predictions_real),
+        'r2': r2_score(price[test_rows], predictions_real), 'fit_s': round(elapsed, 2)}
+
+
+def backtest(input_files, freq='Q', train_periods=4, test_periods=1, expanding=False, max_workers=None,
+        results_path='backtest_results.csv'):
+    """
+    Walk-forward backtest of the V3.1 recipe over a multi-year transaction store:
+    - Folds are monthly (freq='M') or quarterly ('Q'), rolling or expanding
+    - Per-period (area, type) sums/counts are computed once; each fold's target encoding is a difference
+      of cumulative aggregates over its train periods, so test periods never leak into it
+    - Folds run in parallel worker processes that share the encoded data through memory-mapped .npy files
+    """
+    # 1. Load the store once (mainstream market only, like model_v3_1)
+    usecols = ['Price', 'Date'] + V2_1_INPUT_COLUMNS
+    df = pd.concat([read_transactions(f, usecols) for f in input_files], ignore_index=True)
+    df = df[df['Price'] <= PRICE_CAP].copy()
+    df['Postcode_Area'] = postcode_area(df['Postcode'])
+    periods = pd.PeriodIndex(df['Date'], freq=freq)
+    period_labels = sorted(periods.unique())
+    period_codes = pd.Categorical(periods, categories=period_labels).codes.astype(np.int64)
+
+    # 2. Encode once: key codes, one-hot block and per-period aggregates with their prefix sums
+    template = TargetEncoder(['Postcode_Area', 'Type']).fit(df)
+    key_codes = template.encode_keys(df)
+    n_keys = len(template.counts)
+    seen = key_codes >= 0
+    flat = period_codes[seen] * n_keys + key_codes[seen]
+    shape = (len(period_labels), n_keys)
+    period_sums = np.bincount(flat, weights=df['Price'].to_numpy(np.float64)[seen], minlength=np.prod(shape))
+    period_counts = np.bincount(flat, minlength=np.prod(shape))
+    zeros = np.zeros((1, n_keys))
+    cum_sums = np.vstack([zeros, np.cumsum(period_sums.reshape(shape), axis=0)])
+    cum_counts = np.vstack([zeros, np.cumsum(period_counts.reshape(shape), axis=0)]).astype(np.int64)
+
+    onehot = SparseOneHotEncoder(V2_1_CATEGORICALS).fit(df).transform(df, dtype=np.uint8).toarray()
+    arrays = {'period': period_codes, 'key_codes': key_codes, 'onehot': onehot,
+        'price': df['Price'].to_numpy(np.float64), 'cum_sums': cum_sums, 'cum_counts': cum_counts}
+    del df, onehot
+
+    folds = make_folds(len(period_labels), train_periods, test_periods, expanding)
+    if not folds:
+        raise ValueError(f"Only {len(period_labels)} {freq} period(s) in the data; not enough for one fold")
+    max_workers = max_workers or os.cpu_count()
+    print(f"Backtesting {len(folds)} fold(s) over {len(period_labels)} periods with {max_workers} worker(s)...")
+
+    # 3. Run the folds in parallel against the shared memory-mapped arrays
+    start = time.perf_counter()
+    with tempfile.TemporaryDirectory(prefix='backtest_') as shared_dir:
+        paths = share_arrays(arrays, shared_dir)
+        del arrays
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+            results = list(pool.map(run_fold, [paths] * len(folds), [template] * len(folds), folds))
+
+    results = pd.DataFrame(results)
+    results.insert(0, 'train_from', [str(period_labels[s]) for s in results['train_start']])
+    results.insert(1, 'train_to', [str(period_labels[e - 1]) for e in results['train_end']])
+    results.insert(2, 'test_from', [str(period_labels[e]) for e in results['train_end']])
+    results.insert(3, 'test_to', [str(period_labels[e - 1]) for e in results['test_end']])
+    results = results.drop(columns=['train_start', 'train_end', 'test_end'])
+    results.to_csv(results_path, index=False)
+
+    print(results[['train_from', 'train_to', 'test_from', 'test_to', 'n_train', 'n_test', 'mae', 'r2']].to_string(
+        index=False))
+    print("-" * 30)
+    print(f"MAE £{results['mae'].mean():.2f} ± {results['mae'].std():.2f}, R2 {results['r2'].mean():.4f} ± "
+        f"{results['r2'].std():.4f} across folds ({time.perf_counter() - start:.1f}s); saved to {results_path}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Walk-forward backtest of the V3.1 recipe with parallel folds.')
+    parser.add_argument('inputs', nargs='+', help='Filtered transaction CSVs, e.g. ppd_partitions/BIRMINGHAM/*.csv')
+    parser.add_argument('--freq', choices=['M', 'Q'], default='Q')
+    parser.add_argument('--train-periods', type=int, default=4)
+    parser.add_argument('--test-periods', type=int, default=1)
+    parser.add_argument('--expanding', action='store_true', help='Expanding instead of rolling train window')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--results', default='backtest_results.csv')
+    args = parser.parse_args()
+
+    backtest(args.inputs, args.freq, args.train_periods, args.test_periods, args.expanding, args.workers,
+        args.results)
\ No newline at end of file
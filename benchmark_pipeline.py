@@ -0,0 +1,201 @@
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+import sklearn
+from sklearn.ensemble import RandomForestRegressor
+
+from feature_engineering_v2_1 import clean_and_feature_engineering_v2_1
+from feature_store import load_aligned_matrices, save_features
+from filter_bham import PPD_COLUMNS, process_local_csv
+from instrumentation import peak_rss_mb
+from model_artifact import V3_1_PARAMS
+
+DEFAULT_SIZES = [100000, 1000000, 10000000]
+
+# Synthetic market: outward codes with a price level, property types with a multiplier
+SYNTHETIC_AREAS = {f"B{i}": 140000 + 9000 * (i % 17) for i in range(1, 77)}
+SYNTHETIC_TYPES = {'D': 1.9, 'S': 1.25, 'T': 1.0, 'F': 0.7, 'O': 1.1}
+OTHER_DISTRICTS = ['COVENTRY', 'WOLVERHAMPTON', 'SANDWELL', 'DUDLEY', 'WALSALL', 'SOLIHULL']
+
+
+def make_synthetic_ppd(path, n_rows, years=(2024, 2025), bham_share=0.3, seed=0, chunk_rows=1000000):
+    """
+    Write a headerless, PPD-shaped national file (same 16 columns as the Land Registry download).
+    Prices follow area level x type multiplier x lognormal noise, so the models have real signal to learn.
+    Generated in chunks, so 10M-row files never sit in memory.
+    """
+    rng = np.random.default_rng(seed)
+    areas = np.array(list(SYNTHETIC_AREAS))
+    area_levels = np.array(list(SYNTHETIC_AREAS.values()), dtype=np.float64)
+    types = np.array(list(SYNTHETIC_TYPES))
+    type_mult = np.array(list(SYNTHETIC_TYPES.values()))
+
+    written = 0
+    with open(path, 'w') as f:
+        while written < n_rows:
+            n = min(chunk_rows, n_rows - written)
+            a = rng.integers(0, len(areas), n)
+            t = rng.integers(0, len(types), n)
+            old_new = np.where(rng.random(n) < 0.1, 'Y', 'N')
+            duration = np.where(types[t] == 'F', 'L', np.where(rng.random(n) < 0.1, 'L', 'F'))
+            price = area_levels[a] * type_mult[t] * np.where(old_new == 'Y', 1.15, 1.0) * rng.lognormal(0, 0.35, n)
+            price[rng.random(n) < 0.002] *= 40  # A few luxury/commercial outliers, like the real file
+
+            year = rng.choice(np.asarray(years), n)
+            month = rng.integers(1, 13, n)
+            day = rng.integers(1, 29, n)
+            dates = pd.Series(year.astype(str)) + '-' + pd.Series(month).map('{:02d}'.format) + '-' + \
+                pd.Series(day).map('{:02d}'.format) + ' 00:00'
+            district = np.where(rng.random(n) < bham_share, 'BIRMINGHAM', rng.choice(OTHER_DISTRICTS, n))
+            inward = pd.Series(rng.integers(1, 10, n).astype(str)) + pd.Series(rng.choice(list('ABDEFGHJLNPQRSTUWXYZ'),
+                n)) + pd.Series(rng.choice(list('ABDEFGHJLNPQRSTUWXYZ'), n))
+
+            chunk = pd.DataFrame({'ID': [f"{{{written + i:08X}-0000-0000-0000-000000000000}}" for i in range(n)],
+                'Price': price.astype(np.int64), 'Date': dates, 'Postcode': pd.Series(areas[a]) + ' ' + inward,
+                'Type': types[t], 'Old_New': old_new, 'Duration': duration, 'PAON': rng.integers(1, 300, n),
+                'SAON': '', 'Street': 'HIGH STREET', 'Locality': '', 'City': district, 'District': district,
+                'County': 'WEST MIDLANDS', 'PPD_Category': 'A', 'Record_Status': 'A'}, columns=PPD_COLUMNS)
+            chunk.to_csv(f, header=False, index=False)
+            written += n
+    return path
+
+
+# ---------------------------------------------------------
+# Stages: each runs in a fresh process so peak RSS is per stage.
+# Each returns (rows it read, seconds), so rows/sec is throughput over the stage's input.
+# ---------------------------------------------------------
+def stage_ingest(workdir):
+    # process_local_csv reads uk_2025.csv and writes birmingham_prices_real_2025.csv in the working directory
+    os.chdir(workdir)
+    start = time.perf_counter()
+    rows_read = process_local_csv()
+    elapsed = time.perf_counter() - start
+    return rows_read, elapsed
+
+
+def stage_features(workdir):
+    os.chdir(workdir)
+    # Split the ingested district file into the 2024 train / 2025 test inputs the V2.1 script expects
+    bham = pd.read_csv('birmingham_prices_real_2025.csv')
+    rows_read = len(bham)
+    year = bham['Date'].str[:4]
+    bham[year == '2024'].to_csv('birmingham_prices_real_2024_train.csv', index=False)
+    bham[year == '2025'].to_csv('birmingham_prices_real_2025_test.csv', index=False)
+    del bham
+
+    start = time.perf_counter()
+    train_df, test_df = clean_and_feature_engineering_v2_1('birmingham_prices_real_2024_train.csv',
+        'birmingham_prices_real_2025_test.csv')
+    elapsed = time.perf_counter() - start
+    save_features(train_df, 'train_features_v2_1.parquet', feature_set='v2_1')
+    save_features(test_df, 'test_features_v2_1.parquet', feature_set='v2_1')
+    return rows_read, elapsed
+
+
+def stage_fit(workdir, n_jobs):
+    os.chdir(workdir)
+    X_train, y_train, _, _, _ = load_aligned_matrices('train_features_v2_1.parquet', 'test_features_v2_1.parquet')
+    y_train_log = np.log1p(y_train)
+
+    start = time.perf_counter()
+    model = RandomForestRegressor(**dict(V3_1_PARAMS, n_jobs=n_jobs))
+    model.fit(X_train, y_train_log)
+    elapsed = time.perf_counter() - start
+    joblib.dump(model, 'bench_model.joblib')
+    return len(X_train), elapsed
+
+
+def stage_predict(workdir, n_jobs):
+    os.chdir(workdir)
+    _, _, X_test, _, _ = load_aligned_matrices('train_features_v2_1.parquet', 'test_features_v2_1.parquet')
+    model = joblib.load('bench_model.joblib')
+    model.set_params(n_jobs=n_jobs)
+
+    start = time.perf_counter()
+    np.expm1(model.predict(X_test))
+    elapsed = time.perf_counter() - start
+    return len(X_test), elapsed
+
+
+def _run_stage(name, workdir, n_jobs):
+    # Worker entry point: returns (rows, timed seconds, peak RSS of this process)
+    if name == 'ingest':
+        rows, elapsed = stage_ingest(workdir)
+    elif name == 'features':
+        rows, elapsed = stage_features(workdir)
+    elif name == 'fit':
+        rows, elapsed = stage_fit(workdir, n_jobs)
+    else:
+        rows, elapsed = stage_predict(workdir, n_jobs)
+    return rows, elapsed, peak_rss_mb()
+
+
+def git_revision():
+    repo = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=repo, capture_output=True, text=True,
+            check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=repo,
+            capture_output=True, text=True).stdout.strip())
+        return commit, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+
+
+def run_benchmarks(sizes, bench_dir='bench_data', results_path='benchmark_results.jsonl', n_jobs=None, seed=0):
+    """
+    Offline end-to-end benchmark:
+    - Generates (once, then reuses) a synthetic national PPD file per size
+    - Times process_local_csv, clean_and_feature_engineering_v2_1, forest fit and predict,
+      each in its own process so peak RSS is attributed to that stage
+    - Appends one JSON line per (size, stage) to results_path, tagged with the git commit
+    """
+    commit, dirty = git_revision()
+    run_info = {'commit': commit, 'dirty': dirty, 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(), 'pandas': pd.__version__, 'sklearn': sklearn.__version__,
+        'cpus': os.cpu_count(), 'n_jobs': n_jobs}
+    context = multiprocessing.get_context('spawn')
+
+    for size in sizes:
+        workdir = os.path.abspath(os.path.join(bench_dir, f"ppd_{size}"))
+        os.makedirs(workdir, exist_ok=True)
+        input_file = os.path.join(workdir, 'uk_2025.csv')
+        if not os.path.exists(input_file):
+            print(f"Generating synthetic PPD file with {size:,} rows...")
+            make_synthetic_ppd(input_file, size, seed=seed)
+
+        for stage in ['ingest', 'features', 'fit', 'predict']:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                rows, elapsed, peak_rss = pool.submit(_run_stage, stage, workdir, n_jobs).result()
+
+            result = dict(run_info, size=size, stage=stage, rows=rows, wall_s=round(elapsed, 3),
+                rows_per_sec=round(rows / max(elapsed, 1e-9)),
+                peak_rss_mb=round(peak_rss, 1) if peak_rss is not None else None)
+            with open(results_path, 'a') as f:
+                f.write(json.dumps(result) + '\n')
+            rss = f"{peak_rss:8.1f} MB" if peak_rss is not None else 'n/a'
+            print(f"[{size:>10,}] {stage:<9} {elapsed:8.2f}s {result['rows_per_sec']:>12,} rows/sec peak RSS {rss}")
+
+    print("-" * 30)
+    print(f"Results appended to {results_path}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='End-to-end pipeline benchmark on synthetic PPD-shaped data.')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES)
+    parser.add_argument('--bench-dir', default='bench_data')
+    parser.add_argument('--results', default='benchmark_results.jsonl')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    run_benchmarks(args.sizes, args.bench_dir, os.path.abspath(args.results), args.n_jobs, args.seed)
\ No newline at end of file
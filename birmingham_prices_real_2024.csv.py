@@ -1,10 +1,6 @@
 import pandas as pd
-import matplotlib.pyplot as plt
-import seaborn as sns
-
-# 1. Load data
-df = pd.read_csv('birmingham_prices_real_2024.csv')
-df['Postcode_Area'] = df['Postcode'].apply(lambda x: str(x).split(' ')[0])
+from price_cube import load_or_build_cube
+from render_reports import render_reports
 
 # Comprehensive district mapping
 district_names = {
@@ -17,56 +13,38 @@ district_names = {
     'B74': 'Sutton Coldfield', 'B75': 'Sutton Coldfield', 'B76': 'Sutton Coldfield'
 }
 
-df['District_Label'] = df['Postcode_Area'].apply(
-    lambda x: f"{x} ({district_names.get(x, 'Other')})"
-)
-
-# Remove 'Other' to focus on identified Birmingham residential areas
-df = df[df['District_Label'].str.contains('Other') == False]
 
-# 2. Calculate Stats
-# Raw stats
-raw_stats = df.groupby('District_Label')['Price'].mean().reset_index()
-raw_stats['Data_Type'] = 'Raw Data (Incl. Outliers)'
+def district_label(area):
+    return f"{area} ({district_names[area]})"
 
-# Filtered stats (<= £1M)
-filtered_df = df[df['Price'] <= 1000000].copy()
-filtered_stats = filtered_df.groupby('District_Label')['Price'].mean().reset_index()
-filtered_stats['Data_Type'] = 'Filtered Data (Mainstream <= £1M)'
 
-# 3. CRITICAL: Sort by Filtered Price Descending
-# We create a sorting order based on the filtered results
-sort_order = filtered_stats.sort_values(by='Price', ascending=False)['District_Label'].tolist()
+if __name__ == "__main__":
+    # 1. Load the precomputed price cube (built in one pass, rebuilt only when the CSV changes)
+    cube = load_or_build_cube(['birmingham_prices_real_2024.csv'], 'price_cube_2024.npz')
 
-# Combine for plotting
-comparison_df = pd.concat([raw_stats, filtered_stats])
+    # 2. Calculate Stats straight from the cube, restricted to the identified Birmingham residential areas
+    # Raw stats
+    raw_stats = cube.query('Postcode_Area', ['mean'], Postcode_Area=list(district_names))
+    raw_stats['Data_Type'] = 'Raw Data (Incl. Outliers)'
 
-# 4. Visualization
-plt.figure(figsize=(14, 12))
-sns.set_style("whitegrid")
+    # Filtered stats (<= £1M)
+    filtered_stats = cube.query('Postcode_Area', ['mean'], price_cap=1000000,
+        Postcode_Area=list(district_names))
+    filtered_stats['Data_Type'] = 'Filtered Data (Mainstream <= £1M)'
 
-# Use 'order' parameter to ensure sorting by Filtered Price
-plot = sns.barplot(
-    x='Price',
-    y='District_Label',
-    hue='Data_Type',
-    data=comparison_df,
-    order=sort_order,
-    palette=['#34495e', '#e67e22'] # Dark Blue vs Orange
-)
+    for stats in (raw_stats, filtered_stats):
+        stats['District_Label'] = stats['Postcode_Area'].map(district_label)
+        stats.rename(columns={'mean': 'Price'}, inplace=True)
 
-plt.title('Birmingham Market Value Ranking: Raw vs Filtered Comparison', fontsize=18, fontweight='bold')
-plt.xlabel('Average Transaction Price (£)', fontsize=14)
-plt.ylabel('District (Sorted by Filtered Market Price)', fontsize=14)
-plt.legend(title='Price Calculation', loc='lower right')
+    # 3. CRITICAL: Sort by Filtered Price Descending
+    # We create a sorting order based on the filtered results
+    sort_order = filtered_stats.sort_values(by='Price', ascending=False)['District_Label'].tolist()
 
-# Add values on bars
-for p in plot.patches:
-    width = p.get_width()
-    if width > 0:
-        plt.text(width + 10000, p.get_y() + p.get_height()/2,
-                 f'£{int(width):,}', va="center", fontsize=9, fontweight='bold')
+    # Combine for plotting
+    comparison_df = pd.concat([raw_stats, filtered_stats])
 
-plt.tight_layout()
-plt.savefig('market_comparison_final.png')
-plt.show()
\ No newline at end of file
+    # 4. Visualization (rendered headless, no window)
+    render_reports([
+        ('market_comparison', {'output_path': 'market_comparison_final.png', 'comparison_df': comparison_df,
+            'sort_order': sort_order, 'title': 'Birmingham Market Value Ranking: Raw vs Filtered Comparison'}),
+    ])
@@ -0,0 +1,154 @@
+import argparse
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from filter_bham import PPD_COLUMNS, PPD_DTYPES
+from instrumentation import peak_rss_mb
+
+# Compact in-memory representation of PPD transactions:
+# repeated text columns are categoricals and Date is parsed once to datetime64.
+# Price is read as int64 and narrowed to int32 after a range check (read_csv would wrap an int32 overflow silently)
+COMPACT_DTYPES = dict(PPD_DTYPES, Postcode='category', Street='category', Locality='category', City='category',
+    County='category', Price='int64')
+INT32_MAX = np.iinfo(np.int32).max
+
+# PPD dates look like '2024-01-05 00:00'
+PPD_DATE_FORMAT = '%Y-%m-%d %H:%M'
+
+
+def compact_transactions(df):
+    """In place: int32 Price (raises if a price does not fit) and datetime64 Date."""
+    if 'Price' in df.columns:
+        prices = df['Price']
+        if len(prices) and (prices.max() > INT32_MAX or prices.min() < 0):
+            raise ValueError(f"Price outside the int32 range ({prices.min()}..{prices.max()})")
+        df['Price'] = prices.astype(np.int32)
+    if 'Date' in df.columns and not pd.api.types.is_datetime64_any_dtype(df['Date']):
+        try:
+            df['Date'] = pd.to_datetime(df['Date'], format=PPD_DATE_FORMAT)
+        except ValueError:
+            df['Date'] = pd.to_datetime(df['Date'])
+    return df
+
+
+def read_transactions(path, columns=None, header=True, **kwargs):
+    """
+    Typed PPD loader used by the feature scripts:
+    - Reads only `columns` (all columns if None), with declared dtypes, so nothing is loaded as object first
+    - header=True for filtered/partition CSVs, header=False for the national headerless files
+    Extra keyword arguments go to pd.read_csv (e.g. chunksize).
+    """
+    names = None if header else PPD_COLUMNS
+    if columns is None:
+        columns = list(pd.read_csv(path, nrows=0).columns) if header else PPD_COLUMNS
+    dtypes = {c: COMPACT_DTYPES[c] for c in columns if c in COMPACT_DTYPES}
+
+    result = pd.read_csv(path, names=names, usecols=columns, dtype=dtypes, **kwargs)
+    if kwargs.get('chunksize'):
+        return (compact_transactions(chunk) for chunk in result)
+    return compact_transactions(result)
+
+
+def add_month(df):
+    """Month of the sale as int8 (1..12)."""
+    df['Month'] = df['Date'].dt.month.astype(np.int8)
+    return df
+
+
+def frame_memory_mb(df):
+    return df.memory_usage(deep=True).sum() / (1024 * 1024)
+
+
+# ---------------------------------------------------------
+# Peak-memory report: previous representation vs compact one
+# ---------------------------------------------------------
+def _run_representation(mode, train_path, test_path, header, n_estimators):
+    # Worker: load -> V2.1 features -> fit (-> predict) in a fresh process, so peak RSS belongs to this run only
+    from sklearn.ensemble import RandomForestRegressor
+
+    from feature_engineering_v2_1 import V2_1_CATEGORICALS, V2_1_INPUT_COLUMNS, build_dense_matrix_v2_1
+    from onehot_encoder import SparseOneHotEncoder
+    from postcode_utils import postcode_area
+    from target_encoding import TargetEncoder
+
+    baseline = peak_rss_mb()
+    paths = [p for p in (train_path, test_path) if p]
+    if mode == 'previous':
+        # Every column as object strings / int64, dummies as a bool frame, sklearn converts to float32 itself
+        frames = [pd.read_csv(p, names=None if header else PPD_COLUMNS) for p in paths]
+    else:
+        frames = [read_transactions(p, ['Price'] + V2_1_INPUT_COLUMNS, header) for p in paths]
+    loaded_mb = sum(frame_memory_mb(f) for f in frames)
+
+    frames = [f[f['Price'] <= 1000000].copy() for f in frames]
+    for f in frames:
+        f['Postcode_Area'] = postcode_area(f['Postcode'])
+    encoder = TargetEncoder(['Postcode_Area', 'Type']).fit(frames[0])
+    onehot = SparseOneHotEncoder(V2_1_CATEGORICALS).fit(frames[0])
+
+    if mode == 'previous':
+        matrices = []
+        for f in frames:
+            f['Area_Type_Avg'] = encoder.transform(f)
+            matrices.append(onehot.encode(f[['Area_Type_Avg'] + V2_1_CATEGORICALS]))
+    else:
+        matrices = [build_dense_matrix_v2_1(f, encoder, onehot) for f in frames]
+
+    model = RandomForestRegressor(n_estimators=n_estimators, max_depth=10, min_samples_leaf=15, random_state=42)
+    model.fit(matrices[0], np.log1p(frames[0]['Price'].to_numpy(np.float64)))
+    if len(matrices) > 1:
+        model.predict(matrices[1])
+
+    return {'rows': sum(len(f) for f in frames), 'loaded_frame_mb': round(loaded_mb, 1),
+        'peak_rss_mb': round(peak_rss_mb(), 1), 'working_set_mb': round(peak_rss_mb() - baseline, 1)}
+
+
+def memory_report(datasets, n_estimators=10):
+    """
+    Peak RSS of load -> V2.1 features -> forest fit, previous vs compact representation.
+    datasets: list of (label, train_path, test_path or None, header).
+    Each run gets its own spawned process; working_set_mb is peak RSS above the post-import baseline.
+    """
+    if peak_rss_mb() is None:
+        raise RuntimeError("Peak RSS is not available on this platform (no resource module)")
+    rows = []
+    context = multiprocessing.get_context('spawn')
+    for label, train_path, test_path, header in datasets:
+        result = {}
+        for mode in ('previous', 'compact'):
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                result[mode] = pool.submit(_run_representation, mode, train_path, test_path, header,
+                    n_estimators).result()
+        previous, compact = result['previous'], result['compact']
+        reduction = 1 - compact['working_set_mb'] / max(previous['working_set_mb'], 1e-9)
+        rows.append({'dataset': label, 'rows': previous['rows'],
+            'frame_mb_previous': previous['loaded_frame_mb'], 'frame_mb_compact': compact['loaded_frame_mb'],
+            'peak_mb_previous': previous['working_set_mb'], 'peak_mb_compact': compact['working_set_mb'],
+            'peak_reduction_pct': round(100 * reduction, 1)})
+
+    report = pd.DataFrame(rows)
+    print("-" * 30)
+    print(f"Peak memory above baseline (MB), previous vs compact representation ({n_estimators} trees):")
+    print(report.to_string(index=False))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Report the peak-memory saving of the compact dtype layer.')
+    parser.add_argument('--train', default='birmingham_prices_real_2024.csv')
+    parser.add_argument('--test', default='birmingham_prices_real_2025.csv')
+    parser.add_argument('--national', nargs='*', default=[],
+        help='Headerless national PPD year files, e.g. pp-2024.csv')
+    parser.add_argument('--n-estimators', type=int, default=10)
+    parser.add_argument('--report', default='memory_report.csv')
+    args = parser.parse_args()
+
+    datasets = [('Birmingham 2024/2025', args.train, args.test, True)]
+    datasets += [(os.path.basename(path), path, None, False) for path in args.national]
+    report = memory_report(datasets, args.n_estimators)
+    report.to_csv(args.report, index=False)
+    print(f"Saved report to {args.report}")
@@ -0,0 +1,242 @@
+import argparse
+import os
+import pickle
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from feature_store import load_aligned_matrices
+
+COMPACT_FOREST_VERSION = 1
+LEAF = -2  # sklearn's TREE_UNDEFINED feature marker for leaves
+
+
+def _float32_thresholds(threshold):
+    # Largest float32 <= each float64 threshold: for float32 inputs, x <= t32 exactly when x <= threshold
+    t32 = threshold.astype(np.float32)
+    above = t32.astype(np.float64) > threshold
+    t32[above] = np.nextafter(t32[above], np.float32(-np.inf))
+    return t32
+
+
+def _flatten_tree(tree, max_depth=None):
+    # One fitted tree_ -> (feature, threshold, left, right, missing_left, value), optionally cut at max_depth.
+    # sklearn stores nodes parents-first and keeps the mean target of internal nodes too,
+    # so a cut node simply becomes a leaf with its own value.
+    feature = tree.feature.astype(np.int32)
+    threshold = tree.threshold.astype(np.float64)
+    left = tree.children_left.astype(np.int32)
+    right = tree.children_right.astype(np.int32)
+    # missing_go_to_left exists since sklearn 1.3 (older forests never see NaN at split time)
+    missing_left = np.asarray(getattr(tree, 'missing_go_to_left', np.zeros(tree.node_count)), dtype=bool)
+    value = tree.value[:, 0, 0].astype(np.float64)
+
+    if max_depth is not None:
+        # Node depths, one tree level at a time
+        depth = np.zeros(tree.node_count, dtype=np.int32)
+        level, d = np.array([0]), 0
+        while len(level):
+            level = level[feature[level] != LEAF]
+            level = np.concatenate([left[level], right[level]])
+            d += 1
+            depth[level] = d
+        keep = depth <= max_depth
+        new_id = np.cumsum(keep).astype(np.int32) - 1
+        cut = keep & (depth == max_depth)
+        feature = np.where(cut, LEAF, feature)
+        left = np.where(feature == LEAF, -1, new_id[np.maximum(left, 0)])
+        right = np.where(feature == LEAF, -1, new_id[np.maximum(right, 0)])
+        feature, threshold, left, right, missing_left, value = (a[keep] for a in
+            (feature, threshold, left, right, missing_left, value))
+    return feature, threshold, left, right, missing_left, value
+
+
+class CompactForest:
+    """
+    A fitted RandomForestRegressor flattened into contiguous NumPy node arrays:
+    - feature (int32), threshold (float32, rounded down so float32 inputs split exactly as in sklearn),
+      children (int32, [right, left] per node; leaves point to themselves), missing_left (bool), value (float64),
+      plus each tree's root offset and depth
+    - predict() walks a group of trees for all rows at once, one array step per tree level
+    - Without pruning, predictions are bit-identical to model.predict (trees are summed in the same order)
+    Saved uncompressed with joblib, so load(path) memory-maps the node arrays.
+    """
+
+    def __init__(self, feature, threshold, children, missing_left, value, roots, depths, metadata=None):
+        self.version = COMPACT_FOREST_VERSION
+        self.feature = feature
+        self.threshold = threshold
+        self.children = children
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.depths = depths
+        self.metadata = metadata or {}
+
+    @classmethod
+    def from_sklearn(cls, model, n_trees=None, max_depth=None):
+        """Flatten the first n_trees trees (all if None), each cut at max_depth (no cut if None)."""
+        if model.n_outputs_ != 1:
+            raise ValueError("CompactForest supports single-output forests only")
+        estimators = model.estimators_[:n_trees] if n_trees else model.estimators_
+        trees = [_flatten_tree(e.tree_, max_depth) for e in estimators]
+        depths = np.array([e.tree_.max_depth if max_depth is None else min(e.tree_.max_depth, max_depth)
+            for e in estimators], dtype=np.int32)
+
+        # Children are stored as absolute positions in the concatenated arrays
+        sizes = np.array([len(t[0]) for t in trees], dtype=np.int64)
+        roots = np.concatenate([[0], np.cumsum(sizes)[:-1]]).astype(np.int64)
+        feature, threshold, left, right, missing_left, value = (np.concatenate(part) for part in zip(*trees))
+        offsets = np.repeat(roots, sizes)
+        left, right = left + offsets, right + offsets
+
+        # Leaves loop back to themselves, so a walk of `depth` steps ends on every row's leaf
+        leaves = np.flatnonzero(feature == LEAF)
+        feature[leaves] = 0
+        left[leaves] = right[leaves] = leaves
+        children = np.ascontiguousarray(np.stack([right, left], axis=1), dtype=np.int32)
+
+        metadata = {'n_trees': len(estimators), 'max_depth': max_depth, 'n_features': model.n_features_in_,
+            'feature_names': list(getattr(model, 'feature_names_in_', []))}
+        return cls(feature, _float32_thresholds(threshold), children, missing_left, value, roots, depths, metadata)
+
+    @property
+    def n_trees(self):
+        return len(self.roots)
+
+    @property
+    def n_nodes(self):
+        return len(self.feature)
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.feature, self.threshold, self.children, self.missing_left, self.value,
+            self.roots, self.depths))
+
+    def _walk(self, X_flat, offset, roots, depth, has_missing):
+        # Leaf node of every (tree, row) pair for a group of trees, tree-major
+        children = self.children.ravel()
+        node = np.repeat(roots, len(offset))
+        offset = np.tile(offset, len(roots))
+        for _ in range(depth):
+            x = X_flat[offset + self.feature[node]]
+            go_left = x <= self.threshold[node]
+            if has_missing:
+                # Same rule as sklearn: NaN follows missing_left
+                go_left = np.where(np.isnan(x), self.missing_left[node], go_left)
+            node = children[2 * node + go_left]
+        return node.reshape(len(roots), -1)
+
+    def predict(self, X, pairs_per_step=65536):
+        """
+        Mean of the tree values, summed tree by tree like sklearn.
+        Trees are walked in groups of about pairs_per_step / rows, so small batches take one pass over all trees
+        and large ones keep each group's nodes in cache.
+        """
+        # Forests compare float32 features (C-contiguous) with the thresholds
+        X = np.ascontiguousarray(X.toarray() if hasattr(X, 'toarray') else X, dtype=np.float32)
+        n_rows, n_features = X.shape
+        X_flat = X.ravel()
+        has_missing = bool(np.isnan(X_flat).any())
+        offset = np.arange(n_rows, dtype=np.int64) * n_features
+
+        total = np.zeros(n_rows, dtype=np.float64)
+        group = max(1, pairs_per_step // max(n_rows, 1))
+        for start in range(0, self.n_trees, group):
+            roots, depths = self.roots[start:start + group], self.depths[start:start + group]
+            for tree_leaves in self._walk(X_flat, offset, roots, int(depths.max()), has_missing):
+                total += self.value[tree_leaves]
+        return total / self.n_trees
+
+    def save(self, path):
+        joblib.dump(self, path)
+        print(f"Saved compact forest ({self.n_trees} trees, {self.n_nodes:,} nodes, "
+            f"{self.nbytes / 1e6:.1f} MB) to {path}")
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        forest = joblib.load(path, mmap_mode=mmap_mode)
+        if getattr(forest, 'version', None) != COMPACT_FOREST_VERSION:
+            raise ValueError(f"{path} is not a version {COMPACT_FOREST_VERSION} compact forest")
+        return forest
+
+
+def _timed_predict(predict, X, repeats=3):
+    # Best of a few runs, in milliseconds
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        predictions = predict(X)
+        best = min(best, time.perf_counter() - start)
+    return predictions, best * 1000
+
+
+def pruning_report(model, X_test, y_test, tree_counts=(None,), depths=(None,), batch_rows=256):
+    """
+    Accuracy vs size/latency of CompactForest exports of a log1p-price forest:
+    one row per (n_trees, max_depth), plus the sklearn forest itself as the reference.
+    Latency is measured on the full test set and on a small batch (per-call overhead).
+    """
+    y_test = np.asarray(y_test)
+    batch = X_test[:batch_rows]
+
+    def row(name, n_trees, max_depth, size_mb, predict):
+        predictions, full_ms = _timed_predict(predict, X_test)
+        _, batch_ms = _timed_predict(predict, batch)
+        predictions_real = np.expm1(predictions)
+        return {'model': name, 'n_trees': n_trees, 'max_depth': max_depth, 'size_mb': round(size_mb, 2),
+            'predict_ms': round(full_ms, 1), f'batch{len(batch)}_ms': round(batch_ms, 2),
+            'mae': round(mean_absolute_error(y_test, predictions_real), 2),
+            'r2': round(r2_score(y_test, predictions_real), 4)}, predictions
+
+    reference, reference_predictions = row('sklearn', len(model.estimators_), model.max_depth,
+        len(pickle.dumps(model, protocol=pickle.HIGHEST_PROTOCOL)) / 1e6, model.predict)
+    rows = [reference]
+    for n_trees in tree_counts:
+        for max_depth in depths:
+            forest = CompactForest.from_sklearn(model, n_trees, max_depth)
+            result, predictions = row('compact', forest.n_trees, max_depth, forest.nbytes / 1e6, forest.predict)
+            if n_trees is None and max_depth is None:
+                result['identical'] = bool(np.array_equal(predictions, reference_predictions))
+            rows.append(result)
+
+    report = pd.DataFrame(rows)
+    print("-" * 30)
+    print("Compact forest: accuracy vs size/latency (MAE/R2 on real prices)")
+    print(report.to_string(index=False))
+    return report
+
+
+def _optional_ints(values):
+    return [None if v.lower() == 'none' else int(v) for v in values]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Export a V3 forest to compact node arrays and report pruning.')
+    parser.add_argument('--train', default='train_features_v2.parquet')
+    parser.add_argument('--test', default='test_features_v2.parquet')
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--trees', nargs='+', default=['none', '50', '25', '10'], help="Tree counts ('none' = all)")
+    parser.add_argument('--depths', nargs='+', default=['none', '20', '15', '10'], help="Depth cuts ('none' = full)")
+    parser.add_argument('--output', default='model_v3_compact.joblib')
+    parser.add_argument('--report', default='compact_forest_report.csv')
+    args = parser.parse_args()
+
+    # Same data and forest as model_v3.py
+    X_train, y_train, X_test, y_test, feature_names = load_aligned_matrices(args.train, args.test)
+    print(f"Training the V3 forest ({args.n_estimators} trees) on {len(X_train):,} rows...")
+    model = RandomForestRegressor(n_estimators=args.n_estimators, random_state=42)
+    model.fit(X_train, np.log1p(y_train))
+
+    report = pruning_report(model, X_test, y_test, _optional_ints(args.trees), _optional_ints(args.depths))
+    report.to_csv(args.report, index=False)
+    print(f"Saved report to {args.report}")
+
+    forest = CompactForest.from_sklearn(model)
+    forest.metadata['feature_names'] = feature_names
+    forest.save(args.output)
+    print(f"Export file size: {os.path.getsize(args.output) / 1e6:.1f} MB")
@@ -0,0 +1,205 @@
+import argparse
+import multiprocessing
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from compact_dtypes import read_transactions
+from postcode_utils import postcode_key
+
+# Columns read from the EPC domestic bulk files (certificates.csv, one directory per local authority)
+EPC_COLUMNS = ['LMK_KEY', 'ADDRESS1', 'ADDRESS2', 'ADDRESS3', 'POSTCODE', 'TOTAL_FLOOR_AREA', 'LODGEMENT_DATE']
+PPD_ADDRESS_COLUMNS = ['ID', 'Postcode', 'SAON', 'PAON', 'Street']
+
+# Spelling variants folded to one token on both sides before scoring
+ADDRESS_ABBREVIATIONS = {'RD': 'ROAD', 'ST': 'STREET', 'AVE': 'AVENUE', 'AV': 'AVENUE', 'DR': 'DRIVE',
+    'LN': 'LANE', 'CL': 'CLOSE', 'CRES': 'CRESCENT', 'CT': 'COURT', 'GDNS': 'GARDENS', 'GRN': 'GREEN',
+    'GR': 'GROVE', 'PL': 'PLACE', 'SQ': 'SQUARE', 'TER': 'TERRACE', 'APARTMENT': 'FLAT', 'APT': 'FLAT'}
+_ABBREVIATION_PATTERN = r'\b(' + '|'.join(ADDRESS_ABBREVIATIONS) + r')\b'
+
+# Minimum share of the PPD address words found in the EPC address for a candidate to count as a match
+MIN_SCORE = 0.5
+
+
+def normalise_addresses(parts):
+    """
+    Address parts (list of Series) -> one normalised string per row:
+    upper case, punctuation to spaces, abbreviations expanded, whitespace collapsed.
+    Each distinct address is normalised once, like the postcode parser.
+    """
+    # Object first: PPD address parts are categoricals, which cannot take '' as a fill value
+    joined = parts[0].astype('object').fillna('').astype('str')
+    for part in parts[1:]:
+        joined = joined + ' ' + part.astype('object').fillna('').astype('str')
+    codes, uniques = pd.factorize(joined)
+
+    normalised = pd.Series(uniques, dtype='object').str.upper().str.replace(r'[^A-Z0-9]+', ' ', regex=True)
+    normalised = normalised.str.replace(_ABBREVIATION_PATTERN, lambda m: ADDRESS_ABBREVIATIONS[m.group(1)],
+        regex=True).str.strip()
+    return pd.Series(normalised.to_numpy()[codes], index=parts[0].index)
+
+
+def _tokens(address):
+    # (numbers, words): house/flat numbers must agree exactly, words are compared by overlap
+    tokens = address.split()
+    numbers = frozenset(t for t in tokens if re.search(r'\d', t))
+    return numbers, frozenset(tokens) - numbers
+
+
+def score_pair(ppd_tokens, epc_tokens):
+    """
+    (score, tie-break) for two tokenised addresses, both 0..1 and (0, 0) when house/flat numbers differ:
+    score is the share of PPD words found in the EPC address (EPC lines often add a locality or town),
+    tie-break is the Jaccard overlap of the two word sets.
+    """
+    ppd_numbers, ppd_words = ppd_tokens
+    epc_numbers, epc_words = epc_tokens
+    if ppd_numbers != epc_numbers:
+        return 0.0, 0.0
+    # Number-only addresses ('12' vs '12') agree completely
+    common = len(ppd_words & epc_words)
+    union = len(ppd_words | epc_words)
+    return (common / len(ppd_words) if ppd_words else 1.0), (common / union if union else 1.0)
+
+
+def match_partition(ppd, epc, min_score=MIN_SCORE):
+    """
+    Worker: match the PPD rows of one postcode partition against the EPC addresses of the same partition.
+    Candidates come only from the same full postcode and house/flat numbers (hash join on the blocking key);
+    within a block every distinct PPD address is scored against every distinct EPC address and the best
+    unambiguous one wins.
+    Returns (matches frame with ID, LMK_KEY, Floor_Area, Match_Score; number of candidate pairs scored).
+    """
+    # 1. Distinct addresses per side, tokenised once
+    ppd_addresses = ppd[['Postcode_Key', 'Address']].drop_duplicates()
+    epc_addresses = epc[['Postcode_Key', 'Address', 'LMK_KEY', 'TOTAL_FLOOR_AREA']]
+    tokens = {address: _tokens(address) for address in
+        pd.concat([ppd_addresses['Address'], epc_addresses['Address']]).unique()}
+    numbers = {address: ' '.join(sorted(t[0])) for address, t in tokens.items()}
+    ppd_addresses = ppd_addresses.assign(Numbers=ppd_addresses['Address'].map(numbers))
+    epc_addresses = epc_addresses.assign(Numbers=epc_addresses['Address'].map(numbers))
+
+    # 2. Candidate pairs: same postcode and same house/flat numbers (pairs that differ would score 0 anyway)
+    pairs = ppd_addresses.merge(epc_addresses, on=['Postcode_Key', 'Numbers'], suffixes=('', '_EPC'))
+    n_pairs = len(pairs)
+    if pairs.empty:
+        return pd.DataFrame(columns=['ID', 'LMK_KEY', 'Floor_Area', 'Match_Score']), 0
+    scores = [score_pair(tokens[a], tokens[b]) for a, b in zip(pairs['Address'], pairs['Address_EPC'])]
+    pairs['Match_Score'], pairs['Tie_Break'] = zip(*scores)
+    pairs = pairs[pairs['Match_Score'] >= min_score]
+
+    # 3. Best candidate per PPD address; exact ties between different EPC addresses are left unmatched
+    keys = ['Postcode_Key', 'Address']
+    pairs = pairs.sort_values(['Match_Score', 'Tie_Break'], ascending=False, kind='stable')
+    rank = pairs.groupby(keys, sort=False).cumcount()
+    top, runner_up = pairs[rank == 0], pairs[rank == 1]
+    tied = top[keys + ['Match_Score', 'Tie_Break']].merge(runner_up[keys + ['Match_Score', 'Tie_Break']])
+    pairs = top[~pd.MultiIndex.from_frame(top[keys]).isin(pd.MultiIndex.from_frame(tied[keys]))]
+
+    matches = ppd[['ID', 'Postcode_Key', 'Address']].merge(pairs, on=['Postcode_Key', 'Address'])
+    matches = matches.rename(columns={'TOTAL_FLOOR_AREA': 'Floor_Area'})
+    return matches[['ID', 'LMK_KEY', 'Floor_Area', 'Match_Score']], n_pairs
+
+
+def load_ppd_addresses(ppd_files):
+    ppd = pd.concat([read_transactions(f, PPD_ADDRESS_COLUMNS) for f in ppd_files], ignore_index=True)
+    ppd['Postcode_Key'] = postcode_key(ppd['Postcode'])
+    ppd['Address'] = normalise_addresses([ppd['SAON'], ppd['PAON'], ppd['Street']])
+    # A transaction listed in several input files is matched once
+    ppd = ppd.drop_duplicates('ID', keep='last')
+    return ppd.dropna(subset=['Postcode_Key'])[['ID', 'Postcode_Key', 'Address']]
+
+
+def load_epc_certificates(epc_files, postcode_keys, chunksize=500000):
+    """
+    Stream the EPC bulk files, keeping only certificates in postcodes that occur in the PPD data
+    (a hash semi-join, so the full national EPC set never has to be held in memory).
+    Several certificates for one address are reduced to the most recently lodged one.
+    """
+    wanted = set(postcode_keys)
+    frames = []
+    for path in epc_files:
+        for chunk in pd.read_csv(path, usecols=EPC_COLUMNS, dtype={'LMK_KEY': 'str', 'POSTCODE': 'str'},
+                chunksize=chunksize, low_memory=False):
+            chunk['Postcode_Key'] = postcode_key(chunk['POSTCODE'])
+            frames.append(chunk[chunk['Postcode_Key'].isin(wanted)])
+    if not frames:
+        frames = [pd.DataFrame(columns=EPC_COLUMNS + ['Postcode_Key'])]
+    epc = pd.concat(frames, ignore_index=True)
+
+    epc['Address'] = normalise_addresses([epc['ADDRESS1'], epc['ADDRESS2'], epc['ADDRESS3']])
+    epc['TOTAL_FLOOR_AREA'] = pd.to_numeric(epc['TOTAL_FLOOR_AREA'], errors='coerce')
+    epc = epc[epc['TOTAL_FLOOR_AREA'] > 0]
+    epc = epc.sort_values('LODGEMENT_DATE').drop_duplicates(['Postcode_Key', 'Address'], keep='last')
+    return epc[['Postcode_Key', 'Address', 'LMK_KEY', 'TOTAL_FLOOR_AREA']]
+
+
+def match_epc(ppd_files, epc_files, output_path='epc_matches.csv', max_workers=None, n_partitions=None,
+        min_score=MIN_SCORE):
+    """
+    PPD <-> EPC address join for Total Floor Area:
+    - Addresses on both sides are normalised; candidates are blocked by full postcode (hash index)
+    - Postcodes are hashed into partitions that are matched in parallel worker processes
+    - Writes ID, LMK_KEY, Floor_Area, Match_Score for every matched PPD transaction
+    Reports match rate and throughput.
+    """
+    start = time.perf_counter()
+    ppd = load_ppd_addresses(ppd_files)
+    epc = load_epc_certificates(epc_files, ppd['Postcode_Key'].unique())
+    load_seconds = time.perf_counter() - start
+    print(f"Loaded {len(ppd):,} PPD transactions and {len(epc):,} EPC addresses in {load_seconds:.1f}s")
+
+    # 1. Partition both sides by a hash of the postcode, so every block lands in exactly one partition
+    max_workers = max_workers or os.cpu_count()
+    n_partitions = n_partitions or max_workers * 4
+    ppd_part = pd.util.hash_pandas_object(ppd['Postcode_Key'], index=False).to_numpy() % n_partitions
+    epc_part = pd.util.hash_pandas_object(epc['Postcode_Key'], index=False).to_numpy() % n_partitions
+
+    # 2. Match the partitions in parallel
+    start = time.perf_counter()
+    results = []
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        futures = [pool.submit(match_partition, ppd[ppd_part == p], epc[epc_part == p], min_score)
+            for p in range(n_partitions) if (ppd_part == p).any() and (epc_part == p).any()]
+        results = [future.result() for future in futures]
+    match_seconds = time.perf_counter() - start
+
+    matches = pd.concat([m for m, _ in results], ignore_index=True) if results else pd.DataFrame(
+        columns=['ID', 'LMK_KEY', 'Floor_Area', 'Match_Score'])
+    pairs = sum(n for _, n in results)
+    matches.to_csv(output_path, index=False)
+
+    print("-" * 30)
+    print(f"Matched {len(matches):,} of {len(ppd):,} transactions ({len(matches) / max(len(ppd), 1):.1%}) "
+        f"over {n_partitions} partition(s)")
+    print(f"Scored {pairs:,} candidate pairs in {match_seconds:.1f}s "
+        f"({len(ppd) / max(match_seconds, 1e-9):,.0f} transactions/sec, {pairs / max(match_seconds, 1e-9):,.0f} "
+        f"pairs/sec); saved to {output_path}")
+    return matches
+
+
+def load_floor_areas(path):
+    """ID -> Floor_Area (m2) from a match_epc output file, one row per ID (the best-scoring match is kept)."""
+    matches = pd.read_csv(path, usecols=['ID', 'Floor_Area', 'Match_Score'],
+        dtype={'ID': 'str', 'Floor_Area': np.float32})
+    matches = matches.sort_values('Match_Score', ascending=False, kind='stable').drop_duplicates('ID')
+    return matches[['ID', 'Floor_Area']]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Match PPD transactions to EPC certificates for floor area.')
+    parser.add_argument('--ppd', nargs='+', default=['birmingham_prices_real_2024.csv',
+        'birmingham_prices_real_2025.csv'], help='Filtered PPD CSVs (with header)')
+    parser.add_argument('--epc', nargs='+', required=True, help='EPC bulk certificates.csv file(s)')
+    parser.add_argument('--output', default='epc_matches.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--partitions', type=int, default=None)
+    parser.add_argument('--min-score', type=float, default=MIN_SCORE)
+    args = parser.parse_args()
+
+    match_epc(args.ppd, args.epc, args.output, args.workers, args.partitions, args.min_score)
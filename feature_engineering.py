@@ -1,19 +1,26 @@
-import pandas as pd
-import numpy as np
+from compact_dtypes import add_month, read_transactions
+from instrumentation import stage
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
 
 
-def clean_and_feature_engineering(file_path):
+def clean_and_feature_engineering(file_path, onehot=None):
     # Load the filtered real data
-    df = pd.read_csv(file_path)
+    with stage('feature_engineering.read_csv', source=file_path) as s:
+        df = read_transactions(file_path, ['Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration'])
+        s.set(rows_out=len(df))
 
     # 1. Extract Postcode Area (e.g., B1, B29)
     # Some postcodes might be missing, we drop them for accuracy
-    df = df.dropna(subset=['Postcode'])
-    df['Postcode_Area'] = df['Postcode'].apply(lambda x: str(x).split(' ')[0])
+    with stage('feature_engineering.postcode_area', rows_in=len(df)) as s:
+        df = df.dropna(subset=['Postcode'])
+        df['Postcode_Area'] = postcode_area(df['Postcode'])
+        s.set(rows_out=len(df))
 
     # 2. Convert Date to Month (Seasonality factor)
-    df['Date'] = pd.to_datetime(df['Date'])
-    df['Month'] = df['Date'].dt.month
+    with stage('feature_engineering.month', rows_in=len(df)) as s:
+        df = add_month(df)
+        s.set(rows_out=len(df))
 
     # 3. Select relevant features for the model
     # Price is our target, others are features
@@ -22,19 +29,26 @@ def clean_and_feature_engineering(file_path):
 
     # 4. One-Hot Encoding for categorical text data
     # This turns 'Type' into multiple columns of 0s and 1s
-    df_final = pd.get_dummies(df_clean, columns=['Postcode_Area', 'Type', 'Old_New', 'Duration'])
+    # The vocabulary is fitted on the first (training) file and reused, so every file gets the same columns
+    with stage('feature_engineering.onehot', rows_in=len(df_clean)) as s:
+        if onehot is None:
+            onehot = SparseOneHotEncoder(['Postcode_Area', 'Type', 'Old_New', 'Duration']).fit(df_clean)
+        df_final = onehot.encode(df_clean)
+        s.set(rows_out=len(df_final), columns=df_final.shape[1])
 
-    return df_final
+    return df_final, onehot
 
 
 if __name__ == "__main__":
     print("Processing 2024 training data...")
-    train_data = clean_and_feature_engineering('birmingham_prices_real_2024.csv')
-    train_data.to_csv('train_features_2024.csv', index=False)
+    train_data, onehot = clean_and_feature_engineering('birmingham_prices_real_2024.csv')
+    with stage('feature_engineering.write_csv', rows_out=len(train_data)):
+        train_data.to_csv('train_features_2024.csv', index=False)
 
     print("Processing 2025 testing data...")
-    test_data = clean_and_feature_engineering('birmingham_prices_real_2025.csv')
-    # Important: Ensure 2025 data has the same columns as 2024
-    test_data.to_csv('test_features_2025.csv', index=False)
+    # Important: Ensure 2025 data has the same columns as 2024 (same fitted vocabulary)
+    test_data, _ = clean_and_feature_engineering('birmingham_prices_real_2025.csv', onehot)
+    with stage('feature_engineering.write_csv', rows_out=len(test_data)):
+        test_data.to_csv('test_features_2025.csv', index=False)
 
     print("Feature Engineering Complete!")
\ No newline at end of file
@@ -1,50 +1,64 @@
-import pandas as pd
-import numpy as np
+from compact_dtypes import add_month, read_transactions
+from feature_store import save_features
+from instrumentation import stage
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
 
+# Raw columns the V2 features are built from
+V2_INPUT_COLUMNS = ['Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration']
 
-def clean_and_feature_engineering(train_path, test_path):
+
+def clean_and_feature_engineering(train_path, test_path, encoder_path=None, onehot_path=None, smoothing=0.0):
     """
     V2 Feature Engineering:
     - Resolves SettingWithCopyWarning using .copy()
     - Implements Target Encoding (Area_Avg_Price) after outlier filtering
     - Strengthens geographic signals for the Birmingham mainstream market
+    - Fits 'Area_Avg_Price' as a TargetEncoder artifact (saved to encoder_path if given)
+    - One-hot columns come from a vocabulary fitted on train (saved to onehot_path if given)
     """
     # 1. Load raw datasets
-    train_df_raw = pd.read_csv(train_path)
-    test_df_raw = pd.read_csv(test_path)
+    with stage('feature_engineering_v2.read_csv') as s:
+        # Typed load of only the columns used below (categoricals, int32 Price, parsed Date)
+        train_df_raw = read_transactions(train_path, V2_INPUT_COLUMNS)
+        test_df_raw = read_transactions(test_path, V2_INPUT_COLUMNS)
+        s.set(rows_out=len(train_df_raw) + len(test_df_raw))
 
     # 2. Filter Outliers (Mainstream market <= £1M) and use .copy()
     # This ensures we work on an independent DataFrame and avoid warnings
-    train_df = train_df_raw[train_df_raw['Price'] <= 1000000].copy()
-    test_df = test_df_raw[test_df_raw['Price'] <= 1000000].copy()
+    with stage('feature_engineering_v2.filter_outliers', rows_in=len(train_df_raw) + len(test_df_raw)) as s:
+        train_df = train_df_raw[train_df_raw['Price'] <= 1000000].copy()
+        test_df = test_df_raw[test_df_raw['Price'] <= 1000000].copy()
+        s.set(rows_out=len(train_df) + len(test_df))
 
     def preprocess_base(df):
         # Extract Postcode Area (e.g., B15, B29)
-        df['Postcode_Area'] = df['Postcode'].apply(lambda x: str(x).split(' ')[0])
+        df['Postcode_Area'] = postcode_area(df['Postcode'])
 
-        # Convert Date to Month for seasonality factors
-        df['Date'] = pd.to_datetime(df['Date'])
-        df['Month'] = df['Date'].dt.month
-        return df
+        # Convert Date to Month (int8) for seasonality factors
+        return add_month(df)
 
     # Apply base preprocessing to both sets
-    train_df = preprocess_base(train_df)
-    test_df = preprocess_base(test_df)
+    n_rows = len(train_df) + len(test_df)
+    with stage('feature_engineering_v2.preprocess_base', rows_in=n_rows, rows_out=n_rows):
+        train_df = preprocess_base(train_df)
+        test_df = preprocess_base(test_df)
 
     # ---------------------------------------------------------
     # 3. TARGET ENCODING: Area Average Price
     # ---------------------------------------------------------
-    # Calculate means based ONLY on 2024 training data to prevent data leakage
-    # We calculate this after filtering to reflect the true mainstream market average
-    area_lookup = train_df.groupby('Postcode_Area')['Price'].mean()
-
-    # Map the 2024 averages back to both 2024 and 2025 datasets
-    train_df['Area_Avg_Price'] = train_df['Postcode_Area'].map(area_lookup)
-    test_df['Area_Avg_Price'] = test_df['Postcode_Area'].map(area_lookup)
-
-    # Handle new postcodes in 2025 not found in 2024 (fill with global mean)
-    global_mean = train_df['Price'].mean()
-    test_df['Area_Avg_Price'] = test_df['Area_Avg_Price'].fillna(global_mean)
+    with stage('feature_engineering_v2.target_encode', rows_in=n_rows, rows_out=n_rows):
+        # Calculate means based ONLY on 2024 training data to prevent data leakage
+        # We calculate this after filtering to reflect the true mainstream market average
+        area_encoder = TargetEncoder(['Postcode_Area'], smoothing=smoothing).fit(train_df)
+        if encoder_path:
+            area_encoder.save(encoder_path)
+
+        # Map the 2024 averages back to both 2024 and 2025 datasets
+        # New postcodes in 2025 not found in 2024 get the stored global mean
+        train_df['Area_Avg_Price'] = area_encoder.transform(train_df)
+        test_df['Area_Avg_Price'] = area_encoder.transform(test_df)
 
     # 4. Feature Selection and One-Hot Encoding
     required_cols = ['Price', 'Area_Avg_Price', 'Postcode_Area', 'Type', 'Old_New', 'Duration', 'Month']
@@ -53,8 +67,14 @@ def clean_and_feature_engineering(train_path, test_path):
 
     # Convert categorical text into numerical binary columns
     categorical_features = ['Postcode_Area', 'Type', 'Old_New', 'Duration']
-    train_final = pd.get_dummies(train_clean, columns=categorical_features)
-    test_final = pd.get_dummies(test_clean, columns=categorical_features)
+    with stage('feature_engineering_v2.onehot', rows_in=n_rows, rows_out=n_rows) as s:
+        # Vocabulary is fitted on 2024 only, so both sets get the same columns in the same order
+        onehot = SparseOneHotEncoder(categorical_features).fit(train_clean)
+        if onehot_path:
+            onehot.save(onehot_path)
+        train_final = onehot.encode(train_clean)
+        test_final = onehot.encode(test_clean)
+        s.set(columns=train_final.shape[1])
 
     return train_final, test_final
 
@@ -64,12 +84,14 @@ if __name__ == "__main__":
 
     # Process both datasets to ensure consistency
     train_features, test_features = clean_and_feature_engineering('birmingham_prices_real_2024.csv',
-        'birmingham_prices_real_2025.csv')
+        'birmingham_prices_real_2025.csv', encoder_path='area_encoder_v2.json',
+        onehot_path='onehot_vocab_v2.json')
 
-    # Save to V2 CSV files
-    train_features.to_csv('train_features_v2.csv', index=False)
-    test_features.to_csv('test_features_v2.csv', index=False)
+    # Save to typed V2 Parquet files (no text round trip for the model scripts)
+    with stage('feature_engineering_v2.write_parquet', rows_out=len(train_features) + len(test_features)):
+        save_features(train_features, 'train_features_v2.parquet', feature_set='v2')
+        save_features(test_features, 'test_features_v2.parquet', feature_set='v2')
 
     print("-" * 30)
-    print("Success! V2 Features saved to 'train_features_v2.csv' and 'test_features_v2.csv'.")
+    print("Success! V2 Features saved to 'train_features_v2.parquet' and 'test_features_v2.parquet'.")
     print("New feature 'Area_Avg_Price' added and Warning 'SettingWithCopy' resolved.")
\ No newline at end of file
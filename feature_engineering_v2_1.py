@@ -1,66 +1,196 @@
+import argparse
+
 import pandas as pd
 import numpy as np
+from scipy import sparse
+
+from compact_dtypes import read_transactions
+from epc_matcher import load_floor_areas
+from feature_store import save_features
+from instrumentation import stage
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
+from spatial_features import (SPATIAL_FEATURES, ComparableSalesIndex, add_coordinates, load_postcode_centroids,
+    past_comparables)
+from target_encoding import TargetEncoder
+
+# Raw inputs of the v3.1 model and the categorical columns that get one-hot encoded
+V2_1_INPUT_COLUMNS = ['Postcode', 'Type', 'Old_New', 'Duration']
+V2_1_CATEGORICALS = ['Postcode_Area', 'Type', 'Old_New', 'Duration']
 
 
-def clean_and_feature_engineering_v2_1(train_path, test_path):
+def clean_and_feature_engineering_v2_1(train_path, test_path, encoder_path=None, onehot_path=None, smoothing=0.0,
+        floor_area_path=None, centroids_path=None, comparables_path=None):
     """
     Refined Feature Engineering:
     - Removes 'Month' to reduce seasonal noise.
     - Creates 'Area_Type_Avg' as a high-precision proxy for house size/value.
     - Resolves SettingWithCopyWarning using .copy().
+    - Fits 'Area_Type_Avg' as a TargetEncoder artifact (saved to encoder_path if given).
+    - One-hot columns come from a vocabulary fitted on train (saved to onehot_path if given).
+    - With floor_area_path (an epc_matcher output), adds 'Floor_Area' from the matched EPC certificate;
+      unmatched transactions get the 2024 mean floor area of their property Type.
+    - With centroids_path (an ONS postcode directory), adds nearest comparable sales of the same Type
+      (see spatial_features.py); the index over all 2024 sales is saved to comparables_path if given.
+    Floor_Area and the comparable-sales columns are evaluation extras: ModelArtifact and the scoring paths
+    only build the base layout (Area_Type_Avg + one-hot columns).
     """
     # 1. Load raw datasets
-    train_df_raw = pd.read_csv(train_path)
-    test_df_raw = pd.read_csv(test_path)
+    with stage('feature_engineering_v2_1.read_csv') as s:
+        # Typed load of only the columns used below (categoricals, int32 Price)
+        input_columns = ['Price'] + V2_1_INPUT_COLUMNS + (['ID'] if floor_area_path else []) + (
+            ['Date'] if centroids_path else [])
+        train_df_raw = read_transactions(train_path, input_columns)
+        test_df_raw = read_transactions(test_path, input_columns)
+        s.set(rows_out=len(train_df_raw) + len(test_df_raw))
 
     # 2. Filter Outliers (Mainstream market <= £1M)
-    train_df = train_df_raw[train_df_raw['Price'] <= 1000000].copy()
-    test_df = test_df_raw[test_df_raw['Price'] <= 1000000].copy()
+    with stage('feature_engineering_v2_1.filter_outliers', rows_in=len(train_df_raw) + len(test_df_raw)) as s:
+        train_df = train_df_raw[train_df_raw['Price'] <= 1000000].copy()
+        test_df = test_df_raw[test_df_raw['Price'] <= 1000000].copy()
+        s.set(rows_out=len(train_df) + len(test_df))
 
     def preprocess_base(df):
-        # Extract Postcode Area
-        df['Postcode_Area'] = df['Postcode'].apply(lambda x: str(x).split(' ')[0])
+        # Extract Postcode Area (parsed once per distinct postcode, as a categorical)
+        df['Postcode_Area'] = postcode_area(df['Postcode'])
         return df
 
-    train_df = preprocess_base(train_df)
-    test_df = preprocess_base(test_df)
+    n_rows = len(train_df) + len(test_df)
+    with stage('feature_engineering_v2_1.preprocess_base', rows_in=n_rows, rows_out=n_rows):
+        train_df = preprocess_base(train_df)
+        test_df = preprocess_base(test_df)
 
     # ---------------------------------------------------------
     # 3. COMPOSITE TARGET ENCODING: Area + Property Type
     # This acts as a proxy for size (e.g., B15 Detached vs B15 Flat)
     # ---------------------------------------------------------
-    # Calculate means based ONLY on 2024 training data
-    lookup = train_df.groupby(['Postcode_Area', 'Type'])['Price'].mean()
+    with stage('feature_engineering_v2_1.target_encode', rows_in=n_rows, rows_out=n_rows):
+        # Fit counts/sums based ONLY on 2024 training data
+        area_type_encoder = TargetEncoder(['Postcode_Area', 'Type'], smoothing=smoothing).fit(train_df)
+        if encoder_path:
+            area_type_encoder.save(encoder_path)
+
+        # Integer-coded array lookups; combinations not seen in 2024 get the stored global mean
+        train_df['Area_Type_Avg'] = area_type_encoder.transform(train_df)
+        test_df['Area_Type_Avg'] = area_type_encoder.transform(test_df)
+
+    # 3b. FLOOR AREA from matched EPC certificates (optional)
+    extra_cols = []
+    if floor_area_path:
+        with stage('feature_engineering_v2_1.floor_area', rows_in=n_rows, rows_out=n_rows) as s:
+            floor_areas = load_floor_areas(floor_area_path)
+            # One match per ID, so the merges never duplicate transactions
+            train_df = train_df.merge(floor_areas, on='ID', how='left', validate='many_to_one')
+            test_df = test_df.merge(floor_areas, on='ID', how='left', validate='many_to_one')
+            s.set(matched=int(train_df['Floor_Area'].notna().sum() + test_df['Floor_Area'].notna().sum()))
 
-    # Map the composite averages back using a multi-index join logic
-    train_df['Area_Type_Avg'] = train_df.set_index(['Postcode_Area', 'Type']).index.map(lookup)
-    test_df['Area_Type_Avg'] = test_df.set_index(['Postcode_Area', 'Type']).index.map(lookup)
+            # Per-Type mean area of the matched 2024 sales fills the gaps (global mean for unseen types)
+            area_encoder = TargetEncoder(['Type'], target='Floor_Area').fit(train_df.dropna(subset=['Floor_Area']))
+            for df in (train_df, test_df):
+                missing = df['Floor_Area'].isna().to_numpy()
+                df.loc[missing, 'Floor_Area'] = area_encoder.transform(df[missing]).astype(np.float32)
+        extra_cols.append('Floor_Area')
 
-    # Fill missing values for combinations not seen in 2024
-    global_mean = train_df['Price'].mean()
-    train_df['Area_Type_Avg'] = train_df['Area_Type_Avg'].fillna(global_mean)
-    test_df['Area_Type_Avg'] = test_df['Area_Type_Avg'].fillna(global_mean)
+    # 3c. NEAREST COMPARABLE SALES of the same Type (optional)
+    if centroids_path:
+        with stage('feature_engineering_v2_1.comparables', rows_in=n_rows, rows_out=n_rows) as s:
+            centroids = load_postcode_centroids(centroids_path, pd.concat([train_df['Postcode'], test_df['Postcode']]))
+            train_df = add_coordinates(train_df, centroids)
+            test_df = add_coordinates(test_df, centroids)
+            s.set(located=int(train_df['Latitude'].notna().sum() + test_df['Latitude'].notna().sum()))
+
+            # 2024 rows only see sales of earlier months; 2025 rows see every 2024 sale
+            train_df[SPATIAL_FEATURES] = past_comparables(train_df)
+            comparables = ComparableSalesIndex().fit(train_df)
+            if comparables_path:
+                comparables.save(comparables_path)
+            test_df[SPATIAL_FEATURES] = comparables.query(test_df)
+
+            # Unanswered rows (no coordinates, first month) fall back to the area/type mean and the mean distance.
+            # Area_Type_Avg includes each 2024 row's own price, so 2024 rows use out-of-fold means instead.
+            train_fallback = area_type_encoder.transform_out_of_fold(train_df)
+            train_df['Comparable_Price'] = train_df['Comparable_Price'].fillna(
+                pd.Series(train_fallback, index=train_df.index))
+            test_df['Comparable_Price'] = test_df['Comparable_Price'].fillna(test_df['Area_Type_Avg'])
+            mean_distance = train_df['Comparable_Distance_Km'].mean()
+            for df in (train_df, test_df):
+                df['Comparable_Distance_Km'] = df['Comparable_Distance_Km'].fillna(mean_distance)
+        extra_cols += SPATIAL_FEATURES
 
     # 4. Feature Selection (REMOVING 'Month')
-    required_cols = ['Price', 'Area_Type_Avg', 'Postcode_Area', 'Type', 'Old_New', 'Duration']
+    required_cols = ['Price', 'Area_Type_Avg'] + extra_cols + ['Postcode_Area', 'Type', 'Old_New', 'Duration']
     train_clean = train_df[required_cols]
     test_clean = test_df[required_cols]
 
     # Categorical encoding
-    categorical_features = ['Postcode_Area', 'Type', 'Old_New', 'Duration']
-    train_final = pd.get_dummies(train_clean, columns=categorical_features)
-    test_final = pd.get_dummies(test_clean, columns=categorical_features)
+    categorical_features = V2_1_CATEGORICALS
+    with stage('feature_engineering_v2_1.onehot', rows_in=n_rows, rows_out=n_rows) as s:
+        # Vocabulary is fitted on 2024 only, so both sets get the same columns in the same order
+        onehot = SparseOneHotEncoder(categorical_features).fit(train_clean)
+        if onehot_path:
+            onehot.save(onehot_path)
+        train_final = onehot.encode(train_clean)
+        test_final = onehot.encode(test_clean)
+        s.set(columns=train_final.shape[1])
 
     return train_final, test_final
 
 
+def build_matrix_v2_1(df, area_type_encoder, onehot):
+    """
+    Raw transactions -> CSR model matrix in the V2.1 training layout:
+    'Area_Type_Avg' first, then the fitted one-hot columns (same order as the saved feature sets).
+    """
+    if 'Postcode_Area' not in df.columns:
+        df = df.assign(Postcode_Area=postcode_area(df['Postcode']))
+
+    area_type_avg = area_type_encoder.transform(df).astype(np.float32).reshape(-1, 1)
+    return sparse.hstack([sparse.csr_matrix(area_type_avg), onehot.transform(df)], format='csr')
+
+
+def build_dense_matrix_v2_1(df, area_type_encoder, onehot):
+    """
+    Same layout as build_matrix_v2_1, as one C-contiguous float32 array filled in place.
+    float32 is the forest's native dtype, so fit/predict use it without making another copy.
+    """
+    if 'Postcode_Area' not in df.columns:
+        df = df.assign(Postcode_Area=postcode_area(df['Postcode']))
+
+    X = np.empty((len(df), 1 + onehot.n_features), dtype=np.float32)
+    X[:, 0] = area_type_encoder.transform(df)
+    onehot.transform_dense(df, out=X[:, 1:])
+    return X
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the V2.1 train/test feature sets.')
+    parser.add_argument('--floor-area', default=None, metavar='EPC_MATCHES',
+        help="Add Floor_Area from an epc_matcher.py output (e.g. epc_matches.csv). Model artifacts and the "
+            "scoring paths only build the base V2.1 layout, so models trained on it are for evaluation only")
+    parser.add_argument('--centroids', default=None, metavar='POSTCODE_CENTROIDS',
+        help="Add Comparable_Price / Comparable_Distance_Km using an ONS postcode directory CSV "
+            "(e.g. postcode_centroids.csv); evaluation only, like --floor-area")
+    args = parser.parse_args()
+
     print("Starting Feature Engineering V2.1...")
+    floor_area_path = args.floor_area
+    if floor_area_path:
+        print(f"Adding Floor_Area from {floor_area_path}")
+    centroids_path = args.centroids
+    if centroids_path:
+        print(f"Adding comparable-sales features from {centroids_path}")
     train_features, test_features = clean_and_feature_engineering_v2_1('birmingham_prices_real_2024.csv',
-        'birmingham_prices_real_2025.csv')
+        'birmingham_prices_real_2025.csv', encoder_path='area_type_encoder_v2_1.json',
+        onehot_path='onehot_vocab_v2_1.json', floor_area_path=floor_area_path, centroids_path=centroids_path,
+        comparables_path='comparable_index.joblib')
 
-    train_features.to_csv('train_features_v2_1.csv', index=False)
-    test_features.to_csv('test_features_v2_1.csv', index=False)
+    # Optional columns are recorded in the Parquet metadata next to the feature set name
+    extra_features = [c for c in ['Floor_Area'] + SPATIAL_FEATURES if c in train_features.columns]
+    with stage('feature_engineering_v2_1.write_parquet', rows_out=len(train_features) + len(test_features)):
+        save_features(train_features, 'train_features_v2_1.parquet', feature_set='v2_1',
+            extra_features=extra_features)
+        save_features(test_features, 'test_features_v2_1.parquet', feature_set='v2_1',
+            extra_features=extra_features)
 
     print("-" * 30)
     print("Success! V2.1 Features saved (Month removed, Area_Type_Avg added).")
\ No newline at end of file
@@ -0,0 +1,83 @@
+import json
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Key under which our own schema metadata is stored in the Parquet footer
+METADATA_KEY = b'bham_feature_set'
+
+
+def save_features(df, path, feature_set, target='Price', **extra):
+    """
+    Typed columnar hand-off between the feature_engineering_v* and model_v* stages:
+    - Writes the feature frame to Parquet, keeping bool dummies as bool and numbers as numbers
+    - Stores feature set name, target and column list in the schema metadata
+    """
+    table = pa.Table.from_pandas(df, preserve_index=False)
+
+    metadata = {'feature_set': feature_set, 'target': target, 'n_rows': len(df), 'columns': list(df.columns)}
+    metadata.update(extra)
+
+    schema_metadata = dict(table.schema.metadata or {})
+    schema_metadata[METADATA_KEY] = json.dumps(metadata).encode('utf-8')
+    table = table.replace_schema_metadata(schema_metadata)
+
+    pq.write_table(table, path)
+    print(f"Saved {len(df)} rows x {len(df.columns)} columns to {path}")
+
+
+def read_feature_schema(path):
+    """Return (column names, feature metadata) from the Parquet footer without reading any data."""
+    schema = pq.read_schema(path)
+    raw = (schema.metadata or {}).get(METADATA_KEY)
+    metadata = json.loads(raw) if raw else {}
+    return schema.names, metadata
+
+
+def load_features(path, columns=None):
+    """Load a feature set, reading only the requested columns (all columns if None)."""
+    return pq.read_table(path, columns=columns).to_pandas()
+
+
+def load_aligned_features(train_path, test_path):
+    """
+    Load train/test feature sets restricted to the columns they share.
+    Columns are decided from the two schemas first, so nothing else is ever read from disk,
+    and they keep the training file's order so the layout is the same on every run.
+    """
+    train_cols, _ = read_feature_schema(train_path)
+    test_cols, _ = read_feature_schema(test_path)
+
+    test_set = set(test_cols)
+    common_cols = [c for c in train_cols if c in test_set]
+
+    return load_features(train_path, common_cols), load_features(test_path, common_cols)
+
+
+def load_feature_matrix(path, columns=None, target='Price', dtype=np.float32):
+    """
+    Load a feature set straight into model inputs, without a pandas frame in between:
+    - X: one C-contiguous float32 array (the forest's native dtype), filled column by column from Parquet
+    - y: the target as float64
+    Returns (X, y, feature_names); feature order follows `columns` (or the file) with the target removed.
+    """
+    table = pq.read_table(path, columns=columns)
+    feature_names = [c for c in table.column_names if c != target]
+
+    X = np.empty((table.num_rows, len(feature_names)), dtype=dtype)
+    for j, name in enumerate(feature_names):
+        X[:, j] = table.column(name).to_numpy()
+    y = table.column(target).to_numpy().astype(np.float64)
+    return X, y, feature_names
+
+
+def load_aligned_matrices(train_path, test_path, target='Price'):
+    """load_aligned_features as float32 matrices: (X_train, y_train, X_test, y_test, feature_names)."""
+    train_cols, _ = read_feature_schema(train_path)
+    test_set = set(read_feature_schema(test_path)[0])
+    common_cols = [c for c in train_cols if c in test_set]
+
+    X_train, y_train, feature_names = load_feature_matrix(train_path, common_cols, target)
+    X_test, y_test, _ = load_feature_matrix(test_path, common_cols, target)
+    return X_train, y_train, X_test, y_test, feature_names
@@ -1,33 +1,145 @@
+import argparse
+import os
+import time
+
 import pandas as pd
 
+from instrumentation import stage
+
+# Official column names for Land Registry PPD
+PPD_COLUMNS = ['ID', 'Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration', 'PAON', 'SAON', 'Street', 'Locality',
+    'City', 'District', 'County', 'PPD_Category', 'Record_Status']
+
+# Columns the feature scripts (and the EPC/record-status work) actually need
+INGEST_COLUMNS = ['ID', 'Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration', 'PAON', 'SAON', 'Street',
+    'District', 'Record_Status']
+
+# Declared dtypes so pandas never has to infer types chunk by chunk
+PPD_DTYPES = {'ID': 'str', 'Price': 'int64', 'Date': 'str', 'Postcode': 'str', 'Type': 'category',
+    'Old_New': 'category', 'Duration': 'category', 'PAON': 'str', 'SAON': 'str', 'Street': 'str', 'Locality': 'str',
+    'City': 'str', 'District': 'category', 'County': 'str', 'PPD_Category': 'category', 'Record_Status': 'category'}
+
 
 def process_local_csv():
     # Load the big file you just downloaded
     input_file = 'uk_2025.csv'
     output_file = 'birmingham_prices_real_2025.csv'
 
-    # Official column names for Land Registry PPD
-    columns = ['ID', 'Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration', 'PAON', 'SAON', 'Street', 'Locality',
-        'City', 'District', 'County', 'PPD_Category', 'Record_Status']
+    columns = PPD_COLUMNS
 
     print(f"Reading {input_file}...")
 
     # We use chunksize to prevent memory errors with the large 100MB+ file
-    chunks = pd.read_csv(input_file, names=columns, chunksize=50000)
+    with stage('filter_bham.read_filter') as s:
+        chunks = pd.read_csv(input_file, names=columns, chunksize=50000)
 
-    bham_data = []
-    for chunk in chunks:
-        # Filter where District is BIRMINGHAM (must be uppercase)
-        filtered = chunk[chunk['District'] == 'BIRMINGHAM']
-        bham_data.append(filtered)
+        bham_data = []
+        rows_read = 0
+        for chunk in chunks:
+            rows_read += len(chunk)
+            # Filter where District is BIRMINGHAM (must be uppercase)
+            filtered = chunk[chunk['District'] == 'BIRMINGHAM']
+            bham_data.append(filtered)
+        s.set(rows_in=rows_read, rows_out=sum(len(part) for part in bham_data))
 
     if bham_data:
-        final_df = pd.concat(bham_data)
-        final_df.to_csv(output_file, index=False)
+        with stage('filter_bham.write_csv') as s:
+            final_df = pd.concat(bham_data)
+            final_df.to_csv(output_file, index=False)
+            s.set(rows_out=len(final_df))
         print(f"Success! Filtered {len(final_df)} Birmingham records into {output_file}")
     else:
         print("No Birmingham records found. Check if the district name is correct.")
+    return rows_read
+
+
+def partition_path(output_dir, district, year):
+    """Output file for one (district, year) partition, e.g. out/BIRMINGHAM/2024.csv"""
+    safe_district = str(district).replace(' ', '_').replace('/', '_')
+    return os.path.join(output_dir, safe_district, f"{year}.csv")
+
+
+def ingest_districts(input_file, districts, output_dir='ppd_partitions', columns=None, chunksize=500000):
+    """
+    Single-pass multi-district ingest:
+    - Reads the national PPD file once, with column projection and declared dtypes
+    - Routes each chunk to every requested district at the same time
+    - Appends each (district, year) partition straight to its own CSV, so memory is bounded by one chunk
+    Returns a dict of {(district, year): rows written}.
+    """
+    columns = columns or INGEST_COLUMNS
+    wanted = {d.upper() for d in districts}
+    dtypes = {c: PPD_DTYPES[c] for c in columns}
+
+    print(f"Reading {input_file} for {len(wanted)} district(s)...")
+
+    chunks = pd.read_csv(input_file, names=PPD_COLUMNS, usecols=columns, dtype=dtypes, chunksize=chunksize)
+
+    written = {}
+    rows_read = 0
+    # Time spent parsing vs routing vs writing, reported with the stage record
+    phases = {'read_s': 0.0, 'route_s': 0.0, 'write_s': 0.0}
+    start = time.perf_counter()
+    with stage('filter_bham.ingest', districts=sorted(wanted)) as s:
+        while True:
+            tick = time.perf_counter()
+            chunk = next(chunks, None)
+            phases['read_s'] += time.perf_counter() - tick
+            if chunk is None:
+                break
+            rows_read += len(chunk)
+
+            # 1. Route: keep only rows for the requested districts
+            tick = time.perf_counter()
+            chunk = chunk[chunk['District'].isin(wanted)]
+            if chunk.empty:
+                phases['route_s'] += time.perf_counter() - tick
+                continue
+
+            # 2. Partition by district and year ('2024-01-05 00:00' -> '2024')
+            years = chunk['Date'].str[:4]
+            groups = chunk.groupby([chunk['District'].astype('str'), years], observed=True, sort=False)
+            phases['route_s'] += time.perf_counter() - tick
+
+            tick = time.perf_counter()
+            for (district, year), part in groups:
+                path = partition_path(output_dir, district, year)
+                key = (district, year)
+
+                # First write in this run truncates any stale partition and writes the header
+                first = key not in written
+                if first:
+                    os.makedirs(os.path.dirname(path), exist_ok=True)
+                part[columns].to_csv(path, mode='w' if first else 'a', header=first, index=False)
+                written[key] = written.get(key, 0) + len(part)
+            phases['write_s'] += time.perf_counter() - tick
+
+            elapsed = time.perf_counter() - start
+            print(f"  {rows_read:,} rows read ({rows_read / elapsed:,.0f} rows/sec)")
+
+        s.set(rows_in=rows_read, rows_out=sum(written.values()), partitions=len(written),
+            **{k: round(v, 4) for k, v in phases.items()})
+
+    elapsed = time.perf_counter() - start
+    total = sum(written.values())
+    print("-" * 30)
+    print(f"Read {rows_read:,} rows in {elapsed:.1f}s ({rows_read / max(elapsed, 1e-9):,.0f} rows/sec)")
+    print(f"Wrote {total:,} records into {len(written)} partition(s) under {output_dir}/")
+    for district in sorted(wanted - {d for d, _ in written}):
+        print(f"No records found for {district}. Check if the district name is correct.")
+
+    return written
 
 
 if __name__ == "__main__":
-    process_local_csv()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description='Filter the national Land Registry PPD file.')
+    parser.add_argument('--input', help='National PPD CSV (no header), e.g. pp-complete.csv')
+    parser.add_argument('--districts', nargs='+', help='Districts to extract in a single pass (enables ingest mode)')
+    parser.add_argument('--output-dir', default='ppd_partitions')
+    parser.add_argument('--chunksize', type=int, default=500000)
+    args = parser.parse_args()
+
+    if args.districts:
+        ingest_districts(args.input or 'uk_2025.csv', args.districts, args.output_dir, chunksize=args.chunksize)
+    else:
+        process_local_csv()
\ No newline at end of file
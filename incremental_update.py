@@ -0,0 +1,179 @@
+import argparse
+import json
+import os
+import sqlite3
+import time
+
+import pandas as pd
+
+from filter_bham import PPD_COLUMNS, PPD_DTYPES
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
+
+# Columns kept in the local transaction store (ID is the PPD Transaction unique identifier)
+STORE_COLUMNS = ['ID', 'Price', 'Date', 'Postcode', 'Type', 'Old_New', 'Duration', 'PAON', 'SAON', 'Street',
+    'District']
+
+# Running aggregates kept in the store, matching the V2 / V2.1 target encodings
+AGGREGATE_KEYS = {'area': ['Postcode_Area'], 'area_type': ['Postcode_Area', 'Type']}
+
+# sqlite's default limit on bound parameters per statement
+_SQL_BATCH = 900
+
+
+class TransactionStore:
+    """
+    Local PPD transaction store with running target-encoding aggregates:
+    - Transactions live in a sqlite table keyed by the PPD transaction ID
+    - Per-area and per-(area, type) counts/sums are TargetEncoder states kept in an `aggregates` table,
+      committed in the same transaction as each chunk's records, so a crash never leaves them out of step
+    - Only mainstream rows (Price <= price_cap) are counted, like the feature scripts
+    """
+
+    def __init__(self, directory='transaction_store', price_cap=1000000):
+        self.directory = directory
+        self.price_cap = price_cap
+        os.makedirs(directory, exist_ok=True)
+
+        self.db = sqlite3.connect(os.path.join(directory, 'transactions.db'))
+        columns = ', '.join(f"{c} {'INTEGER' if c == 'Price' else 'TEXT'}" for c in STORE_COLUMNS[1:])
+        self.db.execute(f"CREATE TABLE IF NOT EXISTS transactions (ID TEXT PRIMARY KEY, {columns})")
+        self.db.execute("CREATE TABLE IF NOT EXISTS aggregates (name TEXT PRIMARY KEY, state TEXT)")
+        self.db.commit()
+        self._load_aggregates()
+
+    def _aggregate_path(self, name):
+        return os.path.join(self.directory, f"{name}_aggregates.json")
+
+    def _load_aggregates(self):
+        # Committed state from the store; stores written before the aggregates table fall back to the JSON files
+        stored = dict(self.db.execute("SELECT name, state FROM aggregates"))
+        self.aggregates = {}
+        for name, keys in AGGREGATE_KEYS.items():
+            path = self._aggregate_path(name)
+            if name in stored:
+                self.aggregates[name] = TargetEncoder.from_dict(json.loads(stored[name]))
+            elif os.path.exists(path):
+                self.aggregates[name] = TargetEncoder.load(path)
+            else:
+                self.aggregates[name] = TargetEncoder(keys).fit(pd.DataFrame(columns=keys + ['Price']))
+
+    def _count(self, df, sign):
+        # Add (sign=1) or remove (sign=-1) mainstream rows from every running aggregate
+        df = df[df['Price'] <= self.price_cap]
+        if df.empty:
+            return
+        df = df.assign(Postcode_Area=postcode_area(df['Postcode']))
+        for encoder in self.aggregates.values():
+            encoder.update(df, sign)
+
+    def fetch(self, ids):
+        """Stored records for the given transaction IDs."""
+        frames = []
+        ids = list(ids)
+        for i in range(0, len(ids), _SQL_BATCH):
+            batch = ids[i:i + _SQL_BATCH]
+            placeholders = ', '.join('?' * len(batch))
+            frames.append(pd.read_sql_query(f"SELECT * FROM transactions WHERE ID IN ({placeholders})", self.db,
+                params=batch))
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=STORE_COLUMNS)
+
+    def apply(self, changes):
+        """
+        Apply one chunk of PPD records according to Record_Status:
+        - 'A' (addition) and 'C' (change) upsert the record, 'D' (delete) removes it
+        - Any stored version of a touched ID is first taken out of the aggregates, then the new version is added
+        - Records and aggregates are committed together; if the chunk fails, both roll back to the last chunk
+        Returns counts of added / changed / deleted records.
+        """
+        changes = changes.drop_duplicates('ID', keep='last')
+        status = changes['Record_Status'].astype('str')
+
+        upserts = changes[status.isin(['A', 'C'])]
+        deletes = changes[status == 'D']
+        rows = upserts[STORE_COLUMNS].astype(object).where(upserts[STORE_COLUMNS].notna(), None)
+        placeholders = ', '.join('?' * len(STORE_COLUMNS))
+        try:
+            # 1. Undo the contribution of every stored record this chunk touches
+            previous = self.fetch(changes['ID'])
+            self._count(previous, -1)
+            existing = set(previous['ID'])
+
+            # 2. Add the new versions back into the aggregates
+            self._count(upserts.assign(Price=upserts['Price'].astype('int64')), 1)
+
+            # 3. Write the delta and the updated aggregates in one transaction
+            with self.db:
+                self.db.executemany(f"INSERT OR REPLACE INTO transactions VALUES ({placeholders})",
+                    rows.itertuples(index=False, name=None))
+                self.db.executemany("DELETE FROM transactions WHERE ID = ?", ((i,) for i in deletes['ID']))
+                self.db.executemany("INSERT OR REPLACE INTO aggregates VALUES (?, ?)",
+                    ((name, json.dumps(encoder.to_dict())) for name, encoder in self.aggregates.items()))
+        except BaseException:
+            # The transaction rolled back: drop the in-memory updates too
+            self._load_aggregates()
+            raise
+
+        changed = upserts['ID'].isin(existing)
+        return {'added': int((~changed).sum()), 'changed': int(changed.sum()),
+            'deleted': int(deletes['ID'].isin(existing).sum())}
+
+    def save_aggregates(self):
+        # JSON copies of the committed aggregates, loadable with TargetEncoder.load
+        for name, encoder in self.aggregates.items():
+            with open(self._aggregate_path(name), 'w') as f:
+                json.dump(encoder.to_dict(), f)
+
+    def close(self):
+        self.save_aggregates()
+        self.db.close()
+
+
+def apply_change_file(change_file, store_dir='transaction_store', districts=None, chunksize=100000, header=False):
+    """
+    Incremental monthly refresh from a Land Registry change file (headerless PPD, Record_Status A/C/D):
+    - Streams the file in chunks, optionally restricted to some districts
+    - Applies upserts/deletes to the transaction store and updates the aggregates for the delta only
+    header=True reads a filtered CSV with a header row instead (e.g. to bootstrap the store from
+    birmingham_prices_real_2024.csv, where missing Record_Status means 'A').
+    """
+    store = TransactionStore(store_dir)
+    wanted = {d.upper() for d in districts} if districts else None
+
+    read_columns = STORE_COLUMNS + ['Record_Status']
+    dtypes = {c: PPD_DTYPES[c] for c in read_columns if c != 'Record_Status'}
+    if header:
+        chunks = pd.read_csv(change_file, dtype=dtypes, chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(change_file, names=PPD_COLUMNS, usecols=read_columns, dtype=dtypes, chunksize=chunksize)
+
+    totals = {'added': 0, 'changed': 0, 'deleted': 0}
+    rows = 0
+    start = time.perf_counter()
+    try:
+        for chunk in chunks:
+            rows += len(chunk)
+            if 'Record_Status' not in chunk.columns:
+                chunk['Record_Status'] = 'A'
+            if wanted is not None:
+                chunk = chunk[chunk['District'].astype('str').isin(wanted)]
+            for key, value in store.apply(chunk[read_columns]).items():
+                totals[key] += value
+    finally:
+        store.close()
+    elapsed = time.perf_counter() - start
+    print(f"Applied {change_file}: {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+    print(f"  added {totals['added']:,}, changed {totals['changed']:,}, deleted {totals['deleted']:,}")
+    return totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Apply a monthly PPD change file to the local transaction store.')
+    parser.add_argument('change_file')
+    parser.add_argument('--store', default='transaction_store')
+    parser.add_argument('--districts', nargs='+', default=None)
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--header', action='store_true', help='Input has a header row (filtered CSV)')
+    args = parser.parse_args()
+
+    apply_change_file(args.change_file, args.store, args.districts, args.chunksize, args.header)
\ No newline at end of file
@@ -0,0 +1,133 @@
+import contextlib
+import cProfile
+import hashlib
+import json
+import os
+import sys
+import time
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows: peak RSS and worker CPU time are reported as None there
+    resource = None
+
+# Where stage records go (JSON lines, appended); set to 'off' to disable
+METRICS_ENV = 'PIPELINE_METRICS'
+DEFAULT_METRICS_PATH = 'pipeline_metrics.jsonl'
+
+# Opt-in profiling: comma-separated stage names (or 'all') to run under cProfile, dumped to PIPELINE_PROFILE_DIR
+PROFILE_ENV = 'PIPELINE_PROFILE'
+PROFILE_DIR_ENV = 'PIPELINE_PROFILE_DIR'
+DEFAULT_PROFILE_DIR = 'profiles'
+
+# One id per process unless the caller groups several scripts under PIPELINE_RUN_ID (e.g. a nightly run)
+RUN_ID = os.environ.get('PIPELINE_RUN_ID') or f"{time.strftime('%Y%m%dT%H%M%S')}-{os.getpid()}"
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS; None without the resource module
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def file_sha256(path, block_size=1 << 20):
+    # Content hash used to key caches (prediction tables, price cubes, pipeline stages) to their inputs
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _children_cpu_s():
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _script_name():
+    return os.path.basename(sys.argv[0]) if sys.argv and sys.argv[0] else 'interactive'
+
+
+def _profiling(name):
+    wanted = {s.strip() for s in os.environ.get(PROFILE_ENV, '').split(',') if s.strip()}
+    return 'all' in wanted or name in wanted
+
+
+class StageRecord:
+    """Mutable record handed to the body of a stage, so it can report row counts once they are known."""
+
+    def __init__(self, name, rows_in=None, rows_out=None, fields=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = rows_out
+        self.fields = dict(fields or {})
+
+    def set(self, rows_in=None, rows_out=None, **fields):
+        if rows_in is not None:
+            self.rows_in = int(rows_in)
+        if rows_out is not None:
+            self.rows_out = int(rows_out)
+        self.fields.update(fields)
+
+
+def emit(record, path=None):
+    """Append one JSON line to the metrics file (PIPELINE_METRICS, default pipeline_metrics.jsonl)."""
+    path = path or os.environ.get(METRICS_ENV, DEFAULT_METRICS_PATH)
+    if path.lower() == 'off':
+        return
+    with open(path, 'a') as f:
+        f.write(json.dumps(record, default=str) + '\n')
+
+
+@contextlib.contextmanager
+def stage(name, rows_in=None, rows_out=None, **fields):
+    """
+    Instrument one pipeline stage:
+        with stage('feature_engineering_v2_1.read_csv') as s:
+            df = pd.read_csv(path)
+            s.set(rows_out=len(df))
+    Records wall time, CPU time (own and of finished worker processes), the process peak RSS (and how much
+    this stage raised it), rows in/out and rows/sec as one JSON line.
+    Stages named in PIPELINE_PROFILE run under cProfile and dump a .prof file.
+    """
+    record = StageRecord(name, rows_in, rows_out, fields)
+    profiler = cProfile.Profile() if _profiling(name) else None
+    rss_before = peak_rss_mb()
+    status = 'ok'
+    wall_start, cpu_start, children_start = time.perf_counter(), time.process_time(), _children_cpu_s()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    except BaseException:
+        status = 'error'
+        raise
+    finally:
+        if profiler:
+            profiler.disable()
+        wall = time.perf_counter() - wall_start
+        cpu = time.process_time() - cpu_start
+        children_cpu = _children_cpu_s() - children_start if resource else None
+        peak = peak_rss_mb()
+
+        rows = record.rows_in if record.rows_in is not None else record.rows_out
+        result = {'ts': time.strftime('%Y-%m-%dT%H:%M:%S'), 'run_id': RUN_ID, 'script': _script_name(),
+            'stage': name, 'status': status, 'wall_s': round(wall, 4), 'cpu_s': round(cpu, 4),
+            'child_cpu_s': round(children_cpu, 4) if resource else None,
+            'peak_rss_mb': round(peak, 1) if resource else None,
+            'peak_rss_growth_mb': round(peak - rss_before, 1) if resource else None,
+            'rows_in': record.rows_in, 'rows_out': record.rows_out,
+            'rows_per_sec': round(rows / max(wall, 1e-9)) if rows is not None else None}
+        result.update(record.fields)
+
+        if profiler:
+            profile_dir = os.environ.get(PROFILE_DIR_ENV, DEFAULT_PROFILE_DIR)
+            os.makedirs(profile_dir, exist_ok=True)
+            result['profile'] = os.path.join(profile_dir, f"{name}_{RUN_ID}.prof")
+            profiler.dump_stats(result['profile'])
+        emit(result)
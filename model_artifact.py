@@ -0,0 +1,167 @@
+import argparse
+import time
+
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+
+from compact_dtypes import read_transactions
+from feature_engineering_v2_1 import (V2_1_CATEGORICALS, V2_1_INPUT_COLUMNS, build_dense_matrix_v2_1,
+    build_matrix_v2_1)
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
+
+ARTIFACT_VERSION = 1
+
+# Feature layout transform() builds (feature_engineering_v2_1.py without the optional extra columns)
+ARTIFACT_FEATURE_SET = 'v2_1'
+
+# Other predictor classes ModelArtifact.load accepts, mapped to the version their files must carry.
+# Their modules register them on import, which unpickling the file triggers (e.g. model_hgb.HGBModel).
+ARTIFACT_TYPES = {}
+
+# Rows densified per forest call, so a scoring chunk never becomes one huge dense block
+# (100k rows x ~2,900 national outward-code columns would be ~1.2 GB of float32); ~64 MB per block
+DENSE_BLOCK_BYTES = 64 * 1024 * 1024
+
+# Model V3.1 hyperparameters (see model_v3_1.py)
+V3_1_PARAMS = {'n_estimators': 100, 'max_depth': 10, 'min_samples_leaf': 15, 'random_state': 42}
+
+
+class ModelArtifact:
+    """
+    Train-once bundle of everything needed to value new transactions:
+    - the fitted forest, the Area_Type_Avg target encoder and the one-hot vocabulary
+    - the target transform (model learns log1p(Price), predictions are expm1'd back to GBP)
+    - the feature set it was trained on, checked at load time against the layout transform() builds
+    Saved uncompressed with joblib so it can be loaded with mmap_mode='r'.
+    """
+
+    def __init__(self, model, area_type_encoder, onehot, target_transform='log1p', metadata=None,
+            feature_set=ARTIFACT_FEATURE_SET):
+        self.version = ARTIFACT_VERSION
+        self.feature_set = feature_set
+        self.model = model
+        self.area_type_encoder = area_type_encoder
+        self.onehot = onehot
+        self.target_transform = target_transform
+        self.metadata = metadata or {}
+
+    @property
+    def feature_names(self):
+        return ['Area_Type_Avg'] + self.onehot.feature_names
+
+    @property
+    def categories(self):
+        """Training vocabulary of each categorical input column."""
+        return self.onehot.vocab
+
+    def transform(self, df):
+        """Raw rows (Postcode, Type, Old_New, Duration) -> CSR matrix in the training layout."""
+        return build_matrix_v2_1(df, self.area_type_encoder, self.onehot)
+
+    def predict_matrix(self, X):
+        # Dense float32 is the forest's native input; sparse rows are densified one bounded block at a time
+        step = max(1, DENSE_BLOCK_BYTES // (4 * len(self.feature_names)))
+        predictions = np.empty(X.shape[0])
+        for i in range(0, X.shape[0], step):
+            block = X[i:i + step]
+            predictions[i:i + step] = self.model.predict(block.toarray() if hasattr(block, 'toarray') else block)
+        if self.target_transform == 'log1p':
+            predictions = np.expm1(predictions)
+        return predictions
+
+    def predict(self, df):
+        """Predicted prices in GBP for a frame of raw transactions."""
+        return self.predict_matrix(self.transform(df))
+
+    def save(self, path):
+        joblib.dump(self, path)
+        print(f"Saved model artifact to {path}")
+
+    @classmethod
+    def load(cls, path, mmap_mode='r'):
+        """Load a saved ModelArtifact, or a predictor of one of the registered ARTIFACT_TYPES."""
+        artifact = joblib.load(path, mmap_mode=mmap_mode)
+        if type(artifact) in ARTIFACT_TYPES:
+            if getattr(artifact, 'version', None) != ARTIFACT_TYPES[type(artifact)]:
+                raise ValueError(f"{path} is not a version {ARTIFACT_TYPES[type(artifact)]} "
+                    f"{type(artifact).__name__} artifact")
+            return artifact
+        if not isinstance(artifact, ModelArtifact) or getattr(artifact, 'version', None) != ARTIFACT_VERSION:
+            raise ValueError(f"{path} is not a version {ARTIFACT_VERSION} model artifact")
+        # Artifacts saved before the feature set was recorded all used the base V2.1 layout
+        feature_set = getattr(artifact, 'feature_set', ARTIFACT_FEATURE_SET)
+        if feature_set != ARTIFACT_FEATURE_SET:
+            raise ValueError(f"{path} was trained on feature set '{feature_set}', but scoring only builds "
+                f"'{ARTIFACT_FEATURE_SET}' (Area_Type_Avg + one-hot columns)")
+        n_features = getattr(artifact.model, 'n_features_in_', None)
+        if n_features is not None and n_features != len(artifact.feature_names):
+            raise ValueError(f"{path}: the model expects {n_features} features but transform() builds "
+                f"{len(artifact.feature_names)}")
+        return artifact
+
+
+def register_artifact_type(cls, version):
+    """Let ModelArtifact.load (and so score_batch, the prediction table and the server) load another predictor."""
+    ARTIFACT_TYPES[cls] = version
+    return cls
+
+
+def fit_v3_1_artifact(train_df, price_cap=1000000, smoothing=0.0, n_jobs=None, **params):
+    """
+    Fit the V2.1 encoders and the V3.1 forest once and bundle them:
+    - Same recipe as feature_engineering_v2_1.py + model_v3_1.py (<= £1M filter, log1p target)
+    - Extra keyword arguments override the V3.1 forest hyperparameters
+    """
+    # 1. Filter the training transactions
+    train_df = train_df[train_df['Price'] <= price_cap].copy()
+    train_df['Postcode_Area'] = postcode_area(train_df['Postcode'])
+
+    # 2. Fit encoders on training data only
+    area_type_encoder = TargetEncoder(['Postcode_Area', 'Type'], smoothing=smoothing).fit(train_df)
+    onehot = SparseOneHotEncoder(V2_1_CATEGORICALS).fit(train_df)
+    X_train = build_dense_matrix_v2_1(train_df, area_type_encoder, onehot)
+    y_train_log = np.log1p(train_df['Price'].to_numpy())
+
+    # 3. Train the forest
+    model_params = dict(V3_1_PARAMS, n_jobs=n_jobs, **params)
+    print(f"Training Model V3.1 artifact on {len(train_df)} records...")
+    start = time.perf_counter()
+    model = RandomForestRegressor(**model_params)
+    model.fit(X_train, y_train_log)
+    print(f"Trained in {time.perf_counter() - start:.1f}s")
+
+    metadata = {'n_train': len(train_df), 'price_cap': price_cap, 'params': model_params,
+        'feature_set': ARTIFACT_FEATURE_SET}
+    return ModelArtifact(model, area_type_encoder, onehot, metadata=metadata)
+
+
+def train_v3_1_artifact(train_path, price_cap=1000000, smoothing=0.0, n_jobs=None, **params):
+    """Load a training CSV (e.g. birmingham_prices_real_2024.csv) and fit the V3.1 artifact on it."""
+    train_df = read_transactions(train_path, ['Price'] + V2_1_INPUT_COLUMNS)
+    artifact = fit_v3_1_artifact(train_df, price_cap, smoothing, n_jobs, **params)
+    artifact.metadata['train_path'] = str(train_path)
+    return artifact
+
+
+if __name__ == "__main__":
+    # Train through the imported module: an artifact built by this script's own copy of the class would be
+    # pickled as __main__.ModelArtifact, which score_batch and the server cannot load
+    import model_artifact
+    from model_hgb import train_hgb_model
+
+    parser = argparse.ArgumentParser(description='Train the V3.1 model once and save it as an artifact.')
+    parser.add_argument('--train', default='birmingham_prices_real_2024.csv')
+    parser.add_argument('--output', default='model_v3_1.joblib')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    parser.add_argument('--backend', choices=['forest', 'hgb'], default='forest',
+        help="'hgb' saves the HistGradientBoosting backend of model_hgb.py instead of the V3.1 forest")
+    args = parser.parse_args()
+
+    if args.backend == 'hgb':
+        artifact = train_hgb_model(args.train)
+    else:
+        artifact = model_artifact.train_v3_1_artifact(args.train, n_jobs=args.n_jobs)
+    artifact.save(args.output)
\ No newline at end of file
@@ -0,0 +1,156 @@
+import argparse
+import io
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import HistGradientBoostingRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from compact_dtypes import read_transactions
+from feature_engineering_v2_1 import V2_1_INPUT_COLUMNS
+from model_artifact import fit_v3_1_artifact, register_artifact_type
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
+
+PRICE_CAP = 1000000
+HGB_MODEL_VERSION = 1
+
+# Integer-coded categorical inputs (no one-hot expansion) plus the composite target encoding.
+# Native categorical splits allow at most max_bins (255) categories per column, i.e. one district's outward codes;
+# columns with more categories (national Postcode_Area) are target-encoded instead.
+HGB_CATEGORICALS = ['Postcode_Area', 'Type', 'Old_New', 'Duration']
+HGB_PARAMS = {'max_iter': 300, 'learning_rate': 0.1, 'max_leaf_nodes': 31, 'min_samples_leaf': 15,
+    'l2_regularization': 1.0, 'random_state': 42}
+
+
+class HGBModel:
+    """
+    Histogram gradient-boosting backend for the V3.1 recipe:
+    - Postcode_Area / Type / Old_New / Duration go in as integer codes with native categorical splits
+    - Area_Type_Avg is kept as the one numeric feature; same log1p target as the forest
+    - A categorical column with more than max_bins categories falls back to its own target encoding
+    Exposes predict(df) on raw transactions, like ModelArtifact, so it plugs into the same scoring code;
+    saved with joblib and registered with ModelArtifact.load.
+    """
+
+    def __init__(self, **params):
+        self.version = HGB_MODEL_VERSION
+        self.params = dict(HGB_PARAMS, **params)
+        self.categories = None
+        self.area_type_encoder = None
+        self.column_encoders = {}
+        self.model = None
+
+    def _matrix(self, df):
+        if 'Postcode_Area' not in df.columns:
+            df = df.assign(Postcode_Area=postcode_area(df['Postcode']))
+        columns = [self.area_type_encoder.transform(df)]
+        for col in HGB_CATEGORICALS:
+            if col in self.column_encoders:
+                columns.append(self.column_encoders[col].transform(df))
+            else:
+                # Unseen categories get code -1 -> NaN, which HGB routes like a missing value
+                codes = pd.Categorical(pd.Series(df[col]).astype('str'), categories=self.categories[col]).codes
+                columns.append(np.where(codes < 0, np.nan, codes))
+        return np.column_stack(columns).astype(np.float64)
+
+    def fit(self, train_df):
+        train_df = train_df.assign(Postcode_Area=postcode_area(train_df['Postcode']))
+        self.categories = {col: sorted(pd.Series(train_df[col]).dropna().astype('str').unique())
+            for col in HGB_CATEGORICALS}
+        self.area_type_encoder = TargetEncoder(['Postcode_Area', 'Type']).fit(train_df)
+
+        # sklearn rejects native categorical columns with more categories than max_bins
+        max_bins = self.params.get('max_bins', 255)
+        self.column_encoders = {col: TargetEncoder([col]).fit(train_df) for col in HGB_CATEGORICALS
+            if len(self.categories[col]) > max_bins}
+        for col in self.column_encoders:
+            print(f"{col} has {len(self.categories[col]):,} categories (> max_bins={max_bins}); "
+                f"using its target encoding instead of native categorical splits")
+
+        # Column 0 is Area_Type_Avg, columns 1.. are the categorical codes (or target means)
+        categorical_mask = [False] + [col not in self.column_encoders for col in HGB_CATEGORICALS]
+        self.model = HistGradientBoostingRegressor(categorical_features=categorical_mask, **self.params)
+        self.model.fit(self._matrix(train_df), np.log1p(train_df['Price'].to_numpy()))
+        return self
+
+    def predict(self, df):
+        return np.expm1(self.model.predict(self._matrix(df)))
+
+    def save(self, path):
+        joblib.dump(self, path)
+        print(f"Saved HGB model artifact to {path}")
+
+    @classmethod
+    def load(cls, path):
+        model = joblib.load(path)
+        if not isinstance(model, cls) or getattr(model, 'version', None) != HGB_MODEL_VERSION:
+            raise ValueError(f"{path} is not a version {HGB_MODEL_VERSION} HGB model artifact")
+        return model
+
+
+register_artifact_type(HGBModel, HGB_MODEL_VERSION)
+
+
+def train_hgb_model(train_path, price_cap=PRICE_CAP, **params):
+    """Load a training CSV (e.g. birmingham_prices_real_2024.csv) and fit the HGB backend on it."""
+    train_df = read_transactions(train_path, ['Price'] + V2_1_INPUT_COLUMNS)
+    return HGBModel(**params).fit(train_df[train_df['Price'] <= price_cap])
+
+
+def _model_size_mb(model):
+    buffer = io.BytesIO()
+    joblib.dump(model, buffer)
+    return buffer.tell() / (1024 * 1024)
+
+
+def compare_backends(train_path, test_path, n_jobs=None):
+    """
+    Side-by-side report of the V3.1 forest (one-hot) vs the HGB backend (native categoricals):
+    fit time, predict throughput, serialized model size and MAE/R2 on the mainstream test set.
+    """
+    usecols = ['Price'] + V2_1_INPUT_COLUMNS
+    train_df = read_transactions(train_path, usecols)
+    test_df = read_transactions(test_path, usecols)
+    train_df = train_df[train_df['Price'] <= PRICE_CAP].copy()
+    test_df = test_df[test_df['Price'] <= PRICE_CAP].copy()
+
+    backends = {'RandomForest V3.1 (one-hot)': lambda: fit_v3_1_artifact(train_df, PRICE_CAP, n_jobs=n_jobs),
+        'HistGradientBoosting (native categoricals)': lambda: HGBModel().fit(train_df)}
+
+    rows = []
+    for name, fit in backends.items():
+        start = time.perf_counter()
+        model = fit()
+        fit_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        predictions_real = model.predict(test_df)
+        predict_seconds = time.perf_counter() - start
+
+        rows.append({'Backend': name, 'Fit (s)': round(fit_seconds, 2),
+            'Predict (rows/s)': round(len(test_df) / max(predict_seconds, 1e-9)),
+            'Model size (MB)': round(_model_size_mb(model), 2),
+            'MAE (£)': round(mean_absolute_error(test_df['Price'], predictions_real), 2),
+            'R2': round(r2_score(test_df['Price'], predictions_real), 4)})
+
+    report = pd.DataFrame(rows)
+    print("-" * 30)
+    print(f"Backend comparison ({len(train_df)} train / {len(test_df)} test records):")
+    print(report.to_string(index=False))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Compare the HGB backend against the V3.1 Random Forest.')
+    parser.add_argument('--train', default='birmingham_prices_real_2024.csv')
+    parser.add_argument('--test', default='birmingham_prices_real_2025.csv')
+    parser.add_argument('--n-jobs', type=int, default=None, help='Threads for the forest')
+    parser.add_argument('--report', default='backend_comparison.csv')
+    args = parser.parse_args()
+
+    report = compare_backends(args.train, args.test, args.n_jobs)
+    report.to_csv(args.report, index=False)
+    print(f"Saved report to {args.report}")
\ No newline at end of file
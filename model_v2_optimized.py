@@ -1,87 +1,73 @@
-import matplotlib
-
-# Force the backend to TkAgg for macOS compatibility to ensure the window pops up
-matplotlib.use('TkAgg')
-
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-import seaborn as sns
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_absolute_error, r2_score
 
-# 1. Load Data
-train_df = pd.read_csv('train_features_2024.csv')
-test_df = pd.read_csv('test_features_2025.csv')
-
-# 2. IMPORTANT: Filter Outliers (Only focus on properties <= £1,000,000)
-# This handles the skewness issue you identified in V1
-train_df = train_df[train_df['Price'] <= 1000000]
-test_df = test_df[test_df['Price'] <= 1000000]
-
-# 3. Alignment
-common_cols = list(set(train_df.columns) & set(test_df.columns))
-train_df = train_df[common_cols]
-test_df = test_df[common_cols]
-
-# 4. Feature/Target Split & Log Transformation
-# Normalizing the distribution to improve R2 score
-X_train = train_df.drop('Price', axis=1)
-y_train_log = np.log1p(train_df['Price'])
-
-X_test = test_df.drop('Price', axis=1)
-y_test_real = test_df['Price']
-
-# 5. Train Model
-print("Training Optimized Model (V2) with Log Transformation...")
-model = RandomForestRegressor(n_estimators=100, random_state=42)
-model.fit(X_train, y_train_log)
-
-# 6. Predict and Convert Back from Log
-predictions_log = model.predict(X_test)
-predictions_real = np.expm1(predictions_log)  # Convert log back to GBP
-
-# 7. Evaluation
-mae = mean_absolute_error(y_test_real, predictions_real)
-r2 = r2_score(y_test_real, predictions_real)
-
-print("-" * 30)
-print(f"V2 Performance (Under £1M Market):")
-print(f"Average Error (MAE): £{mae:.2f}")
-print(f"Model Reliability (R2): {r2:.4f}")
-
-
-# ---------------------------------------------------------
-# 8. NEW: Feature Importance Visualization
-# ---------------------------------------------------------
-def plot_feature_importance(model, X_train):
-    importances = model.feature_importances_
-    feature_names = X_train.columns
-
-    feature_importance_df = pd.DataFrame({'Feature': feature_names, 'Importance': importances}).sort_values(
-        by='Importance', ascending=False)
-
-    plt.figure(figsize=(12, 8))
-    sns.barplot(x='Importance', y='Feature', data=feature_importance_df.head(15), palette='magma', hue='Feature',
-        legend=False)
-    plt.title('Top 15 Influential Factors - Birmingham Optimized Model', fontsize=16)
-    plt.xlabel('Importance Score', fontsize=12)
-    plt.tight_layout()
-    plt.savefig('feature_importance_v2.png')
-    plt.show(block=True)
-
-
-# Execute the new visualization
-plot_feature_importance(model, X_train)
-
-# ---------------------------------------------------------
-# 9. Visualization: Actual vs Predicted
-# ---------------------------------------------------------
-plt.figure(figsize=(10, 6))
-plt.scatter(y_test_real, predictions_real, alpha=0.3, color='green')
-plt.plot([y_test_real.min(), y_test_real.max()], [y_test_real.min(), y_test_real.max()], 'r--', lw=2)
-plt.xlabel('Actual Price (£)')
-plt.ylabel('Predicted Price (£)')
-plt.title('V2 Optimized: Actual vs Predicted (Mainstream Market)')
-plt.savefig('results_v2_optimized.png')
-plt.show(block=True)
\ No newline at end of file
+from compact_forest import CompactForest
+from instrumentation import stage
+from render_reports import render_reports
+
+
+if __name__ == "__main__":
+    # 1. Load Data
+    with stage('model_v2.load') as s:
+        train_df = pd.read_csv('train_features_2024.csv')
+        test_df = pd.read_csv('test_features_2025.csv')
+        s.set(rows_out=len(train_df) + len(test_df))
+
+    # 2. IMPORTANT: Filter Outliers (Only focus on properties <= £1,000,000)
+    # This handles the skewness issue you identified in V1
+    train_df = train_df[train_df['Price'] <= 1000000]
+    test_df = test_df[test_df['Price'] <= 1000000]
+
+    # 3. Alignment
+    # Keep the training column order so the layout is identical on every run
+    common_cols = [c for c in train_df.columns if c in set(test_df.columns)]
+    train_df = train_df[common_cols]
+    test_df = test_df[common_cols]
+
+    # 4. Feature/Target Split & Log Transformation
+    # Normalizing the distribution to improve R2 score
+    X_train = train_df.drop('Price', axis=1)
+    y_train_log = np.log1p(train_df['Price'])
+
+    X_test = test_df.drop('Price', axis=1)
+    y_test_real = test_df['Price']
+
+    # 5. Train Model
+    print("Training Optimized Model (V2) with Log Transformation...")
+    model = RandomForestRegressor(n_estimators=100, random_state=42)
+    with stage('model_v2.fit', rows_in=len(X_train), features=X_train.shape[1]):
+        model.fit(X_train, y_train_log)
+
+    # 6. Predict and Convert Back from Log
+    with stage('model_v2.predict', rows_in=len(X_test), rows_out=len(X_test)):
+        predictions_log = model.predict(X_test)
+        predictions_real = np.expm1(predictions_log)  # Convert log back to GBP
+
+    # Export the forest as compact node arrays (memory-mappable, bit-identical predictions; see compact_forest.py)
+    with stage('model_v2.export'):
+        CompactForest.from_sklearn(model).save('model_v2_compact.joblib')
+
+    # 7. Evaluation
+    mae = mean_absolute_error(y_test_real, predictions_real)
+    r2 = r2_score(y_test_real, predictions_real)
+
+    print("-" * 30)
+    print(f"V2 Performance (Under £1M Market):")
+    print(f"Average Error (MAE): £{mae:.2f}")
+    print(f"Model Reliability (R2): {r2:.4f}")
+
+    # ---------------------------------------------------------
+    # 8-9. Visualization: Feature Importance + Actual vs Predicted
+    # Rendered headless in parallel worker processes (large test sets are drawn as a density plot)
+    # ---------------------------------------------------------
+    with stage('model_v2.render'):
+        render_reports([
+            ('feature_importance', {'output_path': 'feature_importance_v2.png', 'features': X_train.columns,
+                'importances': model.feature_importances_, 'palette': 'magma',
+                'title': 'Top 15 Influential Factors - Birmingham Optimized Model'}),
+            ('actual_vs_predicted', {'output_path': 'results_v2_optimized.png', 'y_true': y_test_real,
+                'y_pred': predictions_real, 'color': 'green',
+                'title': 'V2 Optimized: Actual vs Predicted (Mainstream Market)'}),
+        ])
@@ -0,0 +1,125 @@
+import json
+
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+
+class SparseOneHotEncoder:
+    """
+    Schema-bound one-hot encoder replacing per-file pd.get_dummies:
+    - The category vocabulary is fitted once on training data and then fixed
+    - Column layout (and names, e.g. 'Postcode_Area_B15') is identical on every run and for every dataset
+    - Emits scipy CSR matrices, or a dense bool frame for the Parquet hand-off
+    Unseen categories: handle_unknown='ignore' encodes them as all zeros, 'error' raises ValueError.
+    """
+
+    def __init__(self, columns, handle_unknown='ignore'):
+        if handle_unknown not in ('ignore', 'error'):
+            raise ValueError("handle_unknown must be 'ignore' or 'error'")
+        self.columns = list(columns)
+        self.handle_unknown = handle_unknown
+        self.vocab = None
+
+    def fit(self, df):
+        self.vocab = {}
+        for col in self.columns:
+            values = pd.Series(df[col]).dropna().astype('str').unique()
+            self.vocab[col] = sorted(values)
+        return self
+
+    def update(self, df):
+        """Add the categories of another chunk of training rows (vocabulary fitted over a stream of chunks)."""
+        if self.vocab is None:
+            return self.fit(df)
+        for col in self.columns:
+            values = pd.Series(df[col]).dropna().astype('str').unique()
+            self.vocab[col] = sorted(set(self.vocab[col]).union(values))
+        return self
+
+    @property
+    def feature_names(self):
+        return [f"{col}_{value}" for col in self.columns for value in self.vocab[col]]
+
+    @property
+    def n_features(self):
+        return sum(len(v) for v in self.vocab.values())
+
+    def _positions(self, df):
+        # (row, column) positions of the ones, one block of columns per categorical feature
+        rows, cols = [], []
+        offset = 0
+        row_ids = np.arange(len(df))
+        for col in self.columns:
+            categories = self.vocab[col]
+            values = pd.Series(df[col]).astype('str')
+            codes = pd.Categorical(values, categories=categories).codes
+            known = codes >= 0
+            if self.handle_unknown == 'error' and not known.all():
+                unseen = sorted(set(values[~known].dropna()))
+                raise ValueError(f"Unseen categories in '{col}': {unseen[:10]}")
+            rows.append(row_ids[known])
+            cols.append(codes[known].astype('int64') + offset)
+            offset += len(categories)
+        return np.concatenate(rows), np.concatenate(cols)
+
+    def category_codes(self, df, dtype=np.int32):
+        """
+        (rows, len(columns)) category codes in vocabulary order, -1 for unseen values:
+        the compact form of the one-hot block, expanded again with codes_to_csr.
+        """
+        codes = np.empty((len(df), len(self.columns)), dtype=dtype)
+        for j, col in enumerate(self.columns):
+            codes[:, j] = pd.Categorical(pd.Series(df[col]).astype('str'), categories=self.vocab[col]).codes
+        return codes
+
+    def codes_to_csr(self, codes, dtype=np.float32):
+        """CSR one-hot block (same layout as transform) from a category_codes array."""
+        offsets = np.cumsum([0] + [len(self.vocab[col]) for col in self.columns[:-1]])
+        known = codes >= 0
+        rows = np.nonzero(known)[0]
+        cols = (codes.astype('int64') + offsets)[known]
+        data = np.ones(len(rows), dtype=dtype)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(codes), self.n_features))
+
+    def transform(self, df, dtype=np.float32):
+        """CSR matrix of shape (rows, n_features)."""
+        rows, cols = self._positions(df)
+        data = np.ones(len(rows), dtype=dtype)
+        return sparse.csr_matrix((data, (rows, cols)), shape=(len(df), self.n_features))
+
+    def transform_dense(self, df, out=None, dtype=np.float32):
+        """
+        Dense (rows, n_features) one-hot block, written straight into `out` when given
+        (e.g. a column slice of a preallocated model matrix), so no sparse or frame copy is made.
+        """
+        if out is None:
+            out = np.empty((len(df), self.n_features), dtype=dtype)
+        out[...] = 0
+        rows, cols = self._positions(df)
+        out[rows, cols] = 1
+        return out
+
+    def to_frame(self, df):
+        """Dense bool frame with get_dummies-style column names, aligned to df's index."""
+        rows, cols = self._positions(df)
+        dense = np.zeros((len(df), self.n_features), dtype=bool)
+        dense[rows, cols] = True
+        return pd.DataFrame(dense, columns=self.feature_names, index=df.index)
+
+    def encode(self, df):
+        """Drop-in replacement for pd.get_dummies(df, columns=self.columns) with the fitted layout."""
+        return pd.concat([df.drop(columns=self.columns), self.to_frame(df)], axis=1)
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({'columns': self.columns, 'handle_unknown': self.handle_unknown, 'vocab': self.vocab}, f)
+        print(f"Saved one-hot vocabulary ({self.n_features} columns) to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            state = json.load(f)
+        encoder = cls(state['columns'], handle_unknown=state['handle_unknown'])
+        encoder.vocab = state['vocab']
+        return encoder
\ No newline at end of file
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+# Hierarchy levels of a UK postcode, e.g. 'B15 2TT':
+#   area 'B' -> district 'B15' -> sector 'B15 2' -> unit 'B15 2TT'
+# Note: the feature scripts call the district level (outward code) 'Postcode_Area'.
+POSTCODE_LEVELS = ['area', 'district', 'sector', 'unit']
+
+
+def _intern_level(values, row_codes):
+    # Factorize the per-unique values once, then gather them back to rows via the integer codes
+    level_codes, categories = pd.factorize(values, sort=True)
+    codes = np.full(len(row_codes), -1, dtype=level_codes.dtype)
+    found = row_codes >= 0
+    codes[found] = level_codes[row_codes[found]]
+    return pd.Categorical.from_codes(codes, categories=categories)
+
+
+def parse_postcodes(postcodes):
+    """
+    Vectorized postcode hierarchy parser:
+    - Factorizes the column once so each distinct postcode is parsed only once
+    - Splits the distinct values with whole-column string ops (no per-row Python lambda)
+    - Returns area, district, sector and unit levels as categoricals aligned to the input index
+    Missing or blank postcodes come back as missing at every level.
+    """
+    postcodes = pd.Series(postcodes)
+    row_codes, uniques = pd.factorize(postcodes)
+
+    unit = pd.Series(uniques, dtype='object').astype('str').str.strip().str.upper().str.replace(r'\s+', ' ',
+        regex=True)
+    # Object dtype even when there is nothing to split (no distinct postcodes, e.g. an all-missing column)
+    parts = unit.str.split(' ', n=1, expand=True).reindex(columns=[0, 1]).astype('object')
+    district = parts[0]
+    inward = parts[1].fillna('')
+    sector = (district + ' ' + inward.str[:1]).where(inward != '', district)
+    area = district.str.extract(r'^([A-Z]+)', expand=False).fillna(district)
+
+    # Blank strings behave like missing postcodes
+    valid = unit != ''
+    levels = {'area': area, 'district': district, 'sector': sector, 'unit': unit}
+
+    result = {}
+    for name in POSTCODE_LEVELS:
+        values = levels[name].where(valid).to_numpy(dtype='object')
+        result[name] = _intern_level(values, row_codes)
+
+    return pd.DataFrame(result, index=postcodes.index)
+
+
+def postcode_area(postcodes):
+    """Outward code used as 'Postcode_Area' by the feature scripts (e.g. 'B15 2TT' -> 'B15'), as a categorical."""
+    return parse_postcodes(postcodes)['district']
+
+
+def postcode_key(postcodes):
+    """Join key: upper-case postcode without spaces ('b15 2tt' -> 'B152TT'), NaN if missing."""
+    postcodes = pd.Series(postcodes)
+    return postcodes.astype('str').str.upper().str.replace(r'\s+', '', regex=True).where(postcodes.notna())
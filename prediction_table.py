@@ -0,0 +1,103 @@
+import argparse
+import itertools
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from feature_engineering_v2_1 import V2_1_CATEGORICALS
+from instrumentation import file_sha256
+from model_artifact import ModelArtifact
+from postcode_utils import postcode_area
+
+
+class PredictionTable:
+    """
+    Precomputed V3.1 predictions for the whole (Postcode_Area, Type, Old_New, Duration) feature space:
+    - Every V3.1 feature is a function of these four columns, so the space is only a few thousand combinations
+    - Each dimension gets one extra 'unseen' slot (global mean / all-zero one-hot), matching the artifact exactly
+    - Prices live in one flat array indexed by a mixed-radix code; lookups replace forest traversals
+    The table records the SHA-256 of the artifact it was built from and is rebuilt when that changes.
+    """
+
+    def __init__(self, vocab, prices, artifact_sha256):
+        self.vocab = vocab
+        self.prices = prices
+        self.artifact_sha256 = artifact_sha256
+        self.index = {col: {v: i for i, v in enumerate(values)} for col, values in vocab.items()}
+        self.shape = tuple(len(vocab[col]) + 1 for col in V2_1_CATEGORICALS)
+
+    @classmethod
+    def build(cls, artifact, artifact_sha256):
+        vocab = {col: list(artifact.categories[col]) for col in V2_1_CATEGORICALS}
+
+        # 1. Enumerate every combination once; None is the 'unseen' slot of each dimension
+        grid = list(itertools.product(*[vocab[col] + [None] for col in V2_1_CATEGORICALS]))
+        combos = pd.DataFrame(grid, columns=V2_1_CATEGORICALS)
+
+        # 2. One vectorized predict call for the whole space (product order == mixed-radix code order)
+        start = time.perf_counter()
+        prices = artifact.predict(combos)
+        print(f"Built prediction table: {len(combos):,} combinations in {time.perf_counter() - start:.2f}s")
+        return cls(vocab, prices.astype(np.float64), artifact_sha256)
+
+    def encode(self, df):
+        """Mixed-radix code per row; values outside the training vocabulary map to the 'unseen' slot."""
+        if 'Postcode_Area' not in df.columns:
+            df = df.assign(Postcode_Area=postcode_area(df['Postcode']))
+        codes = np.zeros(len(df), dtype=np.int64)
+        for col, size in zip(V2_1_CATEGORICALS, self.shape):
+            col_codes = pd.Categorical(pd.Series(df[col]).astype('str'), categories=self.vocab[col]).codes
+            col_codes = np.where(col_codes < 0, size - 1, col_codes)
+            codes = codes * size + col_codes
+        return codes
+
+    def predict(self, df):
+        """Predicted prices in GBP, same as ModelArtifact.predict but as an array gather."""
+        return self.prices[self.encode(df)]
+
+    def quote(self, postcode, property_type, old_new, duration):
+        """Single-property hash lookup, e.g. table.quote('B15 2TT', 'D', 'N', 'F')."""
+        values = [(str(postcode).upper().split() or [''])[0], property_type, old_new, duration]
+        code = 0
+        for col, value, size in zip(V2_1_CATEGORICALS, values, self.shape):
+            code = code * size + self.index[col].get(str(value), size - 1)
+        return float(self.prices[code])
+
+    def save(self, path):
+        np.savez(path, prices=self.prices, artifact_sha256=np.array(self.artifact_sha256),
+            **{f"vocab_{col}": np.array(self.vocab[col], dtype=object) for col in V2_1_CATEGORICALS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            vocab = {col: list(data[f"vocab_{col}"]) for col in V2_1_CATEGORICALS}
+            return cls(vocab, data['prices'], str(data['artifact_sha256']))
+
+
+def load_or_build_table(artifact_path='model_v3_1.joblib', table_path=None):
+    """Load the table for this artifact, rebuilding (and re-saving) it if missing or built from another artifact."""
+    table_path = table_path or os.path.splitext(artifact_path)[0] + '_table.npz'
+    artifact_sha256 = file_sha256(artifact_path)
+
+    if os.path.exists(table_path):
+        table = PredictionTable.load(table_path)
+        if table.artifact_sha256 == artifact_sha256:
+            return table
+        print(f"{table_path} was built from a different model artifact; rebuilding...")
+
+    table = PredictionTable.build(ModelArtifact.load(artifact_path), artifact_sha256)
+    table.save(table_path)
+    print(f"Saved prediction table to {table_path}")
+    return table
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Precompute V3.1 predictions for the finite feature space.')
+    parser.add_argument('--artifact', default='model_v3_1.joblib')
+    parser.add_argument('--table', default=None, help='Defaults to <artifact>_table.npz')
+    args = parser.parse_args()
+
+    table = load_or_build_table(args.artifact, args.table)
+    print(f"Table covers {len(table.prices):,} combinations ({table.prices.nbytes / 1024:.1f} KB)")
\ No newline at end of file
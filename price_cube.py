@@ -0,0 +1,278 @@
+import argparse
+import os
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import file_sha256
+from postcode_utils import postcode_area
+
+# Saved cube layout; files of another version are rebuilt by load_or_build_cube
+CUBE_VERSION = 2
+
+# Cube dimensions, in mixed-radix order. Postcode_Area is the outward code ('B15'), as in the feature scripts,
+# not the PPD 'District' column (the local authority, e.g. 'BIRMINGHAM').
+CUBE_DIMENSIONS = ['Postcode_Area', 'Type', 'Month', 'Price_Band']
+
+# Lower edges of the (lo, hi] price bands. Caps on an edge select whole bands exactly; a cap inside a band
+# is estimated from that band's sketch, interpolating the sketch bin that holds the cap
+DEFAULT_BAND_EDGES = [0, 100000, 200000, 300000, 400000, 500000, 600000, 700000, 800000, 900000, 1000000,
+    1500000, 2000000, 5000000]
+
+# Quantile sketch: log-spaced price bins with ratio SKETCH_GAMMA (~1% relative error) from SKETCH_MIN upwards
+SKETCH_GAMMA = 1.02
+SKETCH_MIN = 1000.0
+SKETCH_BINS = 600
+
+
+def _sketch_bins(prices):
+    bins = np.floor(np.log(np.maximum(prices, SKETCH_MIN) / SKETCH_MIN) / np.log(SKETCH_GAMMA))
+    return np.clip(bins, 0, SKETCH_BINS - 1).astype(np.int64)
+
+
+def _sketch_values():
+    # Representative value of each bin (relative error at most (gamma - 1) / (gamma + 1))
+    return SKETCH_MIN * SKETCH_GAMMA ** np.arange(SKETCH_BINS) * 2 * SKETCH_GAMMA / (1 + SKETCH_GAMMA)
+
+
+class PriceCube:
+    """
+    Precomputed price statistics by Postcode_Area (outward code) x Type x Month x Price_Band:
+    - Dense count / sum / sum-of-squares arrays, one cell per combination
+    - A sparse log-binned histogram per cell, so medians and other quantiles merge across cells
+    - Built in one pass over the transactions; every slice (by type, by month, mean vs median,
+      other price caps) is a sum over cube axes instead of a fresh groupby over the rows
+    """
+
+    def __init__(self, labels, counts, sums, sumsq, sketch_cells, sketch_bins, sketch_counts, sources=None):
+        self.labels = labels
+        self.counts = counts
+        self.sums = sums
+        self.sumsq = sumsq
+        self.sketch_cells = sketch_cells
+        self.sketch_bins = sketch_bins
+        self.sketch_counts = sketch_counts
+        self.sources = sources or {}
+        self.shape = tuple(len(labels[dim]) for dim in CUBE_DIMENSIONS)
+
+    @property
+    def band_edges(self):
+        return [int(label.split('-')[0]) for label in self.labels['Price_Band']]
+
+    @classmethod
+    def build(cls, df, band_edges=None, sources=None):
+        """Single pass over transactions with Price, Date, Postcode and Type columns."""
+        start = time.perf_counter()
+        band_edges = list(band_edges or DEFAULT_BAND_EDGES)
+        prices = df['Price'].to_numpy(np.float64)
+
+        # 1. One integer code per dimension
+        dims = {'Postcode_Area': postcode_area(df['Postcode']).array,
+            'Type': pd.Categorical(pd.Series(df['Type']).astype('str')),
+            'Month': pd.Categorical(pd.to_datetime(df['Date']).dt.strftime('%Y-%m'))}
+        labels = {dim: [str(v) for v in values.categories] for dim, values in dims.items()}
+        codes = {dim: np.asarray(values.codes, dtype=np.int64) for dim, values in dims.items()}
+        # Bands are right-closed (lo, hi], so 'Price <= cap' selects whole bands
+        codes['Price_Band'] = np.maximum(np.searchsorted(band_edges, prices, side='left') - 1, 0)
+        labels['Price_Band'] = [f"{lo}-{hi}" for lo, hi in zip(band_edges, band_edges[1:] + [''])]
+
+        # 2. Mixed-radix cell code; rows without a postcode/date fall outside the cube
+        valid = np.logical_and.reduce([codes[dim] >= 0 for dim in CUBE_DIMENSIONS])
+        cells = np.zeros(len(df), dtype=np.int64)
+        for dim in CUBE_DIMENSIONS:
+            cells = cells * len(labels[dim]) + codes[dim]
+        cells, prices = cells[valid], prices[valid]
+
+        # 3. All aggregates from the same cell codes
+        size = int(np.prod([len(labels[dim]) for dim in CUBE_DIMENSIONS]))
+        shape = tuple(len(labels[dim]) for dim in CUBE_DIMENSIONS)
+        counts = np.bincount(cells, minlength=size).reshape(shape)
+        sums = np.bincount(cells, weights=prices, minlength=size).reshape(shape)
+        sumsq = np.bincount(cells, weights=prices * prices, minlength=size).reshape(shape)
+        sketch_keys, sketch_counts = np.unique(cells * SKETCH_BINS + _sketch_bins(prices), return_counts=True)
+
+        print(f"Built price cube: {valid.sum():,} rows -> {np.count_nonzero(counts):,} non-empty cells "
+            f"in {time.perf_counter() - start:.2f}s")
+        return cls(labels, counts, sums, sumsq, sketch_keys // SKETCH_BINS, sketch_keys % SKETCH_BINS,
+            sketch_counts, sources)
+
+    def _selection(self, filters, price_cap):
+        # Boolean mask per axis from {dimension: value or list of values} plus an optional price cap.
+        # Returns (masks, partial): `partial` is the index of the band the cap falls inside (None if on an edge);
+        # it stays selected in the masks, and its rows above the cap are dropped via the sketch.
+        masks = []
+        for dim in CUBE_DIMENSIONS:
+            mask = np.ones(len(self.labels[dim]), dtype=bool)
+            if dim in filters:
+                wanted = filters[dim]
+                wanted = {str(v) for v in (wanted if isinstance(wanted, (list, tuple, set)) else [wanted])}
+                mask = np.isin(self.labels[dim], list(wanted))
+            masks.append(mask)
+
+        partial = None
+        if price_cap is not None:
+            lo = np.array(self.band_edges, dtype=np.float64)
+            hi = np.append(lo[1:], np.inf)
+            inside = np.flatnonzero((lo < price_cap) & (price_cap < hi) & masks[-1])
+            partial = int(inside[0]) if len(inside) else None
+            masks[-1] &= lo < price_cap
+        return masks, partial
+
+    def _sketch_selection(self, masks, kept, partial=None, price_cap=None):
+        # Sketch entries of the selected cells with their output group (mixed radix over the selected labels of
+        # the `kept` axes), Price_Band index and weight. In a partial band, bins above the cap are dropped and the
+        # bin holding the cap keeps the share of its (log-scale) width that lies below the cap.
+        cell_index = np.unravel_index(self.sketch_cells, self.shape)
+        selected = np.logical_and.reduce([mask[idx] for mask, idx in zip(masks, cell_index)])
+        weights = self.sketch_counts.astype(np.float64)
+        if partial is not None:
+            cap_bin = _sketch_bins(np.float64(price_cap))
+            share = np.clip(np.log(price_cap / (SKETCH_MIN * SKETCH_GAMMA ** cap_bin)) / np.log(SKETCH_GAMMA), 0, 1)
+            in_band = cell_index[-1] == partial
+            selected &= ~in_band | (self.sketch_bins <= cap_bin)
+            weights = np.where(in_band & (self.sketch_bins == cap_bin), weights * share, weights)
+
+        group = np.zeros(selected.sum(), dtype=np.int64)
+        for dim in kept:
+            axis = CUBE_DIMENSIONS.index(dim)
+            # Position of the label among the selected labels of this axis
+            positions = np.cumsum(masks[axis]) - 1
+            group = group * masks[axis].sum() + positions[cell_index[axis][selected]]
+        return selected, group, cell_index[-1][selected], weights[selected]
+
+    def query(self, by=('Postcode_Area',), stats=('count', 'mean'), price_cap=None, **filters):
+        """
+        Aggregate the cube to the `by` dimensions, e.g.
+            cube.query(by=['Postcode_Area'], stats=['mean', 'median'], price_cap=1000000, Type=['D', 'S'])
+        stats: count, sum, mean, std, median or pNN (e.g. p90); quantiles come from the sketch (~1% error).
+        A price_cap between band edges is exact for the whole bands below it; the band containing it is
+        estimated from its sketch (moments use the bin values; counts are rounded). For exact answers at
+        other caps, build the cube with that cap among its band_edges.
+        """
+        by = [by] if isinstance(by, str) else list(by)
+        unknown = set(by) - set(CUBE_DIMENSIONS) | set(filters) - set(CUBE_DIMENSIONS)
+        if unknown:
+            raise ValueError(f"Unknown cube dimension(s) {sorted(unknown)}; expected {CUBE_DIMENSIONS}")
+        masks, partial = self._selection(filters, price_cap)
+        reduce_axes = tuple(i for i, dim in enumerate(CUBE_DIMENSIONS) if dim not in by)
+        # Axis order of the reduced arrays follows CUBE_DIMENSIONS, whatever the order of `by`
+        kept = [dim for dim in CUBE_DIMENSIONS if dim in by]
+
+        # 1. Moments: slice the selected labels on every axis, then sum away the axes not in `by`
+        index = np.ix_(*masks)
+        cells = [self.counts[index], self.sums[index], self.sumsq[index]]
+        if partial is not None:
+            # The partially capped band is rebuilt from the sketch below
+            position = int(np.cumsum(masks[-1])[partial] - 1)
+            cells = [np.where(np.arange(a.shape[-1]) == position, 0, a) for a in cells]
+        counts, sums, sumsq = (a.sum(axis=reduce_axes) for a in cells)
+        group_labels = [np.array(self.labels[dim])[masks[CUBE_DIMENSIONS.index(dim)]] for dim in kept]
+        result = pd.DataFrame(
+            {dim: values.ravel() for dim, values in zip(kept, np.meshgrid(*group_labels, indexing='ij'))}
+            if kept else {}, index=range(counts.size))
+
+        counts, sums, sumsq = counts.ravel(), sums.ravel(), sumsq.ravel()
+        if partial is not None:
+            selected, group, band, weights = self._sketch_selection(masks, kept, partial, price_cap)
+            in_band = band == partial
+            group, weights = group[in_band], weights[in_band]
+            values = _sketch_values()[self.sketch_bins[selected][in_band]]
+            counts = counts + np.bincount(group, weights=weights, minlength=len(counts))
+            sums = sums + np.bincount(group, weights=weights * values, minlength=len(counts))
+            sumsq = sumsq + np.bincount(group, weights=weights * values * values, minlength=len(counts))
+
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = sums / counts
+            moments = {'count': np.rint(counts).astype(np.int64), 'sum': sums, 'mean': means,
+                'std': np.sqrt(np.maximum(sumsq / counts - means * means, 0))}
+
+        quantiles = {s: 0.5 if s == 'median' else int(s[1:]) / 100 for s in stats
+            if s == 'median' or re.fullmatch(r'p\d{1,2}', s)}
+        if quantiles:
+            quantile_values = self._quantiles(masks, kept, len(counts), list(quantiles.values()), partial, price_cap)
+
+        for stat in stats:
+            if stat in moments:
+                result[stat] = moments[stat]
+            elif stat in quantiles:
+                result[stat] = quantile_values[:, list(quantiles).index(stat)]
+            else:
+                raise ValueError(f"Unknown statistic '{stat}'")
+        return result[counts > 0][list(by) + list(stats)].reset_index(drop=True)
+
+    def _quantiles(self, masks, kept, n_groups, qs, partial=None, price_cap=None):
+        # 1. Keep sketch entries whose cell is selected and map each to its output group
+        selected, group, _, weights = self._sketch_selection(masks, kept, partial, price_cap)
+
+        # 2. Merged histogram per group, then the first bin whose cumulative count reaches q * n
+        histograms = np.bincount(group * SKETCH_BINS + self.sketch_bins[selected],
+            weights=weights, minlength=n_groups * SKETCH_BINS).reshape(n_groups, SKETCH_BINS)
+        cumulative = np.cumsum(histograms, axis=1)
+        values = _sketch_values()
+        result = np.full((n_groups, len(qs)), np.nan)
+        for j, q in enumerate(qs):
+            targets = np.maximum(q * cumulative[:, -1], 1)
+            bins = (cumulative < targets[:, None]).sum(axis=1)
+            result[:, j] = np.where(cumulative[:, -1] > 0, values[np.minimum(bins, SKETCH_BINS - 1)], np.nan)
+        return result
+
+    def save(self, path):
+        np.savez(path, version=np.array(CUBE_VERSION), counts=self.counts, sums=self.sums, sumsq=self.sumsq,
+            sketch_cells=self.sketch_cells, sketch_bins=self.sketch_bins, sketch_counts=self.sketch_counts,
+            sources=np.array([f"{p}\t{h}" for p, h in self.sources.items()], dtype=object),
+            **{f"labels_{dim}": np.array(self.labels[dim], dtype=object) for dim in CUBE_DIMENSIONS})
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=True) as data:
+            if 'version' not in data.files or int(data['version']) != CUBE_VERSION:
+                raise ValueError(f"{path} is not a version {CUBE_VERSION} price cube")
+            labels = {dim: list(data[f"labels_{dim}"]) for dim in CUBE_DIMENSIONS}
+            sources = dict(entry.split('\t') for entry in data['sources'])
+            return cls(labels, data['counts'], data['sums'], data['sumsq'], data['sketch_cells'],
+                data['sketch_bins'], data['sketch_counts'], sources)
+
+
+def load_or_build_cube(input_files, cube_path='price_cube.npz', band_edges=None):
+    """Load the cube for these transaction files, rebuilding (and re-saving) it if missing or if any file changed."""
+    sources = {os.path.abspath(f): file_sha256(f) for f in input_files}
+
+    if os.path.exists(cube_path):
+        try:
+            cube = PriceCube.load(cube_path)
+        except ValueError as e:
+            print(f"{e}; rebuilding...")
+        else:
+            if cube.sources == sources and (band_edges is None or cube.band_edges == list(band_edges)):
+                return cube
+            print(f"{cube_path} was built from different inputs; rebuilding...")
+
+    usecols = ['Price', 'Date', 'Postcode', 'Type']
+    df = pd.concat([pd.read_csv(f, usecols=usecols) for f in input_files], ignore_index=True)
+    cube = PriceCube.build(df, band_edges, sources)
+    cube.save(cube_path)
+    print(f"Saved price cube to {cube_path}")
+    return cube
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Build the outward-code price-statistics cube and query one slice.')
+    parser.add_argument('inputs', nargs='*', default=['birmingham_prices_real_2024.csv'])
+    parser.add_argument('--cube', default='price_cube.npz')
+    parser.add_argument('--by', nargs='+', default=['Postcode_Area'], choices=CUBE_DIMENSIONS)
+    parser.add_argument('--stats', nargs='+', default=['count', 'mean', 'median'])
+    parser.add_argument('--price-cap', type=int, default=None,
+        help='Exact on a band edge, estimated from the sketch inside a band')
+    parser.add_argument('--band-edges', nargs='+', type=int, default=None,
+        help='Lower price band edges to build the cube with (rebuilds it if they differ), e.g. 0 250000 750000')
+    parser.add_argument('--type', nargs='+', default=None, help='Property types to keep, e.g. D S')
+    args = parser.parse_args()
+
+    cube = load_or_build_cube(args.inputs, args.cube, args.band_edges)
+    filters = {'Type': args.type} if args.type else {}
+    start = time.perf_counter()
+    result = cube.query(args.by, args.stats, args.price_cap, **filters)
+    print(result.to_string(index=False))
+    print(f"Query answered in {(time.perf_counter() - start) * 1000:.1f} ms")
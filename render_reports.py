@@ -0,0 +1,112 @@
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+# Above this many points the actual-vs-predicted chart is drawn as a hexbin density instead of a raw scatter
+DENSITY_THRESHOLD = 50000
+
+
+def _pyplot():
+    # Workers never open a window: force the non-interactive backend before pyplot is imported
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def render_feature_importance(output_path, features, importances, title, palette='viridis', top_n=15):
+    import pandas as pd
+    import seaborn as sns
+    plt = _pyplot()
+
+    importance_df = pd.DataFrame({'Feature': list(features), 'Importance': importances}).sort_values(
+        by='Importance', ascending=False)
+
+    plt.figure(figsize=(12, 8))
+    sns.barplot(x='Importance', y='Feature', data=importance_df.head(top_n), palette=palette, hue='Feature',
+        legend=False)
+    plt.title(title, fontsize=16)
+    plt.xlabel('Importance Score', fontsize=12)
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close('all')
+
+
+def render_actual_vs_predicted(output_path, y_true, y_pred, title, color='teal'):
+    plt = _pyplot()
+    y_true = np.asarray(y_true, dtype=np.float64)
+    y_pred = np.asarray(y_pred, dtype=np.float64)
+
+    plt.figure(figsize=(10, 6))
+    if len(y_true) > DENSITY_THRESHOLD:
+        # Aggregated density: cost depends on the grid size, not on the number of points
+        plt.hexbin(y_true, y_pred, gridsize=120, bins='log', mincnt=1, cmap='viridis')
+        plt.colorbar(label='Transactions (log scale)')
+    else:
+        plt.scatter(y_true, y_pred, alpha=0.3, color=color)
+    plt.plot([y_true.min(), y_true.max()], [y_true.min(), y_true.max()], 'r--', lw=2)
+    plt.xlabel('Actual Price (£)')
+    plt.ylabel('Predicted Price (£)')
+    plt.title(title)
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close('all')
+
+
+def render_market_comparison(output_path, comparison_df, sort_order, title,
+        value_label='Average Transaction Price (£)'):
+    import seaborn as sns
+    plt = _pyplot()
+
+    plt.figure(figsize=(14, 12))
+    sns.set_style("whitegrid")
+
+    # Use 'order' parameter to ensure sorting by Filtered Price
+    plot = sns.barplot(x='Price', y='District_Label', hue='Data_Type', data=comparison_df, order=sort_order,
+        palette=['#34495e', '#e67e22'])  # Dark Blue vs Orange
+
+    plt.title(title, fontsize=18, fontweight='bold')
+    plt.xlabel(value_label, fontsize=14)
+    plt.ylabel('District (Sorted by Filtered Market Price)', fontsize=14)
+    plt.legend(title='Price Calculation', loc='lower right')
+
+    # Add values on bars
+    for p in plot.patches:
+        width = p.get_width()
+        if width > 0:
+            plt.text(width + 10000, p.get_y() + p.get_height() / 2, f'£{int(width):,}', va="center", fontsize=9,
+                fontweight='bold')
+
+    plt.tight_layout()
+    plt.savefig(output_path)
+    plt.close('all')
+
+
+RENDERERS = {'feature_importance': render_feature_importance, 'actual_vs_predicted': render_actual_vs_predicted,
+    'market_comparison': render_market_comparison}
+
+
+def _render_job(job):
+    kind, kwargs = job
+    start = time.perf_counter()
+    RENDERERS[kind](**kwargs)
+    return kwargs['output_path'], time.perf_counter() - start
+
+
+def render_reports(jobs, max_workers=None):
+    """
+    Non-interactive reporting stage:
+    - jobs is a list of (kind, kwargs) pairs, kind one of RENDERERS
+    - Each figure is rendered with the Agg backend in its own worker process and saved to disk
+    Prints per-figure and total render time.
+    """
+    start = time.perf_counter()
+    # Always spawn: forking a parent that already runs sklearn/OpenMP threads is unsafe (macOS in particular).
+    # Workers re-import the calling script, so callers must keep their work under a __main__ guard.
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers or len(jobs), mp_context=context) as pool:
+        for output_path, seconds in pool.map(_render_job, jobs):
+            print(f"Success: Saved {output_path} ({seconds:.2f}s)")
+    print(f"Rendered {len(jobs)} figure(s) in {time.perf_counter() - start:.2f}s")
\ No newline at end of file
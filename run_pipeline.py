@@ -0,0 +1,307 @@
+import argparse
+import ast
+import hashlib
+import json
+import os
+import platform
+import shlex
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from instrumentation import RUN_ID, emit, file_sha256
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = '.pipeline_cache'
+LOG_DIR = 'pipeline_logs'
+
+# Stage DAG of the v1 -> v3.1 project. Edges come from the files: a stage depends on whichever stage writes
+# one of its inputs. Optional inputs are only read when the stage params name them (e.g. the EPC and
+# postcode-directory extras that feature_engineering_v2_1.py takes with --floor-area / --centroids).
+STAGES = [
+    {'name': 'filter_bham', 'script': 'filter_bham.py',
+        'inputs': ['uk_2025.csv'], 'outputs': ['birmingham_prices_real_2025.csv']},
+    {'name': 'features_v1', 'script': 'feature_engineering.py',
+        'inputs': ['birmingham_prices_real_2024.csv', 'birmingham_prices_real_2025.csv'],
+        'outputs': ['train_features_2024.csv', 'test_features_2025.csv']},
+    {'name': 'features_v2', 'script': 'feature_engineering_v2.py',
+        'inputs': ['birmingham_prices_real_2024.csv', 'birmingham_prices_real_2025.csv'],
+        'outputs': ['train_features_v2.parquet', 'test_features_v2.parquet', 'area_encoder_v2.json',
+            'onehot_vocab_v2.json']},
+    {'name': 'features_v2_1', 'script': 'feature_engineering_v2_1.py',
+        'inputs': ['birmingham_prices_real_2024.csv', 'birmingham_prices_real_2025.csv'],
+        'optional_inputs': ['epc_matches.csv', 'postcode_centroids.csv'],
+        'outputs': ['train_features_v2_1.parquet', 'test_features_v2_1.parquet', 'area_type_encoder_v2_1.json',
+            'onehot_vocab_v2_1.json'],
+        'optional_outputs': ['comparable_index.joblib']},
+    {'name': 'model_v1', 'script': 'model_v1_baseline.py.py',
+        'inputs': ['train_features_2024.csv', 'test_features_2025.csv'], 'outputs': ['prediction_results.png']},
+    {'name': 'model_v2', 'script': 'model_v2_optimized.py',
+        'inputs': ['train_features_2024.csv', 'test_features_2025.csv'],
+        'outputs': ['feature_importance_v2.png', 'results_v2_optimized.png', 'model_v2_compact.joblib']},
+    {'name': 'model_v3', 'script': 'model_v3.py',
+        'inputs': ['train_features_v2.parquet', 'test_features_v2.parquet'],
+        'outputs': ['feature_importance_v3.png', 'results_v3.png', 'model_v3_compact.joblib']},
+    {'name': 'model_v3_1', 'script': 'model_v3_1.py',
+        'inputs': ['train_features_v2_1.parquet', 'test_features_v2_1.parquet'],
+        'outputs': ['feature_importance_v3_1.png', 'results_v3_1.png']},
+]
+
+# Library versions are part of every stage key (a new sklearn can change a fitted model)
+KEY_PACKAGES = ['numpy', 'pandas', 'scipy', 'sklearn', 'pyarrow', 'matplotlib']
+
+
+def _sha256_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def local_imports(script, root=ROOT):
+    """The script plus every repo module it imports, directly or through other repo modules."""
+    seen, pending = set(), [script]
+    while pending:
+        name = pending.pop()
+        path = os.path.join(root, name)
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.add(name)
+        with open(path) as f:
+            tree = ast.parse(f.read(), filename=path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.Import):
+                modules = [alias.name for alias in node.names]
+            elif isinstance(node, ast.ImportFrom) and node.module and not node.level:
+                modules = [node.module]
+            else:
+                continue
+            pending += [module.split('.')[0] + '.py' for module in modules]
+    return sorted(seen)
+
+
+def _package_versions():
+    versions = {'python': platform.python_version()}
+    for package in KEY_PACKAGES:
+        try:
+            versions[package] = __import__(package).__version__
+        except ImportError:
+            versions[package] = None
+    return versions
+
+
+def param_inputs(stage, params):
+    """Files the stage params point at (e.g. --floor-area epc_matches.csv or --centroids=onspd.csv)."""
+    values = [p.split('=', 1)[1] if p.startswith('--') and '=' in p else p for p in params]
+    return sorted({v for v in values if v in stage.get('optional_inputs', []) or os.path.isfile(v)})
+
+
+def stage_key(stage, params, versions, root=ROOT):
+    """
+    Content address of one stage run: hashes of its code (script + imported repo modules), of its input files
+    (optional inputs only when the params use them), its command-line parameters and the library versions.
+    """
+    record = {'stage': stage['name'], 'params': params, 'versions': versions,
+        'code': {name: file_sha256(os.path.join(root, name)) for name in local_imports(stage['script'], root)},
+        'inputs': {name: file_sha256(name) for name in stage['inputs']},
+        'optional_inputs': {name: file_sha256(name) if os.path.exists(name) else None
+            for name in param_inputs(stage, params)}}
+    return _sha256_text(json.dumps(record, sort_keys=True)), record
+
+
+class StageCache:
+    """
+    Content-addressed store of stage outputs: <cache_dir>/<key>.json lists the output hashes,
+    <cache_dir>/objects/<key>/ holds copies of the output files, so switching back to an earlier
+    code/parameter version restores its outputs instead of recomputing them.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        os.makedirs(os.path.join(cache_dir, 'objects'), exist_ok=True)
+
+    def _manifest_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def lookup(self, key):
+        path = self._manifest_path(key)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+    def is_current(self, manifest):
+        # Outputs in the working directory are exactly the cached ones
+        return all(os.path.exists(name) and file_sha256(name) == digest
+            for name, digest in manifest['outputs'].items())
+
+    def restore(self, key, manifest):
+        for name in manifest['outputs']:
+            shutil.copy2(os.path.join(self.cache_dir, 'objects', key, name), name)
+
+    def store(self, key, stage, record, seconds):
+        # Copies, not hard links: the scripts rewrite their outputs in place
+        object_dir = os.path.join(self.cache_dir, 'objects', key)
+        os.makedirs(object_dir, exist_ok=True)
+        names = stage['outputs'] + [name for name in stage.get('optional_outputs', []) if os.path.exists(name)]
+        outputs = {}
+        for name in names:
+            shutil.copy2(name, os.path.join(object_dir, name))
+            outputs[name] = file_sha256(name)
+        manifest = {'stage': stage['name'], 'key': key, 'outputs': outputs, 'seconds': round(seconds, 3),
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'record': record}
+        with open(self._manifest_path(key), 'w') as f:
+            json.dump(manifest, f, indent=2)
+
+
+def _upstream(stages):
+    # stage name -> names of the stages that write one of its inputs
+    writers = {output: s['name'] for s in stages for output in s['outputs'] + s.get('optional_outputs', [])}
+    return {s['name']: {writers[name] for name in s['inputs'] + s.get('optional_inputs', []) if name in writers}
+        for s in stages}
+
+
+def select_stages(stages, targets):
+    """The target stages and everything upstream of them (all stages if no targets)."""
+    if not targets:
+        return list(stages)
+    names = {s['name'] for s in stages}
+    unknown = set(targets) - names
+    if unknown:
+        raise ValueError(f"Unknown stage(s): {sorted(unknown)}; choose from {sorted(names)}")
+    upstream = _upstream(stages)
+    wanted, pending = set(), list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending += upstream[name]
+    return [s for s in stages if s['name'] in wanted]
+
+
+def run_stage(stage, cache, params, versions, force=False, log_dir=LOG_DIR):
+    """Run one stage unless its key is cached; returns a summary dict (status: cached/restored/ran/kept/failed)."""
+    start = time.perf_counter()
+    result = {'stage': stage['name'], 'key': None}
+
+    missing = [name for name in stage['inputs'] if not os.path.exists(name)]
+    if missing:
+        # Source data that is not here: keep existing outputs (e.g. the filtered CSVs shipped with the project)
+        status = 'kept' if all(os.path.exists(name) for name in stage['outputs']) else 'failed'
+        return dict(result, status=status, seconds=0.0, detail=f"missing input(s): {', '.join(missing)}")
+
+    key, record = stage_key(stage, params, versions)
+    result['key'] = key[:12]
+    manifest = None if force else cache.lookup(key)
+    if manifest is not None:
+        if cache.is_current(manifest):
+            return dict(result, status='cached', seconds=time.perf_counter() - start, detail='')
+        cache.restore(key, manifest)
+        return dict(result, status='restored', seconds=time.perf_counter() - start, detail='')
+
+    # Each stage logs to its own file, so concurrent stages do not interleave their output
+    os.makedirs(log_dir, exist_ok=True)
+    log_path = os.path.join(log_dir, f"{stage['name']}.log")
+    env = dict(os.environ, PIPELINE_RUN_ID=RUN_ID, MPLBACKEND='Agg')
+    with open(log_path, 'w') as log:
+        completed = subprocess.run([sys.executable, os.path.join(ROOT, stage['script'])] + params, env=env,
+            stdout=log, stderr=subprocess.STDOUT)
+    seconds = time.perf_counter() - start
+
+    missing_outputs = [name for name in stage['outputs'] if not os.path.exists(name)]
+    if completed.returncode != 0 or missing_outputs:
+        detail = f"exit code {completed.returncode}" if completed.returncode else \
+            f"missing output(s): {', '.join(missing_outputs)}"
+        return dict(result, status='failed', seconds=seconds, detail=f"{detail}, see {log_path}")
+    cache.store(key, stage, record, seconds)
+    return dict(result, status='ran', seconds=seconds, detail=f"log: {log_path}")
+
+
+def run_pipeline(targets=None, max_workers=None, force=(), stage_params=None, stages=STAGES, cache_dir=CACHE_DIR):
+    """
+    Run the stage DAG in dependency order:
+    - A stage starts as soon as every upstream stage has finished, so independent branches run concurrently
+    - Stages whose content key is in the cache are skipped (or their outputs restored from the cache)
+    - Downstream stages of a failed stage are skipped
+    force: stage names to rerun regardless of the cache; stage_params: {stage: [command-line args]}
+    Prints and returns the per-stage summary.
+    """
+    selected = select_stages(stages, targets)
+    upstream = _upstream(selected)
+    stage_params = stage_params or {}
+    cache = StageCache(cache_dir)
+    versions = _package_versions()
+    max_workers = max_workers or min(len(selected), os.cpu_count() or 1)
+
+    start = time.perf_counter()
+    results, running = {}, {}
+    print_lock = threading.Lock()
+
+    def _say(status, name):
+        with print_lock:
+            print(f"[{time.perf_counter() - start:7.1f}s] {status:<8} {name}", flush=True)
+
+    def _run(stage):
+        _say('start', stage['name'])
+        return run_stage(stage, cache, stage_params.get(stage['name'], []), versions, stage['name'] in force)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while len(results) < len(selected):
+            for stage in selected:
+                name = stage['name']
+                if name in results or name in running:
+                    continue
+                if any(results.get(up, {}).get('status') in ('failed', 'skipped') for up in upstream[name]):
+                    results[name] = {'stage': name, 'key': None, 'status': 'skipped', 'seconds': 0.0,
+                        'detail': 'upstream stage failed'}
+                elif all(up in results for up in upstream[name]):
+                    running[name] = pool.submit(_run, stage)
+            if not running:
+                continue
+            done, _ = wait(running.values(), return_when=FIRST_COMPLETED)
+            for name, future in list(running.items()):
+                if future in done:
+                    results[name] = future.result()
+                    del running[name]
+                    _say(results[name]['status'], name)
+                    emit(dict(results[name], ts=time.strftime('%Y-%m-%dT%H:%M:%S'), run_id=RUN_ID,
+                        script='run_pipeline.py', stage=f"pipeline.{name}"))
+
+    summary = [results[s['name']] for s in selected]
+    elapsed = time.perf_counter() - start
+    print("-" * 30)
+    print(f"{'stage':<15} {'status':<9} {'seconds':>8}  {'key':<12}  detail")
+    for row in summary:
+        print(f"{row['stage']:<15} {row['status']:<9} {row['seconds']:>8.2f}  {row['key'] or '-':<12}  {row['detail']}")
+    hits = sum(row['status'] in ('cached', 'restored') for row in summary)
+    ran_seconds = sum(row['seconds'] for row in summary if row['status'] == 'ran')
+    print(f"{hits}/{len(summary)} stage(s) from cache; {ran_seconds:.1f}s of stage time in {elapsed:.1f}s wall")
+    return summary
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Run the v1 -> v3.1 pipeline, skipping up-to-date stages.')
+    parser.add_argument('targets', nargs='*', help='Stages to bring up to date (default: all), with their upstream')
+    parser.add_argument('--force', nargs='*', default=[], help='Stages to rerun even if cached')
+    parser.add_argument('--workers', type=int, default=None, help='Stages run at the same time')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--list', action='store_true', help='Show the stages and their dependencies')
+    parser.add_argument('--stage-args', action='append', default=[], metavar="STAGE='ARGS'",
+        help="Command-line arguments for one stage (part of its cache key), repeatable, "
+            "e.g. --stage-args features_v2_1='--floor-area epc_matches.csv'")
+    args = parser.parse_args()
+
+    stage_params = {}
+    for value in args.stage_args:
+        name, _, stage_args = value.partition('=')
+        if name not in {s['name'] for s in STAGES} or not stage_args:
+            parser.error(f"--stage-args expects STAGE='ARGS' with a known stage, got {value!r}")
+        stage_params[name] = shlex.split(stage_args)
+
+    if args.list:
+        for name, upstream in _upstream(STAGES).items():
+            print(f"{name:<15} <- {', '.join(sorted(upstream)) or '(source data)'}")
+        sys.exit(0)
+
+    summary = run_pipeline(args.targets, args.workers, set(args.force), stage_params, cache_dir=args.cache_dir)
+    sys.exit(1 if any(row['status'] == 'failed' for row in summary) else 0)
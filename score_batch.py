@@ -0,0 +1,61 @@
+import argparse
+import time
+
+import pandas as pd
+
+from feature_engineering_v2_1 import V2_1_INPUT_COLUMNS
+from filter_bham import PPD_COLUMNS, PPD_DTYPES
+from model_artifact import ModelArtifact
+from prediction_table import load_or_build_table
+
+
+def score_file(input_file, output_file, artifact_path='model_v3_1.joblib', chunksize=100000, raw_ppd=False,
+        use_table=False):
+    """
+    Chunked batch scoring through the V3.1 pipeline:
+    - Loads the model artifact once (memory-mapped)
+    - Streams the input in chunks, reading only ID + the model's input columns
+    - Appends 'Predicted_Price' for each chunk to output_file as soon as it is scored
+    raw_ppd=True reads a headerless Land Registry file (e.g. a monthly PPD drop) instead of a filtered CSV.
+    use_table=True answers from the precomputed prediction table instead of traversing the forest.
+    """
+    predictor = load_or_build_table(artifact_path) if use_table else ModelArtifact.load(artifact_path)
+
+    usecols = ['ID'] + V2_1_INPUT_COLUMNS
+    dtypes = {c: PPD_DTYPES[c] for c in usecols}
+    if raw_ppd:
+        chunks = pd.read_csv(input_file, names=PPD_COLUMNS, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+    else:
+        chunks = pd.read_csv(input_file, usecols=usecols, dtype=dtypes, chunksize=chunksize)
+
+    print(f"Scoring {input_file} with {artifact_path}...")
+    rows = 0
+    start = time.perf_counter()
+    for i, chunk in enumerate(chunks):
+        predictions = predictor.predict(chunk)
+
+        out = pd.DataFrame({'ID': chunk['ID'].to_numpy(), 'Predicted_Price': predictions.round(2)})
+        out.to_csv(output_file, mode='w' if i == 0 else 'a', header=(i == 0), index=False)
+
+        rows += len(chunk)
+        elapsed = time.perf_counter() - start
+        print(f"  {rows:,} rows scored ({rows / elapsed:,.0f} rows/sec)")
+
+    elapsed = time.perf_counter() - start
+    print("-" * 30)
+    print(f"Success! Scored {rows:,} rows in {elapsed:.1f}s ({rows / max(elapsed, 1e-9):,.0f} rows/sec) "
+        f"-> {output_file}")
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Batch-score transactions with the saved V3.1 model artifact.')
+    parser.add_argument('input')
+    parser.add_argument('output')
+    parser.add_argument('--artifact', default='model_v3_1.joblib')
+    parser.add_argument('--chunksize', type=int, default=100000)
+    parser.add_argument('--raw-ppd', action='store_true', help='Input is a headerless Land Registry PPD file')
+    parser.add_argument('--use-table', action='store_true', help='Look predictions up in the precomputed table')
+    args = parser.parse_args()
+
+    score_file(args.input, args.output, args.artifact, args.chunksize, args.raw_ppd, args.use_table)
\ No newline at end of file
@@ -0,0 +1,159 @@
+import argparse
+
+import joblib
+import numpy as np
+import pandas as pd
+from sklearn.neighbors import BallTree
+
+from compact_dtypes import read_transactions
+from postcode_utils import postcode_key
+
+# ONS Postcode Directory (ONSPD/NSPL) columns: postcode with a space, latitude, longitude.
+# Postcodes without a grid reference carry the placeholder lat 99.999999.
+ONSPD_COLUMNS = {'postcode': 'pcds', 'lat': 'lat', 'lon': 'long'}
+EARTH_RADIUS_KM = 6371.0088
+
+SPATIAL_FEATURES = ['Comparable_Price', 'Comparable_Distance_Km']
+COMPARABLE_INDEX_VERSION = 1
+
+
+def load_postcode_centroids(path, postcodes=None, columns=ONSPD_COLUMNS, chunksize=500000):
+    """
+    Postcode_Key -> Latitude, Longitude from a local ONS postcode directory CSV.
+    Streamed in chunks; with `postcodes` only those postcodes are kept (semi-join), so the national file
+    never has to be held in memory.
+    """
+    wanted = set(postcode_key(postcodes).dropna()) if postcodes is not None else None
+    frames = []
+    for chunk in pd.read_csv(path, usecols=list(columns.values()), dtype={columns['postcode']: 'str'},
+            chunksize=chunksize):
+        chunk = chunk.rename(columns={columns['postcode']: 'Postcode', columns['lat']: 'Latitude',
+            columns['lon']: 'Longitude'})
+        chunk['Postcode_Key'] = postcode_key(chunk['Postcode'])
+        chunk = chunk[chunk['Latitude'].abs() <= 90]
+        if wanted is not None:
+            chunk = chunk[chunk['Postcode_Key'].isin(wanted)]
+        frames.append(chunk[['Postcode_Key', 'Latitude', 'Longitude']])
+    centroids = pd.concat(frames, ignore_index=True).drop_duplicates('Postcode_Key')
+    print(f"Loaded {len(centroids):,} postcode centroids from {path}")
+    return centroids
+
+
+def add_coordinates(df, centroids):
+    """Adds Latitude/Longitude (NaN where the postcode is not in the directory), keeping df's row order."""
+    keys = pd.Index(centroids['Postcode_Key'])
+    positions = keys.get_indexer(postcode_key(df['Postcode']))
+    found = positions >= 0
+    for col in ('Latitude', 'Longitude'):
+        values = np.full(len(df), np.nan)
+        values[found] = centroids[col].to_numpy()[positions[found]]
+        df[col] = values
+    return df
+
+
+def weighted_median(values, weights):
+    """Row-wise weighted median of two (rows, k) arrays; rows whose weights are all 0 give NaN."""
+    order = np.argsort(values, axis=1)
+    values = np.take_along_axis(values, order, axis=1)
+    cumulative = np.cumsum(np.take_along_axis(weights, order, axis=1), axis=1)
+    total = cumulative[:, -1:]
+    position = (cumulative < 0.5 * total).sum(axis=1).clip(max=values.shape[1] - 1)
+    result = values[np.arange(len(values)), position]
+    return np.where(total[:, 0] > 0, result, np.nan)
+
+
+class ComparableSalesIndex:
+    """
+    Nearest comparable sales: one BallTree (haversine metric) per property Type over past sales.
+    - A query returns, for every row at once, the k nearest sales of the same Type:
+      'Comparable_Price' = their distance-weighted median price (weight 1 / (distance + bandwidth_km))
+      'Comparable_Distance_Km' = their mean distance
+    - Rows without coordinates, or of a Type with no indexed sales, get NaN
+    Saved with joblib so the index fitted on training sales can be queried again later; the model artifact
+    and scoring paths do not use it (the comparable-sales columns are an evaluation-only feature set).
+    """
+
+    def __init__(self, k=10, bandwidth_km=0.25):
+        self.version = COMPARABLE_INDEX_VERSION
+        self.k = int(k)
+        self.bandwidth_km = float(bandwidth_km)
+        self.trees = {}
+        self.prices = {}
+        self.n_sales = 0
+
+    def fit(self, sales):
+        """sales: frame with Type, Price, Latitude, Longitude (rows without coordinates are skipped)."""
+        sales = sales.dropna(subset=['Latitude', 'Longitude'])
+        self.trees, self.prices = {}, {}
+        for property_type, group in sales.groupby('Type', observed=True):
+            coords = np.radians(group[['Latitude', 'Longitude']].to_numpy(np.float64))
+            self.trees[str(property_type)] = BallTree(coords, metric='haversine')
+            self.prices[str(property_type)] = group['Price'].to_numpy(np.float64)
+        self.n_sales = len(sales)
+        return self
+
+    def query(self, df):
+        """Frame of SPATIAL_FEATURES aligned to df's index."""
+        result = np.full((len(df), len(SPATIAL_FEATURES)), np.nan)
+        types = df['Type'].astype('str').to_numpy()
+        located = df[['Latitude', 'Longitude']].notna().all(axis=1).to_numpy()
+        coords = np.radians(df[['Latitude', 'Longitude']].to_numpy(np.float64))
+
+        for property_type, tree in self.trees.items():
+            rows = np.flatnonzero(located & (types == property_type))
+            if len(rows) == 0:
+                continue
+            # One batch query for every row of this Type
+            k = min(self.k, len(self.prices[property_type]))
+            distances, neighbours = tree.query(coords[rows], k=k)
+            distances_km = distances * EARTH_RADIUS_KM
+            weights = 1.0 / (distances_km + self.bandwidth_km)
+            result[rows, 0] = weighted_median(self.prices[property_type][neighbours], weights)
+            result[rows, 1] = distances_km.mean(axis=1)
+        return pd.DataFrame(result, columns=SPATIAL_FEATURES, index=df.index)
+
+    def save(self, path):
+        joblib.dump(self, path)
+        print(f"Saved comparable-sales index ({self.n_sales:,} sales, k={self.k}) to {path}")
+
+    @classmethod
+    def load(cls, path):
+        index = joblib.load(path)
+        if getattr(index, 'version', None) != COMPARABLE_INDEX_VERSION:
+            raise ValueError(f"{path} is not a version {COMPARABLE_INDEX_VERSION} comparable-sales index")
+        return index
+
+
+def past_comparables(sales, k=10, bandwidth_km=0.25):
+    """
+    Leakage-safe SPATIAL_FEATURES for the training sales themselves:
+    rows of each calendar month are answered by an index over the sales of earlier months only,
+    so no row sees its own price or any later one. Rows of the first month get NaN
+    (feature_engineering_v2_1.py fills them with out-of-fold area/type means).
+    """
+    result = pd.DataFrame(np.nan, columns=SPATIAL_FEATURES, index=sales.index)
+    months = sales['Date'].dt.to_period('M')
+    for month in np.sort(months.unique()):
+        current = (months == month).to_numpy()
+        past = (months < month).to_numpy()
+        if not past.any():
+            continue
+        index = ComparableSalesIndex(k, bandwidth_km).fit(sales[past])
+        result.loc[current] = index.query(sales[current]).to_numpy()
+    return result
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Fit and save the comparable-sales index over past sales.')
+    parser.add_argument('--sales', default='birmingham_prices_real_2024.csv')
+    parser.add_argument('--centroids', required=True, help='ONS postcode directory CSV (pcds, lat, long)')
+    parser.add_argument('--output', default='comparable_index.joblib')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--price-cap', type=int, default=1000000)
+    args = parser.parse_args()
+
+    sales = read_transactions(args.sales, ['Price', 'Postcode', 'Type'])
+    sales = sales[sales['Price'] <= args.price_cap].copy()
+    sales = add_coordinates(sales, load_postcode_centroids(args.centroids, sales['Postcode']))
+    print(f"{sales['Latitude'].notna().mean():.1%} of {len(sales):,} sales located")
+    ComparableSalesIndex(args.k).fit(sales).save(args.output)
@@ -0,0 +1,201 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+from scipy import sparse
+from sklearn.ensemble import RandomForestRegressor
+
+from compact_dtypes import read_transactions
+from feature_engineering_v2_1 import V2_1_CATEGORICALS, V2_1_INPUT_COLUMNS
+from instrumentation import peak_rss_mb, stage
+from model_artifact import V3_1_PARAMS
+from onehot_encoder import SparseOneHotEncoder
+from postcode_utils import postcode_area
+from target_encoding import TargetEncoder
+
+# On-disk layout of a matrix store directory:
+#   meta.json, area_type_encoder.json, onehot_vocab.json,
+#   {split}_area_type_avg.npy (float32 rows), {split}_codes.npy (int16/int32 rows x categoricals), {split}_y.npy
+# The one-hot block is kept as one category code per categorical column and expanded to CSR when read.
+STORE_META = 'meta.json'
+STORE_SPLITS = ['train', 'test']
+
+# Rows drawn from the store to fit the forest: an unbounded fit would hold every row (and its tree nodes) in memory
+DEFAULT_MAX_SAMPLES = 2000000
+
+
+def _chunks(paths, header, chunksize, price_cap):
+    # Mainstream rows (Price <= cap) of every file, chunk by chunk, with Postcode_Area added
+    for path in paths:
+        for chunk in read_transactions(path, ['Price'] + V2_1_INPUT_COLUMNS, header, chunksize=chunksize):
+            chunk = chunk[chunk['Price'] <= price_cap].copy()
+            chunk['Postcode_Area'] = postcode_area(chunk['Postcode'])
+            yield chunk
+
+
+def _preallocate(path, dtype, shape):
+    # Empty .npy file of the final size; returns the byte offset where its data starts
+    array = np.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    offset = array.offset
+    del array
+    return offset
+
+
+def build_matrix_store(train_paths, test_paths, store_dir, header=False, chunksize=500000, price_cap=1000000,
+        smoothing=0.0):
+    """
+    Out-of-core V2.1 features for national-scale inputs, in two chunked passes:
+    1. Fit the Area_Type_Avg counts/sums and the one-hot vocabulary on the train chunks; count rows per split
+    2. Encode every chunk straight into preallocated .npy files opened as np.memmap:
+       Area_Type_Avg as float32 and one integer category code per categorical column instead of the one-hot block
+    Only one chunk is in memory (and mapped) at a time, so peak memory does not grow with the input;
+    disk use is about rows x (4 + 2 x categoricals + 8) bytes (int32 codes above 32,767 categories).
+    header=False reads the national headerless PPD files, header=True filtered/partition CSVs.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    sources = {'train': list(train_paths), 'test': list(test_paths)}
+
+    # Pass 1: aggregates, vocabulary and row counts
+    encoder = TargetEncoder(['Postcode_Area', 'Type'], smoothing=smoothing)
+    onehot = SparseOneHotEncoder(V2_1_CATEGORICALS)
+    n_rows = {}
+    with stage('streaming_features.fit_pass') as s:
+        for split in STORE_SPLITS:
+            n_rows[split] = 0
+            for chunk in _chunks(sources[split], header, chunksize, price_cap):
+                n_rows[split] += len(chunk)
+                if split == 'train' and encoder.vocab is None:
+                    encoder.fit(chunk)
+                    onehot.fit(chunk)
+                elif split == 'train':
+                    encoder.update(chunk)
+                    onehot.update(chunk)
+        s.set(rows_out=sum(n_rows.values()), columns=1 + onehot.n_features)
+    if not n_rows['train']:
+        raise ValueError(f"No training rows at or below £{price_cap:,} in {sources['train']}")
+    encoder.save(os.path.join(store_dir, 'area_type_encoder.json'))
+    onehot.save(os.path.join(store_dir, 'onehot_vocab.json'))
+    print(f"Pass 1: {n_rows['train']:,} train / {n_rows['test']:,} test rows, {1 + onehot.n_features} features")
+
+    # Pass 2: encode chunk by chunk into the on-disk arrays
+    n_codes = len(V2_1_CATEGORICALS)
+    code_dtype = np.int16 if max(len(v) for v in onehot.vocab.values()) <= np.iinfo(np.int16).max else np.int32
+    with stage('streaming_features.encode_pass', rows_out=sum(n_rows.values())):
+        for split in STORE_SPLITS:
+            paths = {name: os.path.join(store_dir, f"{split}_{name}.npy") for name in ('area_type_avg', 'codes', 'y')}
+            shapes = {'area_type_avg': ((n_rows[split],), np.float32),
+                'codes': ((n_rows[split], n_codes), code_dtype), 'y': ((n_rows[split],), np.float64)}
+            offsets = {name: _preallocate(paths[name], dtype, shape) for name, (shape, dtype) in shapes.items()}
+            row = 0
+            for chunk in _chunks(sources[split], header, chunksize, price_cap):
+                # Each chunk maps only its own rows, so written pages are released after every chunk
+                for name, (shape, dtype) in shapes.items():
+                    row_bytes = int(np.prod(shape[1:], dtype=np.int64)) * np.dtype(dtype).itemsize
+                    window = np.memmap(paths[name], dtype, 'r+', offsets[name] + row * row_bytes,
+                        (len(chunk),) + shape[1:])
+                    if name == 'area_type_avg':
+                        window[:] = encoder.transform(chunk)
+                    elif name == 'codes':
+                        window[:] = onehot.category_codes(chunk, dtype=code_dtype)
+                    else:
+                        window[:] = chunk['Price'].to_numpy()
+                    window.flush()
+                    del window
+                row += len(chunk)
+
+    meta = {'feature_set': 'v2_1', 'layout': 'codes', 'target': 'Price', 'price_cap': price_cap, 'rows': n_rows,
+        'code_columns': V2_1_CATEGORICALS, 'code_dtype': np.dtype(code_dtype).name,
+        'feature_names': ['Area_Type_Avg'] + onehot.feature_names, 'sources': sources,
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S')}
+    with open(os.path.join(store_dir, STORE_META), 'w') as f:
+        json.dump(meta, f, indent=2)
+    peak_rss = peak_rss_mb()
+    rss = f", peak RSS {peak_rss:.0f} MB" if peak_rss is not None else ''
+    print(f"Saved matrix store to {store_dir}/ ({store_size_mb(store_dir):,.0f} MB on disk{rss})")
+    return meta
+
+
+def store_size_mb(store_dir):
+    return sum(os.path.getsize(os.path.join(store_dir, name)) for name in os.listdir(store_dir)) / 1e6
+
+
+def open_matrix_store(store_dir, split):
+    """(area_type_avg, codes, y, onehot) of one split; the arrays are read-only memory maps of the store files."""
+    arrays = [np.load(os.path.join(store_dir, f"{split}_{name}.npy"), mmap_mode='r')
+        for name in ('area_type_avg', 'codes', 'y')]
+    onehot = SparseOneHotEncoder.load(os.path.join(store_dir, 'onehot_vocab.json'))
+    return arrays[0], arrays[1], arrays[2], onehot
+
+
+def store_rows_to_csr(area_type_avg, codes, onehot):
+    """Store rows -> CSR matrix in the V2.1 training layout (Area_Type_Avg, then the one-hot columns)."""
+    area_type_avg = sparse.csr_matrix(np.asarray(area_type_avg, dtype=np.float32).reshape(-1, 1))
+    return sparse.hstack([area_type_avg, onehot.codes_to_csr(np.asarray(codes))], format='csr')
+
+
+def train_from_store(store_dir, max_samples=DEFAULT_MAX_SAMPLES, n_jobs=None, random_state=42, **params):
+    """
+    Fit the V3.1 forest on the store's train split (log1p target).
+    At most max_samples rows (drawn at random, without replacement) are read from the store and expanded
+    to a CSR one-hot matrix, so fit memory and tree size stay bounded however large the store is;
+    max_samples=None fits on every row.
+    """
+    area_type_avg, codes, y, onehot = open_matrix_store(store_dir, 'train')
+    rows = np.arange(len(y))
+    if max_samples is not None and max_samples < len(y):
+        rows = np.sort(np.random.default_rng(random_state).choice(len(y), int(max_samples), replace=False))
+    X = store_rows_to_csr(area_type_avg[rows], codes[rows], onehot)
+    model = RandomForestRegressor(**dict(V3_1_PARAMS, n_jobs=n_jobs, **params))
+    with stage('streaming_features.fit', rows_in=len(rows), features=X.shape[1]):
+        model.fit(X, np.log1p(y[rows]))
+    return model
+
+
+def evaluate_from_store(model, store_dir, chunk_rows=200000):
+    """MAE and R2 (in GBP) on the store's test split, predicted chunk by chunk with running sums."""
+    area_type_avg, codes, y, onehot = open_matrix_store(store_dir, 'test')
+    n, abs_error, squared_error, total, total_squared = 0, 0.0, 0.0, 0.0, 0.0
+    with stage('streaming_features.evaluate', rows_in=len(y), rows_out=len(y)):
+        for start in range(0, len(y), chunk_rows):
+            window = slice(start, start + chunk_rows)
+            actual = np.asarray(y[window])
+            predicted = np.expm1(model.predict(store_rows_to_csr(area_type_avg[window], codes[window], onehot)))
+            n += len(actual)
+            abs_error += float(np.abs(actual - predicted).sum())
+            squared_error += float(((actual - predicted) ** 2).sum())
+            total += float(actual.sum())
+            total_squared += float((actual ** 2).sum())
+    variance_sum = total_squared - total * total / max(n, 1)
+    r2 = 1 - squared_error / variance_sum if variance_sum else np.nan
+    return {'rows': n, 'mae': abs_error / max(n, 1), 'r2': r2}
+
+
+if __name__ == "__main__":
+    # Disk cost: about 4 + 2 x 4 + 8 = 20 bytes per transaction (Area_Type_Avg, four int16 category codes, Price),
+    # e.g. ~0.6 GB for 30M national rows. A dense float32 one-hot of ~2,900 outward codes would need ~12 KB per row
+    # (hundreds of GB), which is why the store keeps codes and expands them to CSR only when reading.
+    parser = argparse.ArgumentParser(description='Build the V2.1 features out of core into a memmap store '
+        '(~20 bytes per transaction on disk).')
+    parser.add_argument('--train', nargs='+', required=True, help='PPD files for training, e.g. pp-2015.csv ...')
+    parser.add_argument('--test', nargs='+', required=True, help='PPD files for evaluation, e.g. pp-2025.csv')
+    parser.add_argument('--header', action='store_true', help='Inputs have a header (filtered CSVs)')
+    parser.add_argument('--store', default='feature_store_v2_1')
+    parser.add_argument('--chunksize', type=int, default=500000)
+    parser.add_argument('--fit', action='store_true', help='Train and evaluate the V3.1 forest from the store')
+    parser.add_argument('--max-samples', type=int, default=DEFAULT_MAX_SAMPLES,
+        help='Training rows drawn from the store (0 = all rows; memory grows with the input)')
+    parser.add_argument('--n-jobs', type=int, default=None)
+    args = parser.parse_args()
+
+    build_matrix_store(args.train, args.test, args.store, header=args.header, chunksize=args.chunksize)
+    if args.fit:
+        model = train_from_store(args.store, args.max_samples or None, args.n_jobs)
+        result = evaluate_from_store(model, args.store)
+        print("-" * 30)
+        print(f"Model V3.1 from the matrix store ({result['rows']:,} test rows):")
+        print(f"Average Error (MAE): £{result['mae']:.2f}")
+        print(f"Model Reliability (R2): {result['r2']:.4f}")
+        if peak_rss_mb() is not None:
+            print(f"Peak RSS: {peak_rss_mb():.0f} MB")
@@ -0,0 +1,167 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+
+class TargetEncoder:
+    """
+    Fitted, serializable target encoder (e.g. Area_Avg_Price, Area_Type_Avg):
+    - Keeps per-key counts and sums instead of a ready-made mean, so it can be smoothed and updated
+    - Key values are integer-coded through a dict vocabulary, stats live in flat arrays indexed by that code
+    - Unseen keys fall back to the stored global mean; no training CSV is needed at scoring time
+    """
+
+    def __init__(self, keys, target='Price', smoothing=0.0):
+        self.keys = list(keys)
+        self.target = target
+        self.smoothing = float(smoothing)
+        self.vocab = None
+        self.sums = None
+        self.counts = None
+        self.global_sum = 0.0
+        self.global_count = 0
+
+    # -----------------------------------------------------
+    # Fitting
+    # -----------------------------------------------------
+    def fit(self, df):
+        # 1. Vocabulary: one sorted dict per key column (value -> integer code)
+        self.vocab = []
+        for key in self.keys:
+            values = pd.Series(df[key]).dropna().astype('str').unique()
+            self.vocab.append({v: i for i, v in enumerate(sorted(values))})
+
+        # 2. Counts and sums per combined key code
+        size = int(np.prod([len(v) for v in self.vocab]))
+        codes = self.encode_keys(df)
+        target = df[self.target].to_numpy(dtype='float64')
+        seen = codes >= 0
+        self.sums = np.bincount(codes[seen], weights=target[seen], minlength=size)
+        self.counts = np.bincount(codes[seen], minlength=size).astype('int64')
+
+        # 3. Global fallback for unseen combinations
+        self.global_sum = float(target.sum())
+        self.global_count = int(len(target))
+        return self
+
+    def _extend_vocab(self, df):
+        # Append unseen key values to the vocabularies and move the stats into the larger code space
+        old_shape = tuple(len(v) for v in self.vocab)
+        for key, vocab in zip(self.keys, self.vocab):
+            for value in pd.Series(df[key]).dropna().astype('str').unique():
+                if value not in vocab:
+                    vocab[value] = len(vocab)
+        new_shape = tuple(len(v) for v in self.vocab)
+        if new_shape == old_shape:
+            return
+
+        size = int(np.prod(new_shape))
+        new_codes = np.ravel_multi_index(np.unravel_index(np.arange(len(self.counts)), old_shape), new_shape)
+        sums = np.zeros(size, dtype='float64')
+        counts = np.zeros(size, dtype='int64')
+        sums[new_codes] = self.sums
+        counts[new_codes] = self.counts
+        self.sums, self.counts = sums, counts
+
+    def update(self, df, sign=1):
+        """
+        Running update of the counts and sums: sign=1 adds the rows, sign=-1 removes them.
+        Only the given rows are touched, so a monthly delta never needs the full history.
+        """
+        if sign > 0:
+            self._extend_vocab(df)
+        codes = self.encode_keys(df)
+        target = df[self.target].to_numpy(dtype='float64')
+        seen = codes >= 0
+        np.add.at(self.sums, codes[seen], sign * target[seen])
+        np.add.at(self.counts, codes[seen], sign)
+        self.global_sum += sign * float(target.sum())
+        self.global_count += sign * int(len(target))
+        return self
+
+    @property
+    def global_mean(self):
+        return self.global_sum / self.global_count if self.global_count else np.nan
+
+    # -----------------------------------------------------
+    # Lookups
+    # -----------------------------------------------------
+    def encode_keys(self, df):
+        """Combined integer code per row (mixed radix over the key vocabularies), -1 for unseen keys."""
+        codes = np.zeros(len(df), dtype='int64')
+        unseen = np.zeros(len(df), dtype=bool)
+        for key, vocab in zip(self.keys, self.vocab):
+            categories = pd.Index(list(vocab))
+            key_codes = pd.Categorical(pd.Series(df[key]).astype('str'), categories=categories).codes
+            unseen |= key_codes < 0
+            codes = codes * len(vocab) + key_codes
+        codes[unseen] = -1
+        return codes
+
+    def encoded_means(self):
+        """Smoothed mean for every combined code: (sum + m * global) / (count + m), global mean if never seen."""
+        m = self.smoothing
+        with np.errstate(invalid='ignore', divide='ignore'):
+            means = (self.sums + m * self.global_mean) / (self.counts + m)
+        return np.where(self.counts > 0, means, self.global_mean)
+
+    def transform(self, df):
+        codes = self.encode_keys(df)
+        means = self.encoded_means()
+        return np.where(codes >= 0, means[np.maximum(codes, 0)], self.global_mean)
+
+    def transform_out_of_fold(self, df, n_folds=5, random_state=42):
+        """
+        Leakage-free encoding of the rows the encoder was fitted on: rows are split into random folds and
+        each fold is encoded with its own contribution taken out of the counts and sums.
+        """
+        folds = np.random.default_rng(random_state).integers(0, n_folds, len(df))
+        result = np.empty(len(df), dtype='float64')
+        for fold in range(n_folds):
+            rows = folds == fold
+            if rows.any():
+                held_out = TargetEncoder.from_dict(self.to_dict()).update(df[rows], sign=-1)
+                result[rows] = held_out.transform(df[rows])
+        return result
+
+    def lookup(self, *values):
+        """Single-row O(1) lookup, e.g. encoder.lookup('B15', 'D')."""
+        code = 0
+        for value, vocab in zip(values, self.vocab):
+            index = vocab.get(str(value))
+            if index is None:
+                return self.global_mean
+            code = code * len(vocab) + index
+        count = self.counts[code]
+        if count == 0:
+            return self.global_mean
+        return float((self.sums[code] + self.smoothing * self.global_mean) / (count + self.smoothing))
+
+    # -----------------------------------------------------
+    # Persistence
+    # -----------------------------------------------------
+    def to_dict(self):
+        return {'keys': self.keys, 'target': self.target, 'smoothing': self.smoothing,
+            'vocab': [sorted(v, key=v.get) for v in self.vocab], 'sums': self.sums.tolist(),
+            'counts': self.counts.tolist(), 'global_sum': self.global_sum, 'global_count': self.global_count}
+
+    @classmethod
+    def from_dict(cls, state):
+        encoder = cls(state['keys'], target=state['target'], smoothing=state['smoothing'])
+        encoder.vocab = [{v: i for i, v in enumerate(values)} for values in state['vocab']]
+        encoder.sums = np.asarray(state['sums'], dtype='float64')
+        encoder.counts = np.asarray(state['counts'], dtype='int64')
+        encoder.global_sum = float(state['global_sum'])
+        encoder.global_count = int(state['global_count'])
+        return encoder
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.to_dict(), f)
+        print(f"Saved target encoder {self.keys} to {path}")
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            return cls.from_dict(json.load(f))
\ No newline at end of file
@@ -0,0 +1,125 @@
+import argparse
+import glob
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from feature_engineering_v2_1 import V2_1_INPUT_COLUMNS
+from filter_bham import PPD_DTYPES, partition_path
+from model_artifact import fit_v3_1_artifact
+
+PRICE_CAP = 1000000
+
+
+def parse_window(text):
+    """'2022-2024:2025' -> ([2022, 2023, 2024], [2025]); '2024:2025' -> ([2024], [2025])"""
+    def years(part):
+        first, _, last = part.partition('-')
+        return list(range(int(first), int(last or first) + 1))
+
+    train, _, test = text.partition(':')
+    if not test:
+        raise ValueError(f"Window '{text}' must look like TRAIN_YEARS:TEST_YEARS, e.g. 2024:2025")
+    return years(train), years(test)
+
+
+def format_years(years):
+    return str(years[0]) if len(years) == 1 else f"{years[0]}-{years[-1]}"
+
+
+def load_partitions(partition_dir, district, years):
+    """Concatenate the (district, year) CSVs written by filter_bham.ingest_districts, reading only model columns."""
+    usecols = ['Price'] + V2_1_INPUT_COLUMNS
+    dtypes = {c: PPD_DTYPES[c] for c in usecols}
+    frames = [pd.read_csv(partition_path(partition_dir, district, year), usecols=usecols, dtype=dtypes)
+        for year in years if os.path.exists(partition_path(partition_dir, district, year))]
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=usecols)
+
+
+def train_partition(partition_dir, district, train_years, test_years, output_dir, n_jobs=1):
+    """
+    Worker: run the V2.1 feature recipe + V3.1 forest for one (district, window) partition.
+    Saves the artifact and returns one row of metrics on the test years (mainstream market <= £1M).
+    """
+    window = f"{format_years(train_years)}_{format_years(test_years)}"
+    result = {'district': district, 'window': window, 'n_train': 0, 'n_test': 0}
+
+    train_df = load_partitions(partition_dir, district, train_years)
+    test_df = load_partitions(partition_dir, district, test_years)
+    test_df = test_df[test_df['Price'] <= PRICE_CAP]
+    if train_df.empty or test_df.empty:
+        result['status'] = 'skipped: no data'
+        return result
+
+    start = time.perf_counter()
+    artifact = fit_v3_1_artifact(train_df, price_cap=PRICE_CAP, n_jobs=n_jobs)
+    fit_seconds = time.perf_counter() - start
+    artifact.metadata.update({'district': district, 'train_years': train_years, 'test_years': test_years})
+
+    predictions_real = artifact.predict(test_df)
+    artifact_path = os.path.join(output_dir, f"{district.replace(' ', '_')}_{window}.joblib")
+    artifact.save(artifact_path)
+
+    result.update({'n_train': artifact.metadata['n_train'], 'n_test': len(test_df),
+        'mae': mean_absolute_error(test_df['Price'], predictions_real),
+        'r2': r2_score(test_df['Price'], predictions_real), 'fit_s': round(fit_seconds, 2),
+        'artifact': artifact_path, 'status': 'ok'})
+    return result
+
+
+def train_districts(districts, windows, partition_dir='ppd_partitions', output_dir='district_models',
+        metrics_path='district_metrics.csv', max_workers=None, n_jobs=1):
+    """
+    Per-district fan-out of the V3.1 recipe:
+    - One job per (district, window), run in a process pool with at most max_workers concurrent fits
+    - Each forest uses n_jobs threads (default 1), so total parallelism is max_workers x n_jobs
+    - Writes one artifact per job and a combined metrics table
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    max_workers = max_workers or os.cpu_count()
+    jobs = [(d.upper(), *parse_window(w)) for d in districts for w in windows]
+    print(f"Training {len(jobs)} partition(s) with up to {max_workers} worker(s)...")
+
+    results = []
+    start = time.perf_counter()
+    context = multiprocessing.get_context('spawn')
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=context) as pool:
+        futures = [pool.submit(train_partition, partition_dir, district, train_years, test_years, output_dir, n_jobs)
+            for district, train_years, test_years in jobs]
+        for future in as_completed(futures):
+            result = future.result()
+            results.append(result)
+            if result['status'] == 'ok':
+                print(f"  {result['district']} {result['window']}: MAE £{result['mae']:.2f}, R2 {result['r2']:.4f}")
+            else:
+                print(f"  {result['district']} {result['window']}: {result['status']}")
+
+    metrics = pd.DataFrame(results).sort_values(['district', 'window'])
+    metrics.to_csv(metrics_path, index=False)
+    print("-" * 30)
+    print(f"Finished {len(jobs)} partition(s) in {time.perf_counter() - start:.1f}s; metrics saved to {metrics_path}")
+    return metrics
+
+
+def available_districts(partition_dir):
+    return sorted({os.path.basename(os.path.dirname(p)) for p in glob.glob(os.path.join(partition_dir, '*', '*.csv'))})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Train the V3.1 recipe for many districts and year windows.')
+    parser.add_argument('--districts', nargs='+', default=None, help='Defaults to every ingested district')
+    parser.add_argument('--windows', nargs='+', default=['2024:2025'], help='TRAIN:TEST years, e.g. 2022-2024:2025')
+    parser.add_argument('--partitions', default='ppd_partitions')
+    parser.add_argument('--output-dir', default='district_models')
+    parser.add_argument('--metrics', default='district_metrics.csv')
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--n-jobs', type=int, default=1, help='Threads per forest')
+    args = parser.parse_args()
+
+    districts = args.districts or available_districts(args.partitions)
+    train_districts(districts, args.windows, args.partitions, args.output_dir, args.metrics, args.workers,
+        args.n_jobs)
\ No newline at end of file
@@ -0,0 +1,165 @@
+import argparse
+import itertools
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.metrics import mean_absolute_error, r2_score
+
+from feature_store import load_aligned_matrices
+from instrumentation import peak_rss_mb
+
+# Default search space around the hand-picked V3.1 values (max_depth=10, min_samples_leaf=15)
+DEFAULT_GRID = {'max_depth': [6, 8, 10, 14, None], 'min_samples_leaf': [1, 5, 15, 30],
+    'max_features': [1.0, 0.5, 'sqrt']}
+
+
+def share_arrays(arrays, directory):
+    """Dump arrays once as .npy files so every worker can np.load them with mmap_mode='r'."""
+    paths = {}
+    for name, array in arrays.items():
+        paths[name] = os.path.join(directory, f"{name}.npy")
+        np.save(paths[name], np.ascontiguousarray(array))
+    return paths
+
+
+def validation_split(n_rows, val_fraction=0.2, random_state=42):
+    """Row order that puts a random val_fraction of the training rows last, and the number of rows before them."""
+    order = np.random.default_rng(random_state).permutation(n_rows)
+    n_fit = n_rows - max(1, int(round(n_rows * val_fraction)))
+    return order, n_fit
+
+
+def run_trial(paths, params, n_estimators, n_fit, random_state=42):
+    """
+    Worker: fit one forest on the first n_fit memory-mapped training rows and score it on the rest
+    (the 2024 validation rows). The 2025 test set is never read here, so it cannot steer the search.
+    Only file paths and parameters are pickled to the worker, never the feature matrices.
+    """
+    X_train = np.load(paths['X_train'], mmap_mode='r')
+    y_train_log = np.load(paths['y_train_log'], mmap_mode='r')
+
+    start = time.perf_counter()
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=1, **params)
+    model.fit(X_train[:n_fit], y_train_log[:n_fit])
+    predictions_real = np.expm1(model.predict(X_train[n_fit:]))
+    y_val_real = np.expm1(y_train_log[n_fit:])
+    wall_time = time.perf_counter() - start
+
+    peak_rss = peak_rss_mb()
+    return {'params': params, 'n_estimators': n_estimators, 'wall_time_s': round(wall_time, 3),
+        'peak_rss_mb': round(peak_rss, 1) if peak_rss is not None else None,
+        'val_mae': float(mean_absolute_error(y_val_real, predictions_real)),
+        'val_r2': float(r2_score(y_val_real, predictions_real))}
+
+
+def score_on_test(paths, params, n_estimators, random_state=42):
+    """Worker: refit the chosen configuration on all training rows and score it once on the test set."""
+    X_train = np.load(paths['X_train'], mmap_mode='r')
+    y_train_log = np.load(paths['y_train_log'], mmap_mode='r')
+    X_test = np.load(paths['X_test'], mmap_mode='r')
+    y_test_real = np.load(paths['y_test_real'], mmap_mode='r')
+
+    model = RandomForestRegressor(n_estimators=n_estimators, random_state=random_state, n_jobs=1, **params)
+    model.fit(X_train, y_train_log)
+    predictions_real = np.expm1(model.predict(X_test))
+    return {'params': params, 'n_estimators': n_estimators,
+        'mae': float(mean_absolute_error(y_test_real, predictions_real)),
+        'r2': float(r2_score(y_test_real, predictions_real))}
+
+
+def successive_halving(paths, candidates, n_fit, min_estimators=10, max_estimators=100, factor=3, n_workers=None,
+        results_path='tuning_results.jsonl'):
+    """
+    Parallel successive halving over forest configurations:
+    - Every candidate starts with min_estimators trees; each round keeps the best 1/factor by validation MAE
+      (training rows from n_fit on) and multiplies the tree budget by factor, until max_estimators is reached
+      or one candidate is left
+    - Trials fan out over a process pool (one fresh process per trial so peak RSS is per trial)
+    - Every trial is appended to results_path as one JSON line
+    Returns the best trial of the final round.
+    """
+    n_workers = n_workers or os.cpu_count()
+    n_estimators = min_estimators
+    round_no = 0
+
+    # 'spawn' is required for max_tasks_per_child; workers only receive paths, so start-up stays cheap
+    context = multiprocessing.get_context('spawn')
+    with open(results_path, 'a') as log, ProcessPoolExecutor(max_workers=n_workers, mp_context=context,
+            max_tasks_per_child=1) as pool:
+        while True:
+            round_no += 1
+            print(f"Round {round_no}: {len(candidates)} candidate(s) x {n_estimators} trees on {n_workers} workers")
+            start = time.perf_counter()
+            futures = [pool.submit(run_trial, paths, params, n_estimators, n_fit) for params in candidates]
+            trials = [f.result() for f in futures]
+
+            for trial in trials:
+                trial['round'] = round_no
+                log.write(json.dumps(trial) + '\n')
+            log.flush()
+
+            trials.sort(key=lambda t: t['val_mae'])
+            best = trials[0]
+            print(f"  best validation MAE £{best['val_mae']:.2f} (R2 {best['val_r2']:.4f}) {best['params']} "
+                f"- round took {time.perf_counter() - start:.1f}s")
+
+            if len(trials) == 1 or n_estimators >= max_estimators:
+                return best
+            keep = max(1, len(trials) // factor)
+            candidates = [t['params'] for t in trials[:keep]]
+            n_estimators = min(n_estimators * factor, max_estimators)
+
+
+def expand_grid(grid):
+    keys = list(grid)
+    return [dict(zip(keys, values)) for values in itertools.product(*(grid[k] for k in keys))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Parallel successive-halving search for the V3.1 Random Forest.')
+    parser.add_argument('--train', default='train_features_v2_1.parquet')
+    parser.add_argument('--test', default='test_features_v2_1.parquet')
+    parser.add_argument('--min-estimators', type=int, default=10)
+    parser.add_argument('--max-estimators', type=int, default=100)
+    parser.add_argument('--factor', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--results', default='tuning_results.jsonl')
+    parser.add_argument('--val-fraction', type=float, default=0.2, help='Share of 2024 rows held out for ranking')
+    args = parser.parse_args()
+
+    # 1. Load the V2.1 feature sets once in the parent process
+    X_train, y_train, X_test, y_test, _ = load_aligned_matrices(args.train, args.test)
+    # Validation rows go last, so workers fit on X_train[:n_fit] and rank on X_train[n_fit:] without copies
+    order, n_fit = validation_split(len(X_train), args.val_fraction)
+    arrays = {'X_train': X_train[order], 'y_train_log': np.log1p(y_train[order]), 'X_test': X_test,
+        'y_test_real': y_test}
+    del X_train, X_test
+
+    # 2. Share them with the workers through memory-mapped .npy files
+    with tempfile.TemporaryDirectory(prefix='tune_rf_') as shared_dir:
+        paths = share_arrays(arrays, shared_dir)
+        del arrays
+
+        candidates = expand_grid(DEFAULT_GRID)
+        best = successive_halving(paths, candidates, n_fit, args.min_estimators, args.max_estimators, args.factor,
+            args.workers, args.results)
+
+        # 3. The winner alone is refitted on all 2024 rows and scored once on 2025
+        context = multiprocessing.get_context('spawn')
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            test = pool.submit(score_on_test, paths, best['params'], best['n_estimators']).result()
+        with open(args.results, 'a') as log:
+            log.write(json.dumps(dict(test, round='test')) + '\n')
+
+    print("-" * 30)
+    print(f"Best configuration: {best['params']} with {best['n_estimators']} trees")
+    print(f"Validation MAE: £{best['val_mae']:.2f} (R2 {best['val_r2']:.4f})")
+    print(f"Test Average Error (MAE): £{test['mae']:.2f}")
+    print(f"Test Model Reliability (R2): {test['r2']:.4f}")
+    print(f"All trials logged to {args.results}")
\ No newline at end of file
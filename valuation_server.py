@@ -0,0 +1,185 @@
+import argparse
+import json
+import queue
+import threading
+import time
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pandas as pd
+
+from feature_engineering_v2_1 import V2_1_INPUT_COLUMNS
+from model_artifact import ModelArtifact
+from prediction_table import load_or_build_table
+
+
+class _PendingQuote:
+    # One queued property waiting for its batch to be scored
+    def __init__(self, row):
+        self.row = row
+        self.enqueued = time.perf_counter()
+        self.done = threading.Event()
+        self.price = None
+        self.error = None
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-property quotes into small vectorized batches:
+    - Request threads enqueue a row and wait
+    - One worker thread takes the first waiting row, keeps collecting for up to window_ms (or max_batch rows),
+      then scores the whole batch with a single predictor.predict call
+    Keeps rolling latency samples and queue-depth stats for /metrics.
+    """
+
+    def __init__(self, predictor, window_ms=2.0, max_batch=256, latency_samples=10000):
+        self.predictor = predictor
+        self.window = window_ms / 1000.0
+        self.max_batch = max_batch
+        self.queue = queue.Queue()
+        self.latencies = deque(maxlen=latency_samples)
+        self.batch_sizes = deque(maxlen=latency_samples)
+        self.max_queue_depth = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def quote(self, row, timeout=10.0):
+        pending = _PendingQuote(row)
+        self.queue.put(pending)
+        with self.lock:
+            self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        if not pending.done.wait(timeout):
+            raise TimeoutError('Quote timed out')
+        if pending.error is not None:
+            raise pending.error
+        return pending.price
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.perf_counter() + self.window
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                frame = pd.DataFrame([p.row for p in batch], columns=V2_1_INPUT_COLUMNS)
+                prices = self.predictor.predict(frame)
+                for pending, price in zip(batch, prices):
+                    pending.price = float(price)
+            except Exception as e:  # Report the failure to every waiting request instead of killing the worker
+                for pending in batch:
+                    pending.error = e
+
+            finished = time.perf_counter()
+            with self.lock:
+                self.requests += len(batch)
+                self.batch_sizes.append(len(batch))
+                self.latencies.extend(finished - p.enqueued for p in batch)
+            for pending in batch:
+                pending.done.set()
+
+    def metrics(self):
+        with self.lock:
+            latencies_ms = np.array(self.latencies) * 1000.0
+            batch_sizes = np.array(self.batch_sizes)
+            stats = {'requests': self.requests, 'queue_depth': self.queue.qsize(),
+                'max_queue_depth': self.max_queue_depth, 'batches': len(batch_sizes)}
+        if len(latencies_ms):
+            stats['latency_p50_ms'] = round(float(np.percentile(latencies_ms, 50)), 3)
+            stats['latency_p99_ms'] = round(float(np.percentile(latencies_ms, 99)), 3)
+            stats['mean_batch_size'] = round(float(batch_sizes.mean()), 2)
+        return stats
+
+
+class ValuationServer(ThreadingHTTPServer):
+    # Larger listen backlog so bursts of concurrent clients are queued instead of reset
+    request_queue_size = 1024
+    daemon_threads = True
+
+
+class ValuationHandler(BaseHTTPRequestHandler):
+    # Set by serve(); shared by all handler threads
+    batcher = None
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/metrics':
+            self._send_json(200, self.batcher.metrics())
+        elif self.path == '/health':
+            self._send_json(200, {'status': 'ok'})
+        else:
+            self._send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if self.path != '/predict':
+            self._send_json(404, {'error': 'not found'})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length))
+            row = [request['postcode'], request['Type'], request['Old_New'], request['Duration']]
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': f'expected JSON with postcode, Type, Old_New, Duration ({e})'})
+            return
+
+        try:
+            price = self.batcher.quote(row)
+        except Exception as e:
+            self._send_json(500, {'error': str(e)})
+            return
+        self._send_json(200, {'predicted_price': round(price, 2)})
+
+    def log_message(self, format, *args):
+        # Keep load tests quiet; use /metrics instead of per-request access logs
+        pass
+
+
+def serve(artifact_path='model_v3_1.joblib', host='127.0.0.1', port=8000, window_ms=2.0, max_batch=256,
+        use_table=False):
+    """
+    Long-running local valuation service: load the V3.1 artifact once and micro-batch incoming quotes.
+    use_table=True answers each batch from the precomputed prediction table instead of the forest.
+    """
+    predictor = load_or_build_table(artifact_path) if use_table else ModelArtifact.load(artifact_path)
+    ValuationHandler.batcher = MicroBatcher(predictor, window_ms=window_ms, max_batch=max_batch)
+
+    server = ValuationServer((host, port), ValuationHandler)
+    print(f"Serving {artifact_path} on http://{host}:{port} (POST /predict, GET /metrics)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print("Shutting down...")
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Local V3.1 valuation server with request micro-batching.')
+    parser.add_argument('--artifact', default='model_v3_1.joblib')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--window-ms', type=float, default=2.0, help='How long to wait to fill a batch')
+    parser.add_argument('--max-batch', type=int, default=256)
+    parser.add_argument('--use-table', action='store_true', help='Answer from the precomputed prediction table')
+    args = parser.parse_args()
+
+    serve(args.artifact, args.host, args.port, args.window_ms, args.max_batch, args.use_table)
\ No newline at end of file